@@ -1,40 +1,162 @@
 
 import sys
+import threading
 from os import getenv, path
 from dotenv import load_dotenv
 load_dotenv()
-from datetime import date
+from datetime import date, timedelta
 import pandas as pd
-from dash import ctx, dcc, Dash, html, Input, Output, State
-import dash_ag_grid as dag
-import dash_leaflet as dl
+from dash import ctx, dcc, Dash, html, Input, Output, State, Patch, no_update, MATCH, ALL, ClientsideFunction
 import dash_bootstrap_components as dbc
+from dash_extensions import EventSource
 from dash_bootstrap_components import Table as dbcTable
 from dash_template_rendering import TemplateRenderer, render_dash_template_string
 
 
 import lib.pws_components as pwsc
-from lib.pws_components import * 
 from lib.pwsapi import get_all_stations, get_station_data
-from lib.pws_map import station_map, station_marker_id, station_from_marker_id
+from lib.pws_map import station_map, station_map_data, StationIndex, MAP_ALL_STATIONS_MAX, station_layer_id, station_from_marker_id
+from lib.station_registry import StationRegistry
+from lib.latest_poller import LatestReadingsPoller
 from lib.converters import degree2compass, kph2mph, c2f, mm2inch
+from lib.timeseries_viz import relayout_x_range, FIGURE_POINT_BUDGET
 
 #### CONFIG AND APP SETUP
 bs53css = "https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css"
 APP_PATH =  path.abspath(path.dirname(__file__))
-app = Dash(__name__, prevent_initial_callbacks=True,  external_stylesheets= [bs53css])  
+# callbacks use components that are made by other callbacks (the readings table, 
+# the weather graph), so they can't all be checked against the first layout.
+# use_async lets callbacks that make several API calls be 'async def' and await them together
+from lib import CACHE_DIR, CACHE_BACKEND, CACHE_REDIS_URL
+
+# the model runs are background callbacks: each runs in its own process, with its
+# progress and result kept in a disk cache that the page polls, so a slow RM-API 
+# response does not hold a server thread or a request through the proxy
+import diskcache
+from dash import DiskcacheManager
+background_callback_manager = DiskcacheManager(diskcache.Cache(path.join(CACHE_DIR, 'background-callbacks')))
+
+app = Dash(__name__, prevent_initial_callbacks=True, suppress_callback_exceptions=True, use_async=True, 
+           background_callback_manager=background_callback_manager, external_stylesheets= [bs53css])  
 
 from flask_caching import Cache
-cache = Cache(app.server, config={
-    'CACHE_TYPE': 'filesystem',
-    'CACHE_DIR': getenv('DASH_CACHE', path.join(APP_PATH, 'cache-directory'))
-})
+if CACHE_BACKEND == 'redis':
+    cache = Cache(app.server, config={'CACHE_TYPE': 'RedisCache', 'CACHE_REDIS_URL': CACHE_REDIS_URL})
+else:
+    cache = Cache(app.server, config={
+        'CACHE_TYPE': 'FileSystemCache',
+        'CACHE_DIR': getenv('DASH_CACHE', path.join(APP_PATH, 'cache-directory'))
+    })
 TIMEOUT:int = 60 # seconds
 
-@cache.memoize(timeout=TIMEOUT)
-def station_records()->list:
-    return(get_all_stations())
-
+# the station list starts from the snapshot saved by the last run (if any) and
+# is loaded from the API in the background, so the server starts without waiting 
+# for the API.  Open pages pick up changes from the registry on the interval timer
+station_registry = StationRegistry(loader=get_all_stations)
+station_registry.load_snapshot()
+
+def station_records()->dict:
+    # without a snapshot, the first request waits for the first load
+    return(station_registry.ensure_loaded())
+
+# latest readings of the stations open pages are watching, polled on one 
+# schedule for all pages and pushed to them, see /events/latest
+latest_poller = LatestReadingsPoller()
+
+def start_background_threads(worker_process:bool = False):
+    """start the station registry refresh and the latest readings poller. 
+
+    Args:
+        worker_process (bool, optional): True in each worker process of a multi-process 
+            server (see gunicorn.conf.py), where the workers take turns loading the stations 
+            and share them through the snapshot file. Defaults to False, this process loads them
+    """
+    if worker_process:
+        station_registry.share_with_processes()
+    else:
+        station_registry.start(refresh_first=True)
+    latest_poller.start()
+
+# threads don't survive a fork, so a server that forks worker processes
+# sets this to False and starts them in each worker, see gunicorn.conf.py 
+if getenv('START_THREADS_ON_IMPORT', 'True').lower() in ('true', '1', 'yes'):
+    start_background_threads()
+
+# spatial index of the stations for the map, made again when the registry changes
+_station_index = {'version': None, 'index': None}
+
+def station_index()->StationIndex:
+    if _station_index['version'] != station_registry.version:
+        _station_index['index'] = StationIndex(station_records())
+        _station_index['version'] = station_registry.version
+    return(_station_index['index'])
+
+
+
+## cache and API counters, for monitoring
+@app.server.route("/stats")
+def stats():
+    from flask import jsonify
+    from lib.tiered_cache import cache_stats
+    from lib.http_client import latency_stats
+    from lib.ewx_api import model_run_flights
+    return(jsonify({
+        "caches": cache_stats(),
+        "http": latency_stats(),
+        "model_runs": model_run_flights.stats(),
+        "station_registry_version": station_registry.version,
+        "latest_poller": latest_poller.stats(),
+    }))
+
+
+## latest readings pushed to the page as server-sent events
+# the page opens /events/latest?station=<code> for the selected station and gets
+# the latest reading as JSON (once there is one), then each new reading the poller finds.  
+# Each open page holds one connection (and one server thread) while it is open, 
+# so a process serves at most SSE_MAX_STREAMS of them, to leave threads for the 
+# callbacks.  Pages past that get the latest reading on the interval timer instead
+SSE_KEEPALIVE_SECONDS:int = int(getenv('SSE_KEEPALIVE_SECONDS', 30))
+SSE_MAX_STREAMS:int = int(getenv('SSE_MAX_STREAMS', int(getenv('GUNICORN_THREADS', 32))//2))
+_sse_streams = threading.BoundedSemaphore(SSE_MAX_STREAMS) if SSE_MAX_STREAMS > 0 else None
+
+@app.server.route("/events/latest")
+def latest_readings_events():
+    import json
+    from flask import request, Response, stream_with_context
+    station_code = request.args.get('station', '')
+    if station_code not in station_records():
+        # no content tells the browser not to reconnect
+        return(Response(status=204))
+    if _sse_streams is None or not _sse_streams.acquire(blocking=False):
+        # all streams in use, the page falls back to the interval timer
+        return(Response(status=204))
+    
+    def events():
+        latest_poller.subscribe(station_code)
+        try:
+            version, reading = latest_poller.latest(station_code)
+            # version 0 is no reading yet (the first poll failed), wait for one
+            if version > 0:
+                yield f"data: {json.dumps(reading)}\n\n"
+            while True:
+                new_version, reading = latest_poller.wait_for_change(station_code, version, timeout = SSE_KEEPALIVE_SECONDS)
+                if latest_poller.stopped:
+                    # the browser reconnects, to a server whose poller is running
+                    return
+                if new_version == version:
+                    # comment line so proxies don't close an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                version = new_version
+                yield f"data: {json.dumps(reading)}\n\n"
+        finally:
+            latest_poller.unsubscribe(station_code)
+    
+    response = Response(stream_with_context(events()), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # the server closes the response when the page goes away, or if it never sent it
+    response.call_on_close(_sse_streams.release)
+    return(response)
 
 
 #### PAGE LAYOUT
@@ -59,16 +181,21 @@ def get_template(template_file, template_dir:str = TEMPLATES_DIR)->str:
 body_with_class_for_template = '<body class="layout-fluid">'
 app.index_string = app.index_string.replace('<body>', body_with_class_for_template)
 
-# render the jinja template using template file    
-app.layout =  render_dash_template_string(get_template(template_file = "main.html"),
+# render the jinja template using template file.  The layout is a function so 
+# it is made for each page load with the current stations, not when the app starts
+def serve_layout():
+    stations = station_records()
+    # read after the stations are loaded, the first page load would otherwise get version 0
+    registry_version = station_registry.version
+    return(render_dash_template_string(get_template(template_file = "main.html"),
     interval_component = dcc.Interval(
             id='interval-component',
             interval= 5*60*1000, # 5 minutes in milliseconds
             n_intervals=1
         ),
-    station_table = pwsc.station_table_narrow(station_records()),
-    station_map = station_map(station_records()),
-    hourly_weather_form = hourly_weather_form(),
+    station_table = pwsc.station_table_narrow(stations),
+    station_map = station_map(stations),
+    hourly_weather_form = pwsc.hourly_weather_form(),
     weather_viz = dcc.Loading(html.Div(id = "weather-summary-viz", className="mt-3 p-1")),
     tomcast_form = pwsc.tomcast_form(), 
     tomcast_results = dcc.Loading(html.Div(id="tomcast-results", className="mt-3 p-1")),
@@ -77,17 +204,31 @@ app.layout =  render_dash_template_string(get_template(template_file = "main.htm
     applescab_form = pwsc.applescab_form(), 
     applescab_results = dcc.Loading(html.Div(id="applescab-results", className="mt-3 p-1")),
     counter_debug  = html.Span("0", id = "counter-debug"),
-  )
+    station_registry_version = dcc.Store(id="station-registry-version", data=registry_version),
+    station_context = dcc.Store(id="station-context"),
+    station_selection = dcc.Store(id="station-selection"),
+    hourly_table_shown = dcc.Store(id="hourly-table-shown"),
+    latest_readings_events = EventSource(id="latest-readings-events", url=app.get_relative_path("/events/latest")),
+  ))
+
+app.layout = serve_layout
 
 
 #### REACTIVITY #####
+# Callbacks that only move values around the page (the selected station code,
+# showing the forms, clearing results, setting the date pickers) are clientside
+# callbacks in assets/station_selection.js and cost no request to the server.
+# Callbacks that call the PWS API or the RM-API, or read the station registry
+# and caches, are serverside callbacks below.  Keep new callbacks that do no 
+# I/O clientside so a row click does not queue on the server workers.
     
 ## table row click, stores the station code of the selected row in an
 # element on the html page, that is read by several other components.  
 # this is helpful so the 'selected_row' doesn't have to be sent 
 # and this component can be used as a state value
 # This callback is not affected by the page time, only table row click
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="station_selection", function_name="station_table_row_data"),
     [
         Output("text_station_table_selection", "children"),
         Output("text_station_table_selection", "href"),
@@ -97,111 +238,228 @@ app.layout =  render_dash_template_string(get_template(template_file = "main.htm
     [Input("station_table", "selectedRows")],
     prevent_initial_call=True,
 )
-def station_table_row_data(row  )->tuple[str,str,str,str]:
-    if row is None or row == []:
-        return ("","", "", "") 
+
+
+### station context
+# one callback loads everything shown for the selected station (registry record,
+# latest reading, today's hourly readings, the weather summary) at once, into
+# the station-context store.  The latest weather, the hourly table and the 
+# weather graph are drawn from the store, so a row click calls each API once.
+# On the timer the store is patched with just the new reading and new hours, 
+# and station-selection only changes when a different station or day is shown.
+# The API calls for the context are made at the same time, see pwsc.station_context_async
+@app.callback(
+    Output("station-context", "data"),
+    Output("station-selection", "data"),
+    [
+        Input("station_table", "selectedRows"),
+        Input('interval-component', 'n_intervals')
+    ],
+    State("station-context", "data"),
+    prevent_initial_call=True,
+)
+async def load_station_context(row, n, context):
+    if isinstance(row,list): row = row[0] if row else None
+    if not (isinstance(row, dict) and 'station_code' in row):
+        return({}, {})
     
-    # we got a list but just want one, so pick
-    if isinstance(row,list): row = row[0]
+    station_code = row['station_code']
+    if ctx.triggered_id == 'interval-component' and context and context.get('station_code') == station_code:
+        new_context = await pwsc.station_context_async(station_code, station_records().get(station_code), include_summary = False)
+        if new_context['date'] == context.get('date'):
+            return(pwsc.station_context_patch(context, new_context), no_update)
     
-    if isinstance(row, dict) and 'station_code' in row:
-        station_code = row['station_code']
-        station_type = row['type']
-            
-    else:
-        station_code = ""
-        station_type = ""
-        
-    return (station_code, station_code, station_type,  "")
-    #except Exception as e:
-    #    return ("","", e)
+    context = await pwsc.station_context_async(station_code, station_records().get(station_code))
+    return(context, {'station_code': station_code, 'date': context['date']})
+
+
+### latest weather stats from selected station
+# connect to the latest readings events of the selected station
+app.clientside_callback(
+    ClientsideFunction(namespace="station_selection", function_name="latest_events_url"),
+    Output("latest-readings-events", "url"),
+    Input("station_table", "selectedRows"),
+    State("latest-readings-events", "url"),
+    prevent_initial_call=True,
+)
 
+# the cards show the reading loaded with the station context, then the 
+# readings pushed by the poller
+LATEST_WEATHER_CARDS = ["latest_reading_date_cell", "latest-atmp", "latest-pcpn", "latest-relh", 
+                        "latest-wspd", "latest-wdir", "latest-lws"]
 
-### load latest weather stats from selected station
 @app.callback(
     [
-        Output("latest_reading_date_cell", "children"),
-        Output("latest-atmp", "children"),
-        Output("latest-pcpn", "children"),
-        Output("latest-relh", "children"),
-        Output("latest-wspd", "children"),
-        Output("latest-wdir", "children"),
-        Output("latest-lws", "children"),
+        *[Output(card, "children") for card in LATEST_WEATHER_CARDS],
         Output("counter-debug", "children"),         
     ],
-    [
-        Input("station_table", "selectedRows"),
-        Input('interval-component', 'n_intervals')
-    ],
+    Input("station-context", "data"),
+    Input("latest-readings-events", "message"),
+    State('interval-component', 'n_intervals'),
+    [State(card, "children") for card in LATEST_WEATHER_CARDS],
     prevent_initial_call=True,
 )
-def station_latest_weather(row, n):
+def station_latest_weather(context, message, n, *showing):
+    """latest weather cards, only the cards whose value changed are sent"""
+    values = latest_weather_values(context, message, n)
+    if values is no_update:
+        return(no_update)
+    return(tuple(no_update if value == shown else value 
+                 for value, shown in zip(values, list(showing) + [None])))
+
+
+def latest_weather_values(context, message, n):
     
+    import json
     from datetime import datetime
     
-    if not row:
+    if not context:
         return ("","--","--","--","--", "", "--", n)
     
-    if isinstance(row,list): row = row[0]
-
-    if isinstance(row, dict) and 'station_code' in row:        
-        latest_reading = latest_readings_values(row['station_code'])
-        if isinstance(latest_reading, dict) and 'atmp' in latest_reading: 
-            latest_reading_dateime = datetime.fromisoformat(latest_reading['local_datetime'])
-            formatted_datetime = latest_reading_dateime.strftime("%I:%M %p %m-%d-%Y")
-            
-            atmp = round(c2f(latest_reading['atmp']),1) if latest_reading.get('atmp') or latest_reading.get('atmp') == 0 else "--"
-            pcpn = round(mm2inch(latest_reading['pcpn']),1) if latest_reading.get('pcpn') or latest_reading.get('pcpn') == 0 else "0"
-            relh = round(latest_reading['relh'],1) if latest_reading.get('relh') or latest_reading.get('relh') == 0 else "--"
-            wspd = round(kph2mph(latest_reading['wspd']),1) if latest_reading.get('wspd') or latest_reading.get('wspd') == 0 else "--"
-            wdir = degree2compass(latest_reading['wdir'])if latest_reading.get('wdir') else "--"
-            lws = latest_reading['lws'] if latest_reading.get('lws') or latest_reading.get('lws') == 0 else "--"
-            return (formatted_datetime,
-                    atmp,                             
-                    pcpn,
-                    relh,
-                    wspd,
-                    wdir,
-                    lws,
-                    n)        
-    return ("no recent readings","--","--","--","--", "",n)
-
+    latest_reading = context.get('latest')
+    if ctx.triggered_id == "latest-readings-events" and message:
+        latest_reading = pwsc.recent_reading(json.loads(message))
+        if latest_reading.get('station_code', context['station_code']) != context['station_code']:
+            return(no_update)
+    if isinstance(latest_reading, dict) and 'atmp' in latest_reading: 
+        latest_reading_dateime = datetime.fromisoformat(latest_reading['local_datetime'])
+        formatted_datetime = latest_reading_dateime.strftime("%I:%M %p %m-%d-%Y")
+        
+        atmp = round(c2f(latest_reading['atmp']),1) if latest_reading.get('atmp') or latest_reading.get('atmp') == 0 else "--"
+        pcpn = round(mm2inch(latest_reading['pcpn']),1) if latest_reading.get('pcpn') or latest_reading.get('pcpn') == 0 else "0"
+        relh = round(latest_reading['relh'],1) if latest_reading.get('relh') or latest_reading.get('relh') == 0 else "--"
+        wspd = round(kph2mph(latest_reading['wspd']),1) if latest_reading.get('wspd') or latest_reading.get('wspd') == 0 else "--"
+        wdir = degree2compass(latest_reading['wdir'])if latest_reading.get('wdir') else "--"
+        lws = latest_reading['lws'] if latest_reading.get('lws') or latest_reading.get('lws') == 0 else "--"
+        return (formatted_datetime,
+                atmp,                             
+                pcpn,
+                relh,
+                wspd,
+                wdir,
+                lws,
+                n)        
+    return ("no recent readings","--","--","--","--", "", "--", n)
+
+
+### station list updates
+# send only the stations that were added, removed or changed since the page 
+# was loaded, as row transactions to the table.
+# The table keeps its selection because rows are identified by station code
+@app.callback(
+    [
+        Output("station_table", "rowTransaction"),
+        Output("station_table", "rowData"),
+        Output(station_layer_id(), "data", allow_duplicate=True),
+        Output("station-registry-version", "data"),
+    ],
+    Input('interval-component', 'n_intervals'),
+    State("station-registry-version", "data"),
+    State("station_map", "bounds"),
+    prevent_initial_call=True,
+)
+def update_station_list(n, page_version, bounds):
+    changes = station_registry.changes_since(page_version or 0)
+    if changes['version'] == page_version:
+        return(no_update, no_update, no_update, no_update)
+    
+    stations = station_records()
+    markers = station_map_data(stations, bounds, station_index())
+    if changes.get('full'):
+        # page is too far behind to know what it has, so replace everything
+        return(no_update, pwsc.station_table_rows(stations), markers, changes['version'])
+        
+    added = {code: stations[code] for code in changes['add']}
+    updated = {code: stations[code] for code in changes['update']}
+    row_transaction = {
+        "add": pwsc.station_table_rows(added),
+        "update": pwsc.station_table_rows(updated),
+        "remove": [{"station_code": code} for code in changes['remove']],
+    }
+    return(row_transaction, no_update, markers, changes['version'])
+
+
+### map viewport
+# with many stations only those around the part of the map that is showing 
+# are sent, and sent again when the map is moved or zoomed.  
+# Up to MAP_ALL_STATIONS_MAX stations are all sent with the map and this does nothing
+@app.callback(
+    Output(station_layer_id(), "data"),
+    Input("station_map", "bounds"),
+    prevent_initial_call=True,
+)
+def station_map_viewport(bounds):
+    stations = station_records()
+    if len(stations) <= MAP_ALL_STATIONS_MAX or not bounds:
+        return(no_update)
+    return(station_map_data(stations, bounds, station_index()))
+        
 
 ### map marker click, which selects a table row
 # which then triggers the row selection. 
 # see Dash AG Grig docs for how sending a function can select a row
+# The input is the clicked feature of any station layer (pattern-matching id, 
+# see pws_map.station_layer_id) so the callback doesn't depend on which stations
+# there are, and stations added later are clickable too.
+# clicking a cluster of stations zooms the map instead, see pws_map.station_map
 @app.callback(
         Output("station_table", "selectedRows", allow_duplicate = True),
-        [Input(station_marker_id(station), 'n_clicks') for station in list(station_records().values())],
+        Input(station_layer_id(ALL), "clickData"),
         prevent_initial_call=True,
         )
-def display_marker_click(*args):
-    if not ctx.triggered_id:
-        return({})
-    else:
-        station_code = station_from_marker_id(ctx.triggered_id)
-        return({"function": f"params.data.station_code == '{station_code}'"})            
+def display_marker_click(_):
+    feature = ctx.triggered[0]['value'] if ctx.triggered else None
+    if not feature or feature.get('properties', {}).get('cluster'):
+        return(no_update)
+    
+    station_code = station_from_marker_id(feature)
+    if not station_code:
+        return(no_update)
+    return({"function": f"params.data.station_code == '{station_code}'"})            
 
 ##### weather line graph, currently only air temp
 @app.callback(
     Output("weather-summary-viz",'children'),
-    Input("text_station_table_selection", "children"),
+    Input("station-selection", "data"),
     prevent_initial_call=True,
 )
-def redraw_weather_viz(station_code):
-    if not station_code:
+def redraw_weather_viz(selection):
+    if not selection:
         return(dbc.Alert("select a station above", color="warning"))
     
-    return(dcc.Graph(figure=pwsc.weather_summary_viz(station_code),id='weather-graph'))
+    # the summary was pulled with the station context, so this reads it from the cache
+    station_code = selection['station_code']
+    return(dcc.Graph(figure=pwsc.weather_summary_viz(station_code, selection['date']),id='weather-graph'))
 
 
-#### DATE PICKERS
-## update all the date pickers when a station is selected to the users data. 
+# zooming the graph draws the visible dates again in full detail, 
+# long series are downsampled to a point budget, see lib/timeseries_viz.py.
+# A series within the budget is drawn in full already, and the browser zooms it
+@app.callback(
+    Output("weather-graph", "figure"),
+    Input("weather-graph", "relayoutData"),
+    State("station-selection", "data"),
+    prevent_initial_call=True,
+)
+def zoom_weather_viz(relayout_data, selection):
+    x_range = relayout_x_range(relayout_data)
+    if x_range is False or not selection:
+        return(no_update)
+    
+    station_code, select_date = selection['station_code'], selection['date']
+    weather_df = pwsc.weather_summary_frame(station_code, select_date)
+    if not isinstance(weather_df, pd.DataFrame) or len(weather_df) <= FIGURE_POINT_BUDGET:
+        return(no_update)
+    return(pwsc.weather_summary_viz(station_code, select_date, weather_df, x_range=x_range))
 
 
-@app.callback(
+#### DATE PICKERS
+## update all the date pickers when a station is selected to the users data. 
+# dates are today (and a week ago for the spray date) in Michigan time, 
+# computed in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace="station_selection", function_name="set_date_pickers"),
     Output("tomcast-date-picker", "date"),
-    # Output("tomcast-date-picker", "min_date_allowed"),
     Output("tomcast-date-picker", "max_date_allowed"),
     Output("tomcast-spray-date-picker", "date"),
     Output("tomcast-spray-date-picker", "max_date_allowed"),
@@ -211,38 +469,88 @@ def redraw_weather_viz(station_code):
     Output("weather-summary-date-picker", "date"),
     Input("station_table", "selectedRows"),
 )
-def set_tomcast_date_picker(_):
-    # THIS IS THE UTC DATE ON THE SERVER, not local date
-    today = datetime.now().date()
-    seven_days_ago_str =  days_ago(d=7).strftime("%Y-%m-%d")
-    max_date_allowed = today
-    return today, max_date_allowed, seven_days_ago_str, max_date_allowed, today, max_date_allowed, today, today
 
     
 
 ##### Hourly Weather table from the PWS API 
+# the table for today is drawn from the station context.  When the context gets
+# new hours on the timer they are added to the table as a row transaction,
+# the hours the table has are kept in the hourly-table-shown store
 @app.callback(
     Output("hourly_readings_table", "children", allow_duplicate=True),
+    Output("readings_table", "rowTransaction"),
+    Output("hourly-table-shown", "data"),
     [
         Input("hourly-weather-date-picker", "date"),
-        Input("text_station_table_selection", "children"),
-        Input('interval-component', 'n_intervals')
+        Input("hourly-weather-days", "value"),
+        Input("station-context", "data"),
     ],
+    State("hourly-table-shown", "data"),
     prevent_initial_call=True,
 )
-def redraw_hourly_weather_table(hourly_weather_date, station_code, n):
-    if not station_code:
-        return(dbc.Alert("select a station above", color="warning"))
+def redraw_hourly_weather_table(hourly_weather_date, days, context, shown):
+    table, row_transaction, shown = hourly_weather_table_update(hourly_weather_date, days, context, shown)
+    # the readings table is only there after a table was drawn, a missing output gets []
+    if ctx.outputs_list[1] == []:
+        row_transaction = []
+    return(table, row_transaction, shown)
+
+
+def hourly_weather_table_update(hourly_weather_date, days, context, shown):
+    """(table, row transaction, hours shown) for redraw_hourly_weather_table"""
+    if not context:
+        return(dbc.Alert("select a station above", color="warning"), no_update, {})
+    
+    station_code = context['station_code']
+    days = int(days or 1)
+    # today's readings come with the station context, other days are pulled 
+    if days == 1 and (hourly_weather_date or context['date']) == context['date']:
+        rows = context['hourly']
+        table_key = {'station_code': station_code, 'date': context['date']}
+        if (ctx.triggered_id == "station-context" and shown and shown.get('hours') and 
+                {k: shown.get(k) for k in table_key} == table_key):
+            new_rows = [row for row in rows if row['hour'] not in shown['hours']]
+            if not new_rows:
+                return(no_update, no_update, no_update)
+            # newest hours go at the top, as in hourly_readings_dataframe
+            new_rows = sorted(new_rows, key = lambda row: row['hour'], reverse = True)
+            return(no_update, 
+                   {"add": new_rows, "addIndex": 0}, 
+                   dict(table_key, hours = shown['hours'] + [row['hour'] for row in new_rows]))
+        
+        readings_table = pwsc.hourly_readings_table(station_code, for_date = context['date'], readings_df = pd.DataFrame(rows))
+        return(readings_table, no_update, dict(table_key, hours = [row['hour'] for row in rows]))
     
-    # for_date = date.fromisoformat(hourly_weather_date)
-    readings_table  = hourly_readings_table(station_code, for_date = hourly_weather_date)
-    return(readings_table)
+    if days == 1:
+        readings_table  = pwsc.hourly_readings_table(station_code, for_date = hourly_weather_date)
+        return(readings_table, no_update, {})
+    
+    # several days ending on the picked date
+    end_date = date.fromisoformat(hourly_weather_date or context['date'])
+    for_date = end_date - timedelta(days = days - 1)
+    readings_table  = pwsc.hourly_readings_table(station_code, for_date = str(for_date), end_date = str(end_date))
+    return(readings_table, no_update, {})
+
+
+##### Paged grids
+# grids made with pwsc.paged_grid ask for the rows they show, and get a sorted 
+# slice of the cached data frame named in their id
+@app.callback(
+    Output({"type": "paged-grid", "kind": MATCH, "station_code": MATCH, "dates": MATCH}, "getRowsResponse"),
+    Input({"type": "paged-grid", "kind": MATCH, "station_code": MATCH, "dates": MATCH}, "getRowsRequest"),
+    prevent_initial_call=True,
+)
+def serve_paged_grid_rows(request):
+    if not request:
+        return(no_update)
+    return(pwsc.paged_grid_rows(ctx.triggered_id, request))
 
 
 ###### MODEL FORMS AND OUTPUTS
 
 ## turn on/off model output and forms as stations are selected
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="station_selection", function_name="display_form_on_select"),
     [
         Output('data_section', 'style'), 
         Output('no_station_message', 'style')
@@ -250,34 +558,46 @@ def redraw_hourly_weather_table(hourly_weather_date, station_code, n):
     Input("station_table", "selectedRows"),
     prevent_initial_call=True,
 )
-def display_form_on_select(row):    
-    style_to_hide_model_form = ({'display': 'none'},{'display': 'inline'})
-    style_to_show_model_form = ({"diplay":"inline"},{'display': 'none'})
-    
-    if row is None or row == []:
-        return (style_to_hide_model_form) 
-    if isinstance(row,list): row = row[0]
-    if isinstance(row, dict) and 'station_code' in row:
-        station_code = row['station_code']
-    else:
-        station_code = ""
-    
-    if station_code:            
-        return (style_to_show_model_form ) 
-    else:
-        return(style_to_hide_model_form )
     
 
+## model runs
+# while a model runs, its loading message shows how long it has been waiting on the 
+# RM-API.  Clicking the button again starts a new run and cancels the one in progress 
+# (the page sends the old job with the new one), and selecting another station cancels it
+def run_with_progress(set_progress, message:str, fn, *args):
+    """call fn(*args) in a thread, and show message and the seconds waited so far 
+    with set_progress every second until it returns
+
+    Args:
+        set_progress (callable): from a background callback with one progress output
+        message (str): what is running, e.g. "running Tomcast for EWXDAVIS01"
+        fn (callable): function to call
+        args: passed to fn
+
+    Returns:
+        the return value of fn
+    """
+    from concurrent.futures import ThreadPoolExecutor, TimeoutError
+    from time import perf_counter
+    start = perf_counter()
+    set_progress(f"{message}...")
+    with ThreadPoolExecutor(max_workers = 1) as executor:
+        future = executor.submit(fn, *args)
+        while True:
+            try:
+                return(future.result(timeout = 1))
+            except TimeoutError:
+                set_progress(f"{message}, waiting {perf_counter() - start:.0f} s")
+
+
 ##### WEATHER SUMMARY model
 # clear the weather summary table when new station is selected
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace="station_selection", function_name="clear_weather_summary_table"),
     Output('weather-summary-table', 'children',allow_duplicate=True),
     Input("station_table", "selectedRows"),
     prevent_initial_call=True,
 )
-def clear_weather_summary_table(row):
-    # TODO - check if the row selected is actually different first!
-    return("")
 
 # submit click 
 @app.callback(
@@ -285,9 +605,12 @@ def clear_weather_summary_table(row):
     [Input('run-weather-summary-button','n_clicks'),],
     State("text_station_table_selection", "children"),
     State("weather-summary-date-picker", "date"),
+    background=True,
+    progress=Output("weather_summary_loading_message", "children"),
+    cancel=Input("station_table", "selectedRows"),
     prevent_initial_call=True,
     )
-def weather_summary(n_clicks, station_code, select_date):
+def weather_summary(set_progress, n_clicks, station_code, select_date):
     # input checking 
     if not station_code:
         return(dbc.Alert("select a station above", color="error"))
@@ -296,7 +619,8 @@ def weather_summary(n_clicks, station_code, select_date):
         return(dbc.Alert("select a date and click 'run'"))
     
     # run model and format output
-    weather_summary_grid = pwsc.weather_summary_table(station_code, select_date)
+    weather_summary_grid = run_with_progress(set_progress, f"calculating the weather summary for {station_code}", 
+                                             pwsc.weather_summary_table, station_code, select_date)
     return(weather_summary_grid)
 
 
@@ -308,9 +632,12 @@ def weather_summary(n_clicks, station_code, select_date):
     State("text_station_table_selection", "children"),
     State("tomcast-date-picker", "date"),
     State("tomcast-spray-date-picker", "date"),
+    background=True,
+    progress=Output("tomcast_loading_message", "children"),
+    cancel=Input("station_table", "selectedRows"),
     prevent_initial_call=True,
     )
-def tomcast(n_clicks, station_code, select_date, date_start_accumulation):
+def tomcast(set_progress, n_clicks, station_code, select_date, date_start_accumulation):
     # input checking 
     if not station_code:
         return dbc.Alert("select a station above", color="error")
@@ -319,7 +646,8 @@ def tomcast(n_clicks, station_code, select_date, date_start_accumulation):
         return dbc.Alert("select a date, optional spray date, and click 'run tomcast'")
     
     # run model and format output
-    return tomcast_model(station_code, select_date,date_start_accumulation)
+    return run_with_progress(set_progress, f"running Tomcast for {station_code}", 
+                             pwsc.tomcast_model, station_code, select_date, date_start_accumulation)
 
 
 
@@ -331,9 +659,12 @@ def tomcast(n_clicks, station_code, select_date, date_start_accumulation):
     State("text_station_table_selection", "children"),
     State("applescab-date-picker", "date"),
     State("applescab-greentip-date-picker", "date"),
+    background=True,
+    progress=Output("applescab_loading_message", "children"),
+    cancel=Input("station_table", "selectedRows"),
     prevent_initial_call=True,
     )
-def run_applescab(n_clicks, station_code, select_date, gt_start):
+def run_applescab(set_progress, n_clicks, station_code, select_date, gt_start):
     # input checking 
     if not station_code:
         return dbc.Alert("select a station above", color="error")
@@ -342,7 +673,8 @@ def run_applescab(n_clicks, station_code, select_date, gt_start):
         return dbc.Alert("select a date, optional green tip date, and click 'run'")
     
     # run model and format output
-    model_table = pwsc.applescab_model(station_code, select_date, gt_start)
+    model_table = run_with_progress(set_progress, f"running Apple Scab for {station_code}", 
+                                    pwsc.applescab_model, station_code, select_date, gt_start)
     return(model_table)
                 
 if __name__ == "__main__":
@@ -0,0 +1,64 @@
+/* station_selection.js: clientside callbacks for the station table selection
+ *
+ * These only move values from the selected row into the page and do no I/O,
+ * so they run in the browser instead of a round trip to the server.
+ * Registered in app.py with ClientsideFunction("station_selection", <name>)
+ */
+
+// same time zone as converters.MICHIGAN_TIME_ZONE_KEY, dates are Michigan dates
+const STATION_TIME_ZONE = "America/Detroit";
+
+// YYYY-MM-DD of the date some days ago in the station time zone
+function local_date_str(days_ago) {
+    const d = new Date(Date.now() - (days_ago || 0) * 24 * 60 * 60 * 1000);
+    // en-CA formats dates as YYYY-MM-DD
+    return new Intl.DateTimeFormat("en-CA", {timeZone: STATION_TIME_ZONE}).format(d);
+}
+
+// first selected row of the station table, or null
+function selected_station(rows) {
+    if (!rows) { return null; }
+    const row = Array.isArray(rows) ? rows[0] : rows;
+    if (row && typeof row === "object" && row.station_code) { return row; }
+    return null;
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    station_selection: {
+
+        // station code, link and type of the selected row, and clear the tomcast results
+        station_table_row_data: function(rows) {
+            const row = selected_station(rows);
+            if (!row) { return ["", "", "", ""]; }
+            return [row.station_code, row.station_code, row.type || "", ""];
+        },
+
+        // show the model forms once a station is selected
+        display_form_on_select: function(rows) {
+            if (selected_station(rows)) {
+                return [{}, {"display": "none"}];
+            }
+            return [{"display": "none"}, {"display": "inline"}];
+        },
+
+        // clear the weather summary table when a new station is selected
+        clear_weather_summary_table: function(rows) {
+            return "";
+        },
+
+        // latest readings events url for the selected station, see /events/latest in app.py
+        latest_events_url: function(rows, url) {
+            const base = (url || "").split("?")[0];
+            const row = selected_station(rows);
+            if (!row) { return base; }
+            return base + "?station=" + encodeURIComponent(row.station_code);
+        },
+
+        // set all the date pickers to today, and the spray date to a week ago
+        set_date_pickers: function(rows) {
+            const today = local_date_str(0);
+            const seven_days_ago = local_date_str(7);
+            return [today, today, seven_days_ago, today, today, today, today, today];
+        }
+    }
+});
@@ -0,0 +1,65 @@
+""" bench_converters.py: compare the scalar and vectorized label converters
+
+Times degree2compass / hour_number2clock_str applied per element with Series.map,
+as hourly_readings_dataframe used to, against degree2compass_array / 
+hour_number2clock_array, for one year of hourly rows (multi-day views) and 
+several years (data exports).
+
+run from the app root dir:  python bench/bench_converters.py
+"""
+
+import sys
+from os import path
+from timeit import repeat
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from lib.converters import degree2compass, degree2compass_array, hour_number2clock_str, hour_number2clock_array
+
+HOURS_PER_YEAR = 365*24
+
+
+def hourly_rows(years:int, seed:int = 42)->pd.DataFrame:
+    """fake hourly readings with wind direction (some missing) and hour numbers"""
+    rng = np.random.default_rng(seed)
+    n = years*HOURS_PER_YEAR
+    wdir = rng.uniform(0, 360, n)
+    wdir[rng.random(n) < 0.02] = np.nan
+    return(pd.DataFrame({
+        'represented_hour': np.tile(np.arange(1, 25), n//24),
+        'wdir_avg_hourly': wdir,
+    }))
+
+
+def best_of(fn, number:int = 3, repeats:int = 5)->float:
+    """best time of one call in seconds"""
+    return(min(repeat(fn, number=number, repeat=repeats))/number)
+
+
+def bench(years:int):
+    df = hourly_rows(years)
+    # scalar degree2compass fails on NaN, as the API gives None for missing values
+    wdir_scalar = df.wdir_avg_hourly.astype(object).where(df.wdir_avg_hourly.notna(), None)
+
+    results = {
+        'compass (map)': best_of(lambda: wdir_scalar.map(degree2compass)),
+        'compass (array)': best_of(lambda: degree2compass_array(df.wdir_avg_hourly)),
+        'clock (map)': best_of(lambda: df.represented_hour.map(hour_number2clock_str)),
+        'clock (array)': best_of(lambda: hour_number2clock_array(df.represented_hour)),
+    }
+    
+    assert list(wdir_scalar.map(degree2compass)) == list(degree2compass_array(df.wdir_avg_hourly))
+    assert list(df.represented_hour.map(hour_number2clock_str)) == list(hour_number2clock_array(df.represented_hour))
+    
+    print(f"\n{years} year(s), {len(df)} hourly rows")
+    for name, seconds in results.items():
+        print(f"  {name:18} {seconds*1000:9.2f} ms")
+    print(f"  compass speed-up   {results['compass (map)']/results['compass (array)']:9.1f}x")
+    print(f"  clock speed-up     {results['clock (map)']/results['clock (array)']:9.1f}x")
+
+
+if __name__ == "__main__":
+    for years in (1, 5):
+        bench(years)
@@ -0,0 +1,91 @@
+""" bench_startup.py: time from starting the app until it answers requests
+
+Starts `python app.py` in a new process, and measures how long until the
+server accepts a connection and until the first page and its layout are served.
+Also reports the import time of app.py and its heaviest imports, from
+python -X importtime.  The API URLs, DASH_CACHE etc. come from the environment
+(or .env) as for the app itself.  Run it twice to see a start with and without
+the station snapshot on disk (see STATION_SNAPSHOT_FILE).
+
+run from the app root dir:  python bench/bench_startup.py [runs]
+"""
+
+import socket
+import subprocess
+import sys
+import urllib.request
+from os import environ, path
+from time import perf_counter, sleep
+
+APP_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+HOST = '127.0.0.1'
+PORT = int(environ.get('BENCH_PORT', 8059))
+TIMEOUT = 120
+
+
+def wait_for_port(host:str, port:int, timeout:float = TIMEOUT)->bool:
+    """True once something accepts connections on host:port"""
+    end = perf_counter() + timeout
+    while perf_counter() < end:
+        try:
+            with socket.create_connection((host, port), timeout = 0.2):
+                return(True)
+        except OSError:
+            sleep(0.01)
+    return(False)
+
+
+def get(url:str)->int:
+    with urllib.request.urlopen(url, timeout = TIMEOUT) as r:
+        r.read()
+        return(r.status)
+
+
+def time_startup()->dict:
+    """seconds from process start to: port open, first page, first layout"""
+    env = dict(environ, HOST = HOST, PORT = str(PORT), DASH_DEBUG = 'False')
+    start = perf_counter()
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd = APP_DIR, env = env,
+                               stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    try:
+        times = {}
+        if not wait_for_port(HOST, PORT):
+            raise RuntimeError("app did not start")
+        times['accepts_connections'] = perf_counter() - start
+        get(f"http://{HOST}:{PORT}/")
+        times['first_page'] = perf_counter() - start
+        get(f"http://{HOST}:{PORT}/_dash-layout")
+        times['first_layout'] = perf_counter() - start
+        return(times)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def import_times(top:int = 8)->list:
+    """(seconds, module) of the slowest cumulative imports of app.py"""
+    r = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd = APP_DIR,
+                       capture_output = True, text = True, env = dict(environ, DASH_DEBUG = 'False'))
+    rows = []
+    for line in r.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        # only modules app.py imports itself, nested imports are counted in their parents
+        if module[:3] == '   ' and module[3] != ' ':
+            rows.append((int(cumulative)/1e6, module.strip()))
+    return(sorted(rows, reverse = True)[:top])
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+    print("slowest imports of app.py (cumulative seconds):")
+    for seconds, module in import_times():
+        print(f"  {seconds:7.3f}  {module}")
+
+    print(f"\nstartup, {runs} runs (seconds from process start):")
+    print(f"  {'accepts connections':>20} {'first page':>12} {'first layout':>13}")
+    for _ in range(runs):
+        t = time_startup()
+        print(f"  {t['accepts_connections']:20.3f} {t['first_page']:12.3f} {t['first_layout']:13.3f}")
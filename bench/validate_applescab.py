@@ -0,0 +1,132 @@
+""" validate_applescab.py: compare the local Apple Scab engine (lib/applescab.py) with the RM-API
+
+Recorded runs are JSON files with the station, dates, the RM-API output table and the
+PWS hourly readings for those days, so the comparison can be repeated without the
+APIs and after changing the engine or its settings (APPLESCAB_DRY_HOURS etc.).
+A green tip date is needed to record a run, so both engines look at the same days.
+
+record runs (needs the APIs, urls from the environment or .env as for the app):
+
+    python bench/validate_applescab.py record STATION_CODE,SELECT_DATE,GREEN_TIP_DATE ...
+
+for example
+
+    python bench/validate_applescab.py record EWXDAVIS01,2024-06-01,2024-04-10
+
+compare the recorded runs, and time the local engine:
+
+    python bench/validate_applescab.py [RECORDINGS_DIR]
+
+run from the app root dir.  Recordings go in bench/recorded/applescab by default.
+"""
+
+import json
+import sys
+from glob import glob
+from os import makedirs, path
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from lib.applescab import applescab_frame, APPLESCAB_COLUMNS
+
+RECORDINGS_DIR = path.join(path.dirname(path.abspath(__file__)), 'recorded', 'applescab')
+
+
+def record(run:str, recordings_dir:str = RECORDINGS_DIR)->str:
+    """run Apple Scab on the RM-API and save its output with the hourly readings it used
+
+    Args:
+        run (str): STATION_CODE,SELECT_DATE,GREEN_TIP_DATE
+
+    Returns:
+        str: path of the recording
+    """
+    from datetime import date, timedelta
+    from lib.ewx_api import applescab
+    from lib.pwsapi import get_hourly_readings
+    station_code, select_date, gt_start = run.split(",")
+    rm_api = applescab(station_code, select_date, gt_start = gt_start, engine = 'rm-api')
+    if 'startDateTime' not in rm_api.columns:
+        raise RuntimeError(f"no output from the RM-API for {run}")
+
+    first_day = str(date.fromisoformat(gt_start) - timedelta(days = 1))
+    recording = {
+        'station_code': station_code,
+        'select_date': select_date,
+        'gt_start': gt_start,
+        'rm_api': rm_api.to_dict('records'),
+        'hourly': get_hourly_readings(station_code, start_date = first_day, end_date = select_date),
+    }
+    makedirs(recordings_dir, exist_ok = True)
+    file_name = path.join(recordings_dir, f"{station_code}_{select_date}_{gt_start}.json")
+    with open(file_name, 'w') as f:
+        json.dump(recording, f, default = str)
+    return(file_name)
+
+
+def period_key(date_times:pd.Series)->pd.Series:
+    """start of a wetting period to the hour, to match periods from the two engines"""
+    return(pd.to_datetime(date_times, errors='coerce').dt.strftime('%Y-%m-%d %H'))
+
+
+def compare(recording:dict)->dict:
+    """compare the local engine with one recorded RM-API run, matching wetting periods on their start hour
+
+    Returns:
+        dict: periods from the RM-API, local periods, periods found by both, of those the ones with
+            the same risk, the largest difference in wet hours and in average temperature, and
+            seconds for the local engine
+    """
+    # columns the RM-API left out are compared as missing
+    rm_api = pd.DataFrame(recording['rm_api']).reindex(columns = APPLESCAB_COLUMNS)
+    started = perf_counter()
+    local = applescab_frame(recording['hourly'], recording['gt_start'])
+    seconds = perf_counter() - started
+
+    rm_api['key'] = period_key(rm_api['startDateTime'])
+    local['key'] = period_key(local['startDateTime'])
+    both = rm_api.merge(local, on = 'key', suffixes = ('_rm', '_local'))
+    wet_difference = (pd.to_numeric(both['durationWet_rm'], errors='coerce') - both['durationWet_local']).abs()
+    atmp_difference = (pd.to_numeric(both['atmp_avg_rm'], errors='coerce') - both['atmp_avg_local']).abs()
+    return({
+        'rm_api_periods': len(rm_api),
+        'local_periods': len(local),
+        'matched': len(both),
+        'same_risk': int((both['risk_rm'].astype(str).str.lower() == both['risk_local'].str.lower()).sum()),
+        'max_wet_hours_difference': float(wet_difference.max()) if len(both) else np.nan,
+        'max_atmp_difference': float(atmp_difference.max()) if len(both) else np.nan,
+        'seconds': seconds,
+    })
+
+
+def validate(recordings_dir:str = RECORDINGS_DIR):
+    files = sorted(glob(path.join(recordings_dir, '*.json')))
+    if not files:
+        print(f"no recordings in {recordings_dir}, see 'record' in this file's docstring")
+        return
+
+    print(f"{'recording':45} {'RM-API':>7} {'local':>6} {'matched':>8} {'same risk':>10} {'wet h diff':>11} {'temp diff':>10} {'ms':>7}")
+    totals = {'rm_api_periods': 0, 'matched': 0, 'same_risk': 0}
+    for file_name in files:
+        with open(file_name) as f:
+            result = compare(json.load(f))
+        for k in totals:
+            totals[k] += result[k]
+        print(f"{path.basename(file_name):45} {result['rm_api_periods']:7} {result['local_periods']:6} {result['matched']:8} "
+              f"{result['same_risk']:10} {result['max_wet_hours_difference']:11.1f} {result['max_atmp_difference']:10.1f} "
+              f"{result['seconds']*1000:7.1f}")
+
+    if totals['rm_api_periods']:
+        print(f"\n{totals['rm_api_periods']} RM-API wetting periods: {totals['matched']/totals['rm_api_periods']:.1%} found locally, "
+              f"risk agrees on {totals['same_risk']/max(totals['matched'], 1):.1%} of those")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'record':
+        for run in sys.argv[2:]:
+            print(record(run))
+    else:
+        validate(sys.argv[1] if len(sys.argv) > 1 else RECORDINGS_DIR)
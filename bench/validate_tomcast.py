@@ -0,0 +1,122 @@
+""" validate_tomcast.py: compare the local TOMCAST engine (lib/tomcast.py) with the RM-API
+
+Recorded runs are JSON files with the station, dates, the RM-API output table and the
+PWS hourly readings for those days, so the comparison can be repeated without the
+APIs and after changing the engine or its settings (TOMCAST_WET_PERCENT etc.).
+
+record runs (needs the APIs, urls from the environment or .env as for the app):
+
+    python bench/validate_tomcast.py record STATION_CODE,SELECT_DATE[,SPRAY_DATE] ...
+
+for example
+
+    python bench/validate_tomcast.py record EWXDAVIS01,2024-08-01,2024-07-20 EWXDAVIS01,2024-08-15
+
+compare the recorded runs, and time the local engine:
+
+    python bench/validate_tomcast.py [RECORDINGS_DIR]
+
+run from the app root dir.  Recordings go in bench/recorded/tomcast by default.
+"""
+
+import json
+import sys
+from glob import glob
+from os import makedirs, path
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from lib.tomcast import tomcast_frame, accumulation_start, TOMCAST_COLUMNS
+
+RECORDINGS_DIR = path.join(path.dirname(path.abspath(__file__)), 'recorded', 'tomcast')
+
+
+def record(run:str, recordings_dir:str = RECORDINGS_DIR)->str:
+    """run TOMCAST on the RM-API and save its output with the hourly readings it used
+
+    Args:
+        run (str): STATION_CODE,SELECT_DATE[,SPRAY_DATE]
+
+    Returns:
+        str: path of the recording
+    """
+    from lib.ewx_api import tomcast
+    from lib.pwsapi import get_hourly_readings
+    station_code, select_date, spray_date = (run.split(",") + [""])[:3]
+    rm_api = tomcast(station_code, select_date, date_start_accumulation = spray_date or None, engine = 'rm-api')
+    if 'Date' not in rm_api.columns:
+        raise RuntimeError(f"no output from the RM-API for {run}")
+
+    # the RM-API picks its own start when there is no spray date, get readings back to its first day
+    first_day = min(str(accumulation_start(select_date, spray_date or None)), rm_api['Date'].astype(str).str[:10].min())
+    recording = {
+        'station_code': station_code,
+        'select_date': select_date,
+        'date_start_accumulation': spray_date,
+        'rm_api': rm_api.to_dict('records'),
+        'hourly': get_hourly_readings(station_code, start_date = first_day, end_date = select_date),
+    }
+    makedirs(recordings_dir, exist_ok = True)
+    file_name = path.join(recordings_dir, f"{station_code}_{select_date}_{spray_date or 'none'}.json")
+    with open(file_name, 'w') as f:
+        json.dump(recording, f, default = str)
+    return(file_name)
+
+
+def compare(recording:dict)->dict:
+    """compare the local engine with one recorded RM-API run, on the days both have
+
+    Returns:
+        dict: days compared, days with the same DSV, the same Risk, the largest SumDSV
+            difference, and seconds for the local engine
+    """
+    rm_api = pd.DataFrame(recording['rm_api'])
+    rm_api['Date'] = rm_api['Date'].astype(str).str[:10]
+    # without a spray date the RM-API estimates the start, use the same first day
+    start = recording['date_start_accumulation'] or rm_api['Date'].min()
+
+    started = perf_counter()
+    local = tomcast_frame(recording['hourly'], recording['select_date'], start)
+    seconds = perf_counter() - started
+
+    both = rm_api.merge(local, on = 'Date', suffixes = ('_rm', '_local'))
+    sum_dsv_difference = (pd.to_numeric(both['SumDSV_rm'], errors='coerce') - both['SumDSV_local']).abs()
+    return({
+        'days': len(both),
+        'same_dsv': int((pd.to_numeric(both['DSV_rm'], errors='coerce') == both['DSV_local']).sum()),
+        'same_risk': int((both['Risk_rm'].astype(str).str.lower() == both['Risk_local']).sum()),
+        'max_sum_dsv_difference': float(sum_dsv_difference.max()) if len(both) else np.nan,
+        'seconds': seconds,
+    })
+
+
+def validate(recordings_dir:str = RECORDINGS_DIR):
+    files = sorted(glob(path.join(recordings_dir, '*.json')))
+    if not files:
+        print(f"no recordings in {recordings_dir}, see 'record' in this file's docstring")
+        return
+
+    print(f"{'recording':45} {'days':>5} {'same DSV':>9} {'same Risk':>10} {'max SumDSV diff':>16} {'ms':>7}")
+    totals = {'days': 0, 'same_dsv': 0, 'same_risk': 0}
+    for file_name in files:
+        with open(file_name) as f:
+            result = compare(json.load(f))
+        for k in totals:
+            totals[k] += result[k]
+        print(f"{path.basename(file_name):45} {result['days']:5} {result['same_dsv']:9} {result['same_risk']:10} "
+              f"{result['max_sum_dsv_difference']:16.1f} {result['seconds']*1000:7.1f}")
+
+    if totals['days']:
+        print(f"\n{totals['days']} days: DSV agrees on {totals['same_dsv']/totals['days']:.1%}, "
+              f"Risk on {totals['same_risk']/totals['days']:.1%}.  Columns compared: {', '.join(TOMCAST_COLUMNS[1:4])}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'record':
+        for run in sys.argv[2:]:
+            print(record(run))
+    else:
+        validate(sys.argv[1] if len(sys.argv) > 1 else RECORDINGS_DIR)
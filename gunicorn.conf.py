@@ -0,0 +1,41 @@
+""" gunicorn.conf.py: settings for serving the dashboard with gunicorn
+
+    gunicorn -c gunicorn.conf.py wsgi:server
+
+The callbacks spend most of their time waiting on the PWS API and the RM-API, 
+so each worker process runs many threads (gthread workers).  Each open page also 
+holds one thread for the latest readings events (/events/latest), up to SSE_MAX_STREAMS 
+per worker (default half the threads), the other pages use the interval timer.  See
+'Production' in readme.md for how to size workers and threads.
+
+Configuration from environment variables:
+
+- `HOST`, `PORT` address to listen on, default 0.0.0.0:5006 as in the Dockerfile
+- `WEB_CONCURRENCY` worker processes, default 2 per CPU
+- `GUNICORN_THREADS` threads per worker, default 32
+- `GUNICORN_TIMEOUT` seconds a request may take before the worker is restarted, default 120 (model runs are slow)
+"""
+
+import multiprocessing
+from os import environ, getenv
+
+bind = f"{getenv('HOST', '0.0.0.0')}:{getenv('PORT', 5006)}"
+workers = int(getenv('WEB_CONCURRENCY', 2*multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(getenv('GUNICORN_THREADS', 32))
+timeout = int(getenv('GUNICORN_TIMEOUT', 120))
+# the latest readings event streams stay open, keep-alive is handled by them
+keepalive = 5
+accesslog = '-'
+
+# import the app once in the master process, so the station list is loaded once 
+# and the workers share its memory
+preload_app = True
+
+# background threads are started in each worker after the fork, not when app.py is imported
+environ['START_THREADS_ON_IMPORT'] = 'False'
+
+
+def post_fork(server, worker):
+    import app
+    app.start_background_threads(worker_process=True)
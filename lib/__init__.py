@@ -1,7 +1,14 @@
 ##### load system configuration from config file
 
 from dotenv import load_dotenv
-from os import getenv
+from os import getenv, path
 load_dotenv()
 
 BASE_PWS_API_URL = getenv('BASE_PWS_API_URL')
+
+# folder for the app's caches, shared by every process on this server
+CACHE_DIR = getenv('DASH_CACHE', path.join(path.dirname(path.dirname(path.abspath(__file__))), 'cache-directory'))
+
+# where the caches shared by the app's processes are kept, 'filesystem' in CACHE_DIR or 'redis'
+CACHE_BACKEND = getenv('CACHE_BACKEND', 'filesystem').lower()
+CACHE_REDIS_URL = getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
@@ -0,0 +1,194 @@
+""" applescab.py: apple scab wetting periods and infection risk computed from PWS hourly readings
+
+Computes the output of the RM-API 'applescab' model (see ewx_api.applescab) from the
+hourly readings of the PWS API, which are already cached per station and day, so a
+run for another green tip date or day needs no request to the RM-API.
+
+An hour is wet if the leaf was wet for APPLESCAB_WET_PERCENT of it or more, or it
+rained.  Wet hours with up to APPLESCAB_DRY_HOURS dry hours between them are one
+wetting period.  The risk of each period is from its hours of wetness at its average
+temperature, by the Mills table (Mills 1944, as published in extension guides): the
+hours of wetness needed for a light, moderate or heavy infection, and the days until
+symptoms show.  Periods before green tip are left out.
+
+Configuration from environment variables:
+
+- `APPLESCAB_ENGINE` 'rm-api' (default) to run the model on the RM-API, or 'local' to use this module
+- `APPLESCAB_WET_PERCENT` an hour is wet if the leaf was wet this percent of it or more, default 50
+- `APPLESCAB_DRY_HOURS` more dry hours than this end a wetting period, default 8
+- `APPLESCAB_GREEN_TIP_DD42` degree days (base 42F, from Jan 1) at green tip, when no
+  green tip date is given, default 100
+
+See bench/validate_applescab.py to compare the results with the RM-API.
+"""
+
+import asyncio
+from os import getenv
+
+import numpy as np
+from pandas import DataFrame, to_numeric, to_datetime, to_timedelta
+
+from . import http_client
+from .pwsapi import get_hourly_readings_async
+from .converters import c2f, mm2inch
+
+APPLESCAB_ENGINE:str = getenv('APPLESCAB_ENGINE', 'rm-api').lower()
+APPLESCAB_WET_PERCENT:float = float(getenv('APPLESCAB_WET_PERCENT', 50))
+APPLESCAB_DRY_HOURS:int = int(getenv('APPLESCAB_DRY_HOURS', 8))
+APPLESCAB_GREEN_TIP_DD42:float = float(getenv('APPLESCAB_GREEN_TIP_DD42', 100))
+
+# Mills table: average temperature (F) of the wetting period, and the hours of wetness
+# for a light, moderate and heavy infection, and days until symptoms (None if not known)
+MILLS_TABLE = {
+    **{t: (48, 72, 72, None) for t in range(33, 42)},
+    42: (30, 40, 60, None), 43: (25, 34, 51, None), 44: (22, 30, 45, None), 45: (20, 27, 41, None),
+    46: (19, 25, 38, None), 47: (17, 23, 35, None), 48: (15, 20, 30, 17), 49: (14.5, 20, 30, 17),
+    50: (14, 19, 29, 16), 51: (13, 18, 27, 16), 52: (12, 18, 26, 15), 53: (12, 17, 25, 15),
+    54: (11.5, 16, 24, 14), 55: (11, 16, 24, 14), 56: (11, 15, 22, 13), 57: (10, 14, 22, 13),
+    58: (10, 14, 21, 12), 59: (10, 13, 21, 12), 60: (9.5, 13, 20, 11), 61: (9, 13, 20, 10),
+    62: (9, 12, 19, 10),
+    **{t: (9, 12, 18, 9) for t in range(63, 76)},
+    76: (9.5, 12, 19, None), 77: (11, 14, 21, None), 78: (13, 17, 26, None),
+}
+MILLS_MIN_F, MILLS_MAX_F = min(MILLS_TABLE), max(MILLS_TABLE)
+# rows by temperature - MILLS_MIN_F, columns light, moderate, heavy, symptom days (NaN if not known)
+_MILLS = np.array([[np.nan if v is None else v for v in MILLS_TABLE[t]] for t in range(MILLS_MIN_F, MILLS_MAX_F + 1)])
+
+APPLESCAB_COLUMNS = ['startDateTime', 'endDateTime', 'timeString', 'durationWet', 'durationSpan', 'atmp_avg', 'pcpn',
+                     'risk', 'symptom_date', 'wet_hours_at_avg_temp_needed', 'progress', 'highlight']
+
+RISKS = np.array(['None', 'Light', 'Moderate', 'Heavy'])
+
+
+def mills_hours(atmp_avg)->np.ndarray:
+    """rows of the Mills table for average temperatures (F), vectorized
+
+    Returns:
+        numpy array with a row per temperature: hours for light, moderate, heavy infection and
+        days to symptoms.  Temperatures outside the table get inf hours (no infection)
+    """
+    atmp_avg = np.asarray(atmp_avg, dtype=float)
+    in_table = (atmp_avg >= MILLS_MIN_F - 0.5) & (atmp_avg < MILLS_MAX_F + 0.5)
+    rows = _MILLS[np.clip(np.nan_to_num(np.round(atmp_avg), nan=MILLS_MIN_F), MILLS_MIN_F, MILLS_MAX_F).astype(int) - MILLS_MIN_F]
+    return(np.where(in_table[:, None], rows, [np.inf, np.inf, np.inf, np.nan]))
+
+
+def wetting_periods(hourly_readings, wet_percent:float = APPLESCAB_WET_PERCENT,
+                    dry_hours:int = APPLESCAB_DRY_HOURS)->DataFrame:
+    """wetting periods in the hourly readings, in one pass over them
+
+    Args:
+        hourly_readings (list[dict] | DataFrame): readings from pwsapi.get_hourly_readings
+        wet_percent (float, optional): an hour is wet from this percent wet. Defaults to APPLESCAB_WET_PERCENT.
+        dry_hours (int, optional): more dry hours than this end a period. Defaults to APPLESCAB_DRY_HOURS.
+
+    Returns:
+        DataFrame with 'start' and 'end' (local time of the start of the first wet hour and the
+        end of the last), 'durationWet' (wet hours), 'durationSpan' (hours from start to end),
+        'atmp_avg' (F, over the wet hours) and 'pcpn' (inches), sorted by start
+    """
+    hourly = DataFrame(hourly_readings)
+    columns = ['start', 'end', 'durationWet', 'durationSpan', 'atmp_avg', 'pcpn']
+    if hourly.empty or 'represented_date' not in hourly.columns:
+        return(DataFrame(columns=columns))
+
+    # represented_hour 1-24 is the hour ending at that time
+    hour_end = to_datetime(hourly['represented_date'].astype(str).str[:10]) + \
+               to_timedelta(to_numeric(hourly['represented_hour'], errors='coerce'), unit='h')
+    pwet = to_numeric(hourly.get('lws_pwet_hourly'), errors='coerce')
+    pcpn = to_numeric(hourly.get('pcpn_total_hourly'), errors='coerce').fillna(0)
+    wet = ((pwet >= wet_percent) | (pcpn > 0)).to_numpy()
+
+    wet_hours = DataFrame({
+        'hour_end': hour_end[wet],
+        'atmp': to_numeric(hourly.get('atmp_avg_hourly'), errors='coerce')[wet],
+        'pcpn': pcpn[wet],
+    }).dropna(subset=['hour_end']).sort_values('hour_end')
+    if wet_hours.empty:
+        return(DataFrame(columns=columns))
+
+    # a new period starts after more than dry_hours hours without a wet hour
+    gap = wet_hours['hour_end'].diff().dt.total_seconds().div(3600).fillna(np.inf)
+    wet_hours['period'] = (gap > dry_hours + 1).cumsum()
+    periods = wet_hours.groupby('period').agg(
+        first_hour_end = ('hour_end', 'min'),
+        end = ('hour_end', 'max'),
+        durationWet = ('hour_end', 'size'),
+        atmp_avg_metric = ('atmp', 'mean'),
+        pcpn_metric = ('pcpn', 'sum'),
+    ).reset_index(drop=True)
+    periods['start'] = periods['first_hour_end'] - to_timedelta(1, unit='h')
+    periods['durationSpan'] = (periods['end'] - periods['start']).dt.total_seconds()/3600
+    periods['atmp_avg'] = c2f(periods['atmp_avg_metric'])
+    periods['pcpn'] = mm2inch(periods['pcpn_metric'])
+    return(periods.loc[:, columns])
+
+
+def applescab_frame(hourly_readings, gt_start = None, wet_percent:float = APPLESCAB_WET_PERCENT,
+                    dry_hours:int = APPLESCAB_DRY_HOURS)->DataFrame:
+    """apple scab infection risk of each wetting period from green tip on
+
+    Args:
+        hourly_readings (list[dict] | DataFrame): readings from green tip to the select date
+        gt_start (date | str, optional): green tip, periods that end before it are left out.
+            Defaults to None, all periods
+        wet_percent (float, optional): an hour is wet from this percent wet. Defaults to APPLESCAB_WET_PERCENT.
+        dry_hours (int, optional): more dry hours than this end a period. Defaults to APPLESCAB_DRY_HOURS.
+
+    Returns:
+        DataFrame with the APPLESCAB_COLUMNS like ewx_api.applescab, one row per wetting period.
+        risk is None, Light, Moderate or Heavy, and progress the percent of the wet hours needed
+        for a light infection
+    """
+    periods = wetting_periods(hourly_readings, wet_percent, dry_hours)
+    if gt_start:
+        periods = periods[periods['end'] >= to_datetime(str(gt_start)[:10])]
+    if periods.empty:
+        return(DataFrame(columns=APPLESCAB_COLUMNS))
+
+    mills = mills_hours(periods['atmp_avg'])
+    duration = periods['durationWet'].to_numpy(dtype=float)
+    level = (duration[:, None] >= mills[:, :3]).sum(axis=1)
+    symptom_days = np.where(level > 0, mills[:, 3], np.nan)
+    symptom_date = periods['start'] + to_timedelta(symptom_days, unit='D')
+    needed = mills[:, 0]
+
+    return(DataFrame({
+        'startDateTime': periods['start'].dt.strftime('%Y-%m-%d %H:%M'),
+        'endDateTime': periods['end'].dt.strftime('%Y-%m-%d %H:%M'),
+        'timeString': periods['start'].dt.strftime('%m/%d %I:%M %p') + ' - ' + periods['end'].dt.strftime('%m/%d %I:%M %p'),
+        'durationWet': periods['durationWet'],
+        'durationSpan': periods['durationSpan'],
+        'atmp_avg': periods['atmp_avg'].round(1),
+        'pcpn': periods['pcpn'].round(2),
+        'risk': RISKS[level],
+        'symptom_date': symptom_date.dt.strftime('%Y-%m-%d').fillna(''),
+        'wet_hours_at_avg_temp_needed': np.where(np.isfinite(needed), needed, np.nan),
+        'progress': np.where(np.isfinite(needed), np.minimum(100, np.round(100*duration/needed)), 0),
+        'highlight': level > 0,
+    }).reset_index(drop=True))
+
+
+def green_tip_date(weather_summary:DataFrame, dd42:float = APPLESCAB_GREEN_TIP_DD42):
+    """first day the degree days base 42F since Jan 1 reach dd42, from a season's weather
+    summary (ewx_api.weather_summary), or None if they have not yet"""
+    if not isinstance(weather_summary, DataFrame) or 'dd2_accum' not in weather_summary.columns:
+        return(None)
+    reached = weather_summary[to_numeric(weather_summary['dd2_accum'], errors='coerce') >= dd42]
+    return(str(reached['date'].min())[:10] if not reached.empty else None)
+
+
+def applescab_local(station_code:str, select_date, gt_start)->DataFrame:
+    """apple scab for a station from its hourly readings from green tip to select_date, like ewx_api.applescab"""
+    return(http_client.run_sync(applescab_local_async(station_code, select_date, gt_start)))
+
+
+async def applescab_local_async(station_code:str, select_date, gt_start)->DataFrame:
+    """async version of applescab_local"""
+    # a period that is wet at green tip may have started the day before
+    start = (to_datetime(str(gt_start)[:10]) - to_timedelta(1, unit='D')).date()
+    readings = await get_hourly_readings_async(station_code, start_date = str(start), end_date = str(select_date)[:10])
+    if readings == [{}]:
+        return(DataFrame([{}]))
+    # the periods are found in a worker thread, so other calls on this event loop go on meanwhile
+    return(await asyncio.to_thread(applescab_frame, readings, gt_start))
@@ -8,6 +8,8 @@ of the calling program
 
 from datetime import time, datetime, date, timedelta
 from zoneinfo import ZoneInfo
+import numpy as np
+import pandas as pd
 
 MICHIGAN_TIME_ZONE_KEY = 'US/Eastern'
 MICHIGAN_TIME_ZONE = ZoneInfo(MICHIGAN_TIME_ZONE_KEY)
@@ -69,6 +71,15 @@ def kph2mph(kph:float)->float:
     mph = kph * 0.6213712
     return( mph ) 
     
+COMPASS_POINTS = np.array([
+    'N', 'NNE', 'NE', 'ENE',
+    'E', 'ESE', 'SE', 'SSE',
+    'S', 'SSW', 'SW', 'WSW',
+    'W', 'WNW', 'NW', 'NNW',
+    ], dtype=object)
+COMPASS_WIDTH = 360/len(COMPASS_POINTS)
+
+
 def degree2compass(deg:float)->str:
     """convert decimal degress to compass points from 16 point compass
 
@@ -82,30 +93,51 @@ def degree2compass(deg:float)->str:
     if not(deg) or isinstance(deg,str):
         return ""
     
-    directions = [
-    'N', 'NNE', 'NE', 'ENE',
-    'E', 'ESE', 'SE', 'SSE',
-    'S', 'SSW', 'SW', 'WSW',
-    'W', 'WNW', 'NW', 'NNW',
-    ] 
-    
-    if deg == 0.0:
-        return('calm')
+    direction_index:int =  int((deg + COMPASS_WIDTH/2)/COMPASS_WIDTH) % len(COMPASS_POINTS)
+    return(COMPASS_POINTS[direction_index])
+
+
+def _as_float_array(values)->np.ndarray:
+    """float array from array-like values, with NaN for missing or non-numeric values"""
+    values = np.asarray(values)
+    if values.dtype.kind in 'fiub':
+        return(values.astype(float, copy=False))
+    return(pd.to_numeric(pd.Series(values.astype(object)), errors='coerce').to_numpy(dtype=float))
+
+
+def degree2compass_array(deg)->np.ndarray:
+    """convert many decimal degrees to 16 point compass directions at once, 
+    vectorized version of degree2compass
+
+    Args:
+        deg (array-like | pandas.Series): decimal degrees, may contain missing or non-numeric values
     
-    points = 16    
-    width = 360/points
-    direction_index:int =  int((deg + width/2)/width) % 16
+    Returns:
+        numpy.ndarray: compass direction abbreviations, "" for 0, missing or non-numeric values
+    """
+    deg = _as_float_array(deg)
+    valid = ~np.isnan(deg) & (deg != 0)
     
-    direction:str = directions[direction_index]
+    # truncate like int() does so negative degrees match degree2compass
+    direction_index = np.trunc((np.where(valid, deg, 0) + COMPASS_WIDTH/2)/COMPASS_WIDTH).astype(int) % len(COMPASS_POINTS)
     
-    return(direction)
+    return(np.where(valid, COMPASS_POINTS[direction_index], ""))
     
     
+def _clock_interval_str(h:int)->str:
+    start_time = time((h-1),0)
+    end_time = time(start_time.hour, 59)
+    return(start_time.strftime("%I:%M") + "-" + end_time.strftime("%I:%M %p"))
+
+# time interval for each hour number, index 0 is not an hour
+HOUR_CLOCK_LABELS = np.array([""] + [_clock_interval_str(h) for h in range(1,25)], dtype=object)
+
+
 def hour_number2clock_str(h:int)->str:
     """convert the hour number ( 1 to 24) which is output by hourly
     weather summary into a human readable time interval
     
-    hour 1 => '12:00AM-12:59AM'
+    hour 1 => '12:00-12:59 AM'
 
     Args:
         h (int): hour number 1 is first hour of the day
@@ -114,17 +146,22 @@ def hour_number2clock_str(h:int)->str:
         str: time interval in 12hr clock
     """
     
-    # try:
-    #     h = int(h)
-    # except Exception as e:
-    #     return ""
-    
-    #h = int(h)
     if (h > 24) or (h < 1):
         return("")
     
-    start_time = time((h-1),0)
-    end_time = time(start_time.hour, 59)
-    time_interval_str = start_time.strftime("%I:%M") + "-" + end_time.strftime("%I:%M %p")
-    
-    return(time_interval_str)    
\ No newline at end of file
+    return(HOUR_CLOCK_LABELS[int(h)])    
+
+
+def hour_number2clock_array(h)->np.ndarray:
+    """convert many hour numbers (1 to 24) to time intervals at once,  
+    vectorized version of hour_number2clock_str
+
+    Args:
+        h (array-like | pandas.Series): hour numbers, 1 is the first hour of the day
+
+    Returns:
+        numpy.ndarray: time intervals in 12hr clock, "" for missing or out of range hours
+    """
+    h = _as_float_array(h)
+    valid = (h >= 1) & (h <= 24)
+    return(HOUR_CLOCK_LABELS[np.where(valid, h, 0).astype(int)])
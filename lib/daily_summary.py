@@ -0,0 +1,240 @@
+""" daily_summary.py: daily weather summary computed from PWS hourly readings
+
+Computes the same daily values as the RM-API 'weathersummary' model (see
+ewx_api.weather_summary_table_headers) from the hourly readings of the PWS API,
+so that days can be added to a stored summary without pulling the whole season
+from the RM-API again, or the whole summary can be computed here for any range
+of days (see weather_summary_local), with degree days for more base temperatures.
+
+Temperatures are in F and rain in inches, with the *_metric columns in C and mm,
+as in the RM-API output.  Degree days use the Baskerville-Emin method on the
+daily min and max temperature.  Days are the station's local days, the
+represented_date of the PWS API readings, and the running totals start again
+each Jan 1 unless another start is given.
+
+Configuration from environment variables:
+
+- `WEATHER_SUMMARY_ENGINE` 'rm-api' (default) to get the summary from the RM-API, or 'local' to
+  compute it here from the cached hourly readings
+- `DEGREE_DAY_EXTRA_BASES` more base temperatures (F) for degree days, comma separated, e.g. '48,52'.
+  Columns are named for the base, dd48F_single and dd48F_accum.  Local engine only, default none
+"""
+
+import asyncio
+from datetime import date
+from os import getenv
+
+import numpy as np
+from pandas import DataFrame, to_numeric
+
+from . import http_client
+from .converters import c2f, mm2inch, today_localtime, MICHIGAN_TIME_ZONE_KEY
+from .pwsapi import get_hourly_readings_async, get_station_data_async
+from .tiered_cache import as_date
+
+WEATHER_SUMMARY_ENGINE:str = getenv('WEATHER_SUMMARY_ENGINE', 'rm-api').lower()
+DEGREE_DAY_EXTRA_BASES:list = [float(base) for base in getenv('DEGREE_DAY_EXTRA_BASES', '').split(',') if base.strip()]
+
+# degree day column prefix and base temperature (F), as in weather_summary_table_headers
+DEGREE_DAY_BASES = {'dd0': 32, 'dd1': 40, 'dd2': 42, 'dd3': 45, 'dd4': 50}
+
+SINGLE_COLUMNS = ['atmp_min', 'atmp_max', 'atmp_avg', 'relh_avg', 'l_wet_0', 'pcpn_single'] + \
+                 [f"{dd}_single" for dd in DEGREE_DAY_BASES] + \
+                 ['atmp_min_metric', 'atmp_max_metric', 'atmp_avg_metric', 'pcpn_single_metric']
+
+# accumulated column and the daily column it is the running total of
+ACCUM_COLUMNS = {'pcpn0_accum': 'pcpn_single', 'pcpn0_accum_metric': 'pcpn_single_metric'} | \
+                {f"{dd}_accum": f"{dd}_single" for dd in DEGREE_DAY_BASES}
+
+
+def degree_days_be(tmin, tmax, base:float):
+    """degree days for each day by the Baskerville-Emin (single sine) method, vectorized
+
+    Args:
+        tmin (array-like): daily minimum temperatures
+        tmax (array-like): daily maximum temperatures, same units as tmin
+        base (float): base temperature, same units
+
+    Returns:
+        numpy array of degree days, NaN where tmin or tmax is missing
+    """
+    tmin = np.asarray(tmin, dtype=float)
+    tmax = np.asarray(tmax, dtype=float)
+    tavg = (tmin + tmax)/2
+    alpha = (tmax - tmin)/2
+
+    # base between min and max: area of the sine curve above the base
+    with np.errstate(divide='ignore', invalid='ignore'):
+        theta = np.arcsin(np.clip((base - tavg)/alpha, -1, 1))
+        partial = ((tavg - base)*(np.pi/2 - theta) + alpha*np.cos(theta))/np.pi
+
+    dd = np.where(tmax <= base, 0.0, np.where(tmin >= base, tavg - base, partial))
+    return(np.where(np.isnan(tmin) | np.isnan(tmax), np.nan, dd))
+
+
+def degree_day_bases(extra_bases = ())->dict:
+    """DEGREE_DAY_BASES and the column prefix and base of more base temperatures (F),
+    e.g. 'dd48F' for 48.  Bases that are already in DEGREE_DAY_BASES are not repeated"""
+    bases = dict(DEGREE_DAY_BASES)
+    for base in extra_bases or ():
+        if float(base) not in bases.values():
+            bases[f"dd{float(base):g}F"] = float(base)
+    return(bases)
+
+
+def degree_day_headers(extra_bases = ())->dict:
+    """column headers for the degree days of more base temperatures, like weather_summary_table_headers"""
+    headers = {}
+    for dd, base in degree_day_bases(extra_bases).items():
+        if dd not in DEGREE_DAY_BASES:
+            headers[f"{dd}_single"] = f"DD{base:g}F (BE) Daily"
+            headers[f"{dd}_accum"] = f"DD{base:g}F (BE) Since 1/1"
+    return(headers)
+
+
+def daily_summary(hourly_readings, extra_bases = ())->DataFrame:
+    """daily weather summary from PWS hourly readings, one row per represented_date
+
+    Args:
+        hourly_readings (list[dict] | DataFrame): readings from pwsapi.get_hourly_readings
+        extra_bases (list[float], optional): more base temperatures (F) for degree days. Defaults to none
+
+    Returns:
+        DataFrame with 'date' (YYYY-MM-DD), the SINGLE_COLUMNS and a *_single column for each
+        extra base, sorted by date.  Empty if no readings
+    """
+    bases = degree_day_bases(extra_bases)
+    columns = ['date'] + SINGLE_COLUMNS + [f"{dd}_single" for dd in bases if dd not in DEGREE_DAY_BASES]
+    hourly = DataFrame(hourly_readings)
+    if hourly.empty or 'represented_date' not in hourly.columns:
+        return(DataFrame(columns=columns))
+
+    hourly = hourly.assign(date = hourly['represented_date'].astype(str).str[:10])
+    # hourly min/max temperature if the API has them, otherwise min/max of the hourly averages
+    atmp_min = 'atmp_min_hourly' if 'atmp_min_hourly' in hourly.columns else 'atmp_avg_hourly'
+    atmp_max = 'atmp_max_hourly' if 'atmp_max_hourly' in hourly.columns else 'atmp_avg_hourly'
+    for column in {'atmp_avg_hourly', atmp_min, atmp_max, 'relh_avg_hourly', 'pcpn_total_hourly', 'lws_pwet_hourly'}:
+        hourly[column] = to_numeric(hourly.get(column), errors='coerce')
+
+    days = hourly.groupby('date').agg(
+        atmp_min_metric = (atmp_min, 'min'),
+        atmp_max_metric = (atmp_max, 'max'),
+        atmp_avg_metric = ('atmp_avg_hourly', 'mean'),
+        relh_avg = ('relh_avg_hourly', 'mean'),
+        pcpn_single_metric = ('pcpn_total_hourly', 'sum'),
+        # hours of leaf wetness, each hour counted by the fraction of it that was wet
+        l_wet_0 = ('lws_pwet_hourly', lambda pwet: pwet.sum()/100),
+    ).reset_index()
+
+    days['atmp_min'] = c2f(days.atmp_min_metric)
+    days['atmp_max'] = c2f(days.atmp_max_metric)
+    days['atmp_avg'] = c2f(days.atmp_avg_metric)
+    days['pcpn_single'] = mm2inch(days.pcpn_single_metric)
+    for dd, base in bases.items():
+        days[f"{dd}_single"] = degree_days_be(days.atmp_min, days.atmp_max, base)
+
+    return(days.loc[:, columns].sort_values('date', ignore_index=True))
+
+
+def add_accumulations(summary:DataFrame, accumulate_from = None)->DataFrame:
+    """(re)compute the *_accum columns as running totals of the daily columns, in date order. 
+    Degree day columns of extra bases (ddNNF_single) get a running total too
+
+    Args:
+        summary (DataFrame): daily summary with 'date' and the daily columns, for one season or more
+        accumulate_from (date | str, optional): first day of the running totals, days before it
+            add nothing.  Defaults to None, which starts them again each Jan 1
+
+    Returns:
+        DataFrame sorted by date ascending with the ACCUM_COLUMNS
+    """
+    summary = summary.sort_values('date', ignore_index=True)
+    accum_columns = ACCUM_COLUMNS | {f"{column[:-len('_single')]}_accum": column for column in summary.columns
+                                     if str(column).startswith('dd') and str(column).endswith('_single')}
+    accum_columns = {accum: single for accum, single in accum_columns.items() if single in summary.columns}
+    if not accum_columns:
+        return(summary)
+
+    days = summary['date'].astype(str).str[:10]
+    singles = summary[list(accum_columns.values())].apply(to_numeric, errors='coerce').fillna(0)
+    if accumulate_from:
+        totals = singles.mul(days >= str(accumulate_from)[:10], axis=0).cumsum()
+    else:
+        # one running total per year
+        totals = singles.groupby(days.str[:4].to_numpy()).cumsum()
+    for accum, single in accum_columns.items():
+        summary[accum] = totals[single]
+    return(summary)
+
+
+def weather_summary_range(hourly_readings, start_date, end_date, extra_bases = (), accumulate_from = None)->DataFrame:
+    """weather summary from start_date to end_date, with the running totals of add_accumulations
+
+    Args:
+        hourly_readings (list[dict] | DataFrame): readings from pwsapi.get_hourly_readings, back to
+            Jan 1 of the start year (or accumulate_from) for the running totals to be complete
+        start_date (date | str): first day
+        end_date (date | str): last day
+        extra_bases (list[float], optional): more base temperatures (F) for degree days. Defaults to none
+        accumulate_from (date | str, optional): first day of the running totals. Defaults to None, each Jan 1
+
+    Returns:
+        DataFrame like ewx_api.weather_summary, sorted by date descending
+    """
+    summary = add_accumulations(daily_summary(hourly_readings, extra_bases), accumulate_from)
+    in_range = (summary['date'] >= str(start_date)[:10]) & (summary['date'] <= str(end_date)[:10])
+    return(summary[in_range].sort_values(by='date', ascending=False, ignore_index=True))
+
+
+# time zone of each station, they don't change
+_station_time_zones:dict = {}
+
+async def station_time_zone_async(station_code:str)->str:
+    """time zone key of a station from the PWS API, MICHIGAN_TIME_ZONE_KEY if it has none"""
+    if station_code not in _station_time_zones:
+        station = await get_station_data_async(station_code)
+        if not station:
+            return(MICHIGAN_TIME_ZONE_KEY)
+        _station_time_zones[station_code] = station.get('timezone') or MICHIGAN_TIME_ZONE_KEY
+    return(_station_time_zones[station_code])
+
+
+def weather_summary_local(station_code:str, start_date = None, end_date = None, extra_bases = DEGREE_DAY_EXTRA_BASES,
+                          accumulate_from = None, timezone_key:str = None)->DataFrame:
+    """weather summary for a station computed from its hourly readings, for any range of days
+
+    The hourly readings are stored per station and day (see pwsapi.get_hourly_readings), so
+    after the first run only the days that can still change are requested from the PWS API.
+
+    Args:
+        station_code (str): PWS station code
+        start_date (date | str, optional): first day. Defaults to None, Jan 1 of the end_date year
+        end_date (date | str, optional): last day. Defaults to None, today at the station
+        extra_bases (list[float], optional): more base temperatures (F). Defaults to DEGREE_DAY_EXTRA_BASES
+        accumulate_from (date | str, optional): first day of the running totals, e.g. a biofix date.
+            Defaults to None, which starts them each Jan 1
+        timezone_key (str, optional): time zone of the station. Defaults to None, from the station record
+
+    Returns:
+        DataFrame like ewx_api.weather_summary, sorted by date descending, or DataFrame([{}])
+        if there are no readings
+    """
+    return(http_client.run_sync(weather_summary_local_async(station_code, start_date, end_date, extra_bases,
+                                                            accumulate_from, timezone_key)))
+
+
+async def weather_summary_local_async(station_code:str, start_date = None, end_date = None, extra_bases = DEGREE_DAY_EXTRA_BASES,
+                                      accumulate_from = None, timezone_key:str = None)->DataFrame:
+    """async version of weather_summary_local"""
+    if timezone_key is None:
+        timezone_key = await station_time_zone_async(station_code)
+    end = as_date(end_date) or today_localtime(timezone_key)
+    start = as_date(start_date) or date(end.year, 1, 1)
+    # readings back to the start of the running totals
+    first_day = min(start, as_date(accumulate_from) or date(start.year, 1, 1))
+    readings = await get_hourly_readings_async(station_code, start_date = str(first_day), end_date = str(end),
+                                               timezone_key = timezone_key)
+    if readings == [{}]:
+        return(DataFrame([{}]))
+    # a season of hourly readings is aggregated in a worker thread, so other calls on this event loop go on meanwhile
+    return(await asyncio.to_thread(weather_summary_range, readings, start, end, extra_bases, accumulate_from))
@@ -1,18 +1,33 @@
 """ ewx_api.py: functions to work with the Enviroweather RM API in Python
+
+The model functions have async versions (tomcast_async etc.) for async callbacks, 
+the blocking functions run them on an event loop of the calling thread (or a run-sync pool thread 
+when called from async code), only the requests go to the http client's loop, see http_client.run_sync
 """
 
 
 ## this goes into the PWS API module
 
 from dotenv import load_dotenv
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from zoneinfo import ZoneInfo
-import requests, json
+import json, base64, threading, asyncio
+from time import monotonic, time
 load_dotenv()
 from os import getenv
-from pandas import DataFrame
+from warnings import warn
+from pandas import DataFrame, concat, to_numeric
 from typing import Union
 from .converters import MICHIGAN_TIME_ZONE_KEY,today_localtime
+from . import http_client
+from .singleflight import SingleFlight
+from .tiered_cache import TieredCache, date_ttl, as_date, TTL_RECENT, TTL_FOREVER
+from .pwsapi import get_hourly_readings_async, hourly_day_settled
+from .daily_summary import (daily_summary, add_accumulations, SINGLE_COLUMNS, weather_summary_local_async, 
+                            degree_day_headers, WEATHER_SUMMARY_ENGINE, DEGREE_DAY_EXTRA_BASES)
+from .tomcast import tomcast_local_async, TOMCAST_ENGINE
+from .applescab import applescab_local_async, green_tip_date, APPLESCAB_ENGINE, APPLESCAB_COLUMNS
+from urllib.parse import urlsplit, parse_qsl, urlencode
 
 
 
@@ -22,23 +37,115 @@ from .converters import MICHIGAN_TIME_ZONE_KEY,today_localtime
 BASE_EWX_API_URL=getenv('BASE_EWX_API_URL', 'https://enviroweather.msu.edu/ewx-api/api')
 BASE_RM_API_URL=getenv('BASE_RM_API_URL', 'https://enviroweather.msu.edu/rm-api/api')
 PWS_STATION_TYPE = 6
+# add new days to a stored season summary instead of pulling the whole season, see weather_summary_incremental.
+# Off by default until the days computed from hourly readings are checked against the RM-API
+WEATHER_SUMMARY_INCREMENTAL:bool = getenv('WEATHER_SUMMARY_INCREMENTAL', 'False').lower() in ('true', '1', 'yes')
+
+
+# site tokens are not cached forever, see TokenManager
+EWX_TOKEN_TTL_SECONDS:int = int(getenv('EWX_TOKEN_TTL_SECONDS', 3600))
+EWX_TOKEN_REFRESH_MARGIN_SECONDS:int = int(getenv('EWX_TOKEN_REFRESH_MARGIN_SECONDS', 300))
+EWX_TOKEN_RETRY_SECONDS:int = 10
 
 
-global current_token_value
-current_token_value = None
+class TokenManager:
+    """holds the site token for one EWX API, and gets a new one before it expires
+    
+    - the expiry is read from the token if it is a JWT with an 'exp' claim, 
+      otherwise it is assumed to last EWX_TOKEN_TTL_SECONDS
+    - once a token is within EWX_TOKEN_REFRESH_MARGIN_SECONDS of expiring, one caller 
+      refreshes it while the others keep using the current token
+    - concurrent callers with no valid token wait on a single acquisition
+    - a failed acquisition is not cached, but is not retried for EWX_TOKEN_RETRY_SECONDS
+    """
+    
+    def __init__(self, base_ewx_api_url:str = BASE_EWX_API_URL):
+        self.base_ewx_api_url = base_ewx_api_url
+        self._token:str = ""
+        self._expires_at:float = 0.0
+        self._retry_after:float = 0.0
+        self._lock = threading.Lock()
         
-def token_value(base_ewx_api_url = BASE_EWX_API_URL):
-    global current_token_value
-    if current_token_value is None:
-        current_token_value = aquire_token(base_ewx_api_url)
+    def token(self)->str:
+        """current token, acquiring or refreshing it as needed.  Returns "" if none could be acquired"""
+        now = monotonic()
+        if self._token and now < self._expires_at - EWX_TOKEN_REFRESH_MARGIN_SECONDS:
+            return(self._token)
+        
+        if self._token and now < self._expires_at:
+            # still valid but expiring soon: refresh unless another thread already is, 
+            # or the last try failed less than EWX_TOKEN_RETRY_SECONDS ago
+            if now >= self._retry_after and self._lock.acquire(blocking=False):
+                try:
+                    now = monotonic()
+                    if now >= self._expires_at - EWX_TOKEN_REFRESH_MARGIN_SECONDS and now >= self._retry_after:
+                        self._acquire()
+                finally:
+                    self._lock.release()
+            return(self._token)
+        
+        with self._lock:
+            now = monotonic()
+            if not(self._token and now < self._expires_at) and now >= self._retry_after:
+                self._acquire()
+            return(self._token if now < self._expires_at else "")
     
-    return current_token_value
+    def invalidate(self, token:str = None):
+        """forget the token, e.g. when the API rejected it, so the next call gets a new one.  
+        If a token is given it is only dropped if it is still the current one, so that 
+        many requests failing with the same old token cause only one new acquisition"""
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = ""
+                self._expires_at = 0.0
+                self._retry_after = 0.0
+    
+    def _acquire(self):
+        new_token = aquire_token(self.base_ewx_api_url)
+        now = monotonic()
+        if new_token:
+            self._token = new_token
+            self._expires_at = now + token_lifetime(new_token)
+        else:
+            # keep a token that is still valid, and wait a bit before trying again
+            self._retry_after = now + EWX_TOKEN_RETRY_SECONDS
+            
+
+def token_lifetime(token:str, default_seconds:int = EWX_TOKEN_TTL_SECONDS)->float:
+    """seconds until the token expires, from the 'exp' claim if it is a JWT
+
+    Args:
+        token (str): token from the siteToken API
+        default_seconds (int, optional): lifetime if it can't be read from the token. 
+            Defaults to EWX_TOKEN_TTL_SECONDS.
+    """
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return(max(0.0, float(claims['exp']) - time()))
+    except Exception:
+        return(float(default_seconds))
+
+
+_token_managers:dict = {}
+_token_managers_lock = threading.Lock()
+
+def token_manager(base_ewx_api_url = BASE_EWX_API_URL)->TokenManager:
+    """the shared token manager for an EWX API url"""
+    with _token_managers_lock:
+        if base_ewx_api_url not in _token_managers:
+            _token_managers[base_ewx_api_url] = TokenManager(base_ewx_api_url)
+        return(_token_managers[base_ewx_api_url])
+
+        
+def token_value(base_ewx_api_url = BASE_EWX_API_URL):
+    return token_manager(base_ewx_api_url).token()
         
          
 def aquire_token(base_ewx_api_url = BASE_EWX_API_URL)->str:
     token_url = f"{base_ewx_api_url}/db2/siteToken"
-    r = requests.get(url = token_url)
-    if r.status_code == 200:
+    r = http_client.get(url = token_url)
+    if r is not None and r.status_code == 200:
         request_data:dict = r.json()
         if 'data' in request_data and 'token' in request_data['data']:
             token =request_data["data"]["token"]
@@ -52,18 +159,20 @@ def get_result_model_keys(base_ewx_api_url:str = BASE_EWX_API_URL):
     ewx_token = token_value(base_ewx_api_url)
     payload = {}
     
-    response = requests.request("GET", 
+    response = http_client.request("GET", 
                                 url, 
                                 headers=ewx_headers(base_ewx_api_url), 
                                 data=payload)
-    return(response.text)
+    return(response.text if response is not None else "")
 
 
-def ewx_headers(base_ewx_api_url:str = BASE_EWX_API_URL):
+def ewx_headers(base_ewx_api_url:str = BASE_EWX_API_URL, token:str = None):
     """ standard headers used in all requests"""
+    if token is None:
+        token = token_value(base_ewx_api_url)
     return {
         'Accept': "application/json",
-        'Authorization': f"Bearer ${token_value(base_ewx_api_url)}"
+        'Authorization': f"Bearer ${token}"
         }
     
 def date_to_api_str(d, default_date=today_localtime(MICHIGAN_TIME_ZONE_KEY))->str:
@@ -113,9 +222,24 @@ def ewx_request(url:str,base_ewx_api_url:str = BASE_EWX_API_URL):
     Returns:
         ANY: the 'data' element of a standard RM-API array output
     """
-    headers = ewx_headers(base_ewx_api_url)
-    payload = {}
-    response = requests.request("GET", url, headers=headers, data=payload)
+    return(http_client.run_sync(ewx_request_async(url, base_ewx_api_url)))
+
+
+async def ewx_request_async(url:str, base_ewx_api_url:str = BASE_EWX_API_URL):
+    """async version of ewx_request"""
+    # getting a new token is a blocking request, but only happens once in a while
+    token = await asyncio.to_thread(token_value, base_ewx_api_url)
+    response = await http_client.request_async("GET", url, headers=ewx_headers(base_ewx_api_url, token))
+    if response is not None and response.status_code == 401:
+        # token was rotated or revoked, get a new one and try once more
+        token_manager(base_ewx_api_url).invalidate(token)
+        token = await asyncio.to_thread(token_value, base_ewx_api_url)
+        response = await http_client.request_async("GET", url, headers=ewx_headers(base_ewx_api_url, token))
+        
+    if response is None:
+        warn(f"request error, no response url {url}")
+        return None
+    
     if response.status_code == 200:
         response_data = response.json()
         # response_data = json.loads(response_json)
@@ -125,14 +249,65 @@ def ewx_request(url:str,base_ewx_api_url:str = BASE_EWX_API_URL):
 
     #TODO handle errors, http errors and errors embedded in
     
-    print(f"request error {response.status_code} {response.text} url {url}")
+    warn(f"request error {response.status_code} {response.text} url {url}")
     return None
 
 
+# identical model runs that are in flight at the same time share one request, 
+# and results are cached for a time depending on the date the model is run for
+model_run_flights = SingleFlight()
+model_cache = TieredCache('models')
+
+def model_run_key(model_url:str)->str:
+    """normalize a model url so the same run always gives the same key: 
+    query parameters are sorted, the scheme and host are lower case"""
+    parts = urlsplit(model_url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return(f"{parts.scheme.lower()}://{parts.netloc.lower()}{parts.path}?{query}")
+
+
+def model_table(model_url:str, base_ewx_api_url:str = BASE_EWX_API_URL, ttl:int = TTL_RECENT)->Union[DataFrame,None]:
+    """run a model on the RM-API and return its 'Table' output as a data frame. 
+    
+    Results are cached for ttl seconds.  Concurrent calls for the same model url 
+    wait on one upstream request.  Each caller gets their own copy of the data frame, 
+    so callers can sort or modify it. 
+
+    Args:
+        model_url (str): URL for a specific model type with all parameters in place
+        base_ewx_api_url (str, optional): api to get a token from, defaults to BASE_EWX_API_URL.
+        ttl (int, optional): seconds to cache the result, see tiered_cache.date_ttl. 
+            Defaults to TTL_RECENT
+
+    Returns:
+        DataFrame or None if the model did not return a table
+    """
+    return(http_client.run_sync(model_table_async(model_url, base_ewx_api_url, ttl)))
+
+
+async def model_table_async(model_url:str, base_ewx_api_url:str = BASE_EWX_API_URL, ttl:int = TTL_RECENT)->Union[DataFrame,None]:
+    """async version of model_table"""
+    key = model_run_key(model_url)
+    
+    async def run():
+        found, model_df = model_cache.get(key)
+        if found:
+            return(model_df)
+        model_data = await ewx_request_async(model_url, base_ewx_api_url)
+        model_df = DataFrame(model_data['Table']) if model_data and 'Table' in model_data else None
+        if model_df is not None:
+            model_cache.set(key, model_df, ttl)
+        return(model_df)
+    
+    model_df = await model_run_flights.do_async(key, run)
+    return(model_df.copy() if model_df is not None else None)
+
+
 def tomcast(station_code:str, 
             select_date:Union[datetime,date,None] = None, 
             date_start_accumulation = None,
-            weather:bool = True, base_rm_api_url:str = BASE_RM_API_URL, base_ewx_api_url:str = BASE_EWX_API_URL, ):
+            weather:bool = True, base_rm_api_url:str = BASE_RM_API_URL, base_ewx_api_url:str = BASE_EWX_API_URL, 
+            engine:str = TOMCAST_ENGINE):
     """generate model URL for the TOMCAST model.   Date optional (will use today's date if none given)
     
     Args:
@@ -141,10 +316,24 @@ def tomcast(station_code:str,
         weather (bool, optional): ask the api to include weather data with the model output. Defaults to True
         base_rm_api_url (str, optional): url to use for the rm api (model). Defaults to module constant BASE_RM_API_URL, which is production api
         base_ewx_api_url (str, optional): api to get a token from, defaults to BASE_EWX_API_URL.
+        engine (str, optional): 'rm-api' or 'local' to compute it from the hourly readings
+            (see tomcast.py). Defaults to TOMCAST_ENGINE
         
     Returns:
         Pandas DataFrame to send to UI for formatting
     """
+    return(http_client.run_sync(tomcast_async(station_code, select_date, date_start_accumulation, weather, base_rm_api_url, base_ewx_api_url, engine)))
+
+
+async def tomcast_async(station_code:str, 
+                        select_date:Union[datetime,date,None] = None, 
+                        date_start_accumulation = None,
+                        weather:bool = True, base_rm_api_url:str = BASE_RM_API_URL, base_ewx_api_url:str = BASE_EWX_API_URL, 
+                        engine:str = TOMCAST_ENGINE):
+    """async version of tomcast"""
+    if engine == 'local':
+        return(await tomcast_local_async(station_code, date_to_api_str(select_date), date_start_accumulation))
+    
     # model params    
     result_model_code:str = "tomcast"        
     select_date_str = date_to_api_str(select_date)
@@ -159,15 +348,16 @@ def tomcast(station_code:str,
         
     #example https://enviroweather.msu.edu/rm-api/api/db2/run?stationCode=EWXDAVIS01&stationType=6&selectDate=2024-08-01&resultModelCode=tomcast"
     model_url = f"{BASE_RM_API_URL}/db2/run?stationCode={station_code}&stationType={PWS_STATION_TYPE}&selectDate={select_date_str}&resultModelCode={result_model_code}&weather={weather}&dateStartAccumulation={date_start_accumulation_str}"    
-    model_data = ewx_request(model_url, base_ewx_api_url)
+    model_df = await model_table_async(model_url, base_ewx_api_url, ttl = date_ttl(select_date_str))
 
-    if model_data and 'Table' in model_data:
-        tomcast_df = DataFrame(model_data['Table']).sort_values(by='Date', axis=0, ascending=False)
+    if model_df is not None:
+        tomcast_df = model_df.sort_values(by='Date', axis=0, ascending=False)
         return(tomcast_df)
     else:        
         return(DataFrame([{}]))
     
-def weather_summary(station_code:str, select_date:Union[datetime,date,None] = None, weather:bool = True, base_rm_api_url:str = BASE_RM_API_URL, base_ewx_api_url:str = BASE_EWX_API_URL, ):
+def weather_summary(station_code:str, select_date:Union[datetime,date,None] = None, weather:bool = True, base_rm_api_url:str = BASE_RM_API_URL, base_ewx_api_url:str = BASE_EWX_API_URL, 
+                    incremental:bool = WEATHER_SUMMARY_INCREMENTAL, engine:str = WEATHER_SUMMARY_ENGINE):
     """get weathersummary api 
 
     Args:
@@ -175,20 +365,106 @@ def weather_summary(station_code:str, select_date:Union[datetime,date,None] = No
         select_date (datetime | date | None, optional): optional date or datetime. Defaults to None.  If none sent, creates current date using timezone sent
         base_rm_api_url (str, optional): url to use for the rm api (model). Defaults to module constant BASE_RM_API_URL, which is production api
         base_ewx_api_url (str, optional): api to get a token from, defaults to BASE_EWX_API_URL.
+        incremental (bool, optional): use the stored summary for the season and only add the days 
+            after it, see weather_summary_incremental. Defaults to WEATHER_SUMMARY_INCREMENTAL
+        engine (str, optional): 'rm-api' or 'local' to compute the whole season from the hourly readings,
+            with degree days for DEGREE_DAY_EXTRA_BASES too (see daily_summary.py). Defaults to WEATHER_SUMMARY_ENGINE
     """
+    return(http_client.run_sync(weather_summary_async(station_code, select_date, weather, base_rm_api_url, base_ewx_api_url, incremental, engine)))
+
+
+async def weather_summary_async(station_code:str, select_date:Union[datetime,date,None] = None, weather:bool = True, 
+                                base_rm_api_url:str = BASE_RM_API_URL, base_ewx_api_url:str = BASE_EWX_API_URL, 
+                                incremental:bool = WEATHER_SUMMARY_INCREMENTAL, engine:str = WEATHER_SUMMARY_ENGINE):
+    """async version of weather_summary"""
+    if engine == 'local':
+        return(await weather_summary_local_async(station_code, end_date = date_to_api_str(select_date)))
+    
+    if incremental:
+        return(await weather_summary_incremental_async(station_code, select_date, base_rm_api_url, base_ewx_api_url))
      
     result_model_code:str = "weathersummary"        
     select_date_str = date_to_api_str(select_date)
     model_url = f"{BASE_RM_API_URL}/db2/run?stationCode={station_code}&stationType={PWS_STATION_TYPE}&selectDate={select_date_str}&resultModelCode={result_model_code}"
-    model_data = ewx_request(model_url, base_ewx_api_url)
-    if model_data and 'Table' in model_data:
-        weather_df= DataFrame(model_data['Table'])
+    weather_df = await model_table_async(model_url, base_ewx_api_url, ttl = date_ttl(select_date_str))
+    if weather_df is not None:
         weather_df.sort_values(by='date', axis=0, ascending=False, inplace=True)      
         
     else:
         weather_df = DataFrame([{}])    
     return(weather_df)
 
+
+# daily weather summary rows for complete days, per station and season 
+weather_summary_store = TieredCache('weather_summary')
+
+def weather_summary_incremental(station_code:str, select_date:Union[datetime,date,None] = None, 
+                                base_rm_api_url:str = BASE_RM_API_URL, base_ewx_api_url:str = BASE_EWX_API_URL):
+    """weather summary from Jan 1 to select_date, pulling the full season from the RM-API 
+    only the first time.  
+    
+    The days of the season that are complete are stored per station.  After that,
+    only the days after the last stored day are computed, from the hourly PWS readings
+    (see daily_summary.py), and the *_accum columns are rebuilt from the daily values.  
+    Days are stored once they are settled, complete or HOURLY_SETTLE_DAYS after they 
+    are over if some hours are missing (see pwsapi.hourly_day_settled). 
+
+    Args:
+        station_code (str): PWS station code valid from database
+        select_date (datetime | date | None, optional): last day of the summary. Defaults to None, which is today
+        base_rm_api_url (str, optional): url to use for the rm api (model). Defaults to module constant BASE_RM_API_URL
+        base_ewx_api_url (str, optional): api to get a token from, defaults to BASE_EWX_API_URL.
+
+    Returns:
+        DataFrame like weather_summary, sorted by date descending
+    """
+    return(http_client.run_sync(weather_summary_incremental_async(station_code, select_date, base_rm_api_url, base_ewx_api_url)))
+
+
+async def weather_summary_incremental_async(station_code:str, select_date:Union[datetime,date,None] = None, 
+                                            base_rm_api_url:str = BASE_RM_API_URL, base_ewx_api_url:str = BASE_EWX_API_URL):
+    """async version of weather_summary_incremental"""
+    select = as_date(date_to_api_str(select_date))
+    local_today = today_localtime(MICHIGAN_TIME_ZONE_KEY)
+    store_key = f"{base_rm_api_url}|{station_code}|{select.year}"
+    found, stored = weather_summary_store.get(store_key)
+    
+    if not found or stored.empty:
+        season = await weather_summary_async(station_code, select, base_rm_api_url=base_rm_api_url, 
+                                             base_ewx_api_url=base_ewx_api_url, incremental=False, engine='rm-api')
+        if 'date' in season.columns:
+            season = season.assign(date = season['date'].astype(str).str[:10])
+            for column in SINGLE_COLUMNS:
+                if column in season.columns:
+                    season[column] = to_numeric(season[column], errors='coerce')
+            complete = season[season['date'] < str(local_today)]
+            if not complete.empty:
+                weather_summary_store.set(store_key, complete.sort_values('date', ignore_index=True), TTL_FOREVER)
+        return(season)
+    
+    last_stored = date.fromisoformat(stored['date'].max())
+    if select <= last_stored:
+        season = stored[stored['date'] <= str(select)]
+        return(season.sort_values(by='date', ascending=False, ignore_index=True))
+    
+    # add the days after the last stored day from hourly readings
+    start = last_stored + timedelta(days=1)
+    hourly_readings = await get_hourly_readings_async(station_code, start_date=str(start), end_date=str(select))
+    new_days = await asyncio.to_thread(daily_summary, hourly_readings)
+    season = await asyncio.to_thread(add_accumulations, concat([stored, new_days], ignore_index=True))
+    
+    # store the new days that can no longer change
+    readings_by_day = {}
+    for reading in hourly_readings:
+        readings_by_day.setdefault(str(reading.get('represented_date'))[:10], []).append(reading)
+    settled = [day for day in new_days['date'] 
+               if hourly_day_settled(readings_by_day.get(day, []), date.fromisoformat(day), local_today)]
+    if settled:
+        weather_summary_store.set(store_key, season[season['date'] <= max(settled)], TTL_FOREVER)
+
+    return(season.sort_values(by='date', ascending=False, ignore_index=True))
+
+
 weather_summary_table_headers = {'date': 'Date',
  'atmp_min': 'Min Temp (F)',
  'atmp_max': 'Max Temp (F)',
@@ -212,7 +488,7 @@ weather_summary_table_headers = {'date': 'Date',
  'atmp_avg_metric': 'Avg Temp (C)',
  'pcpn_single_metric': 'Rainfall Daily (mm)',
  'pcpn0_accum_metric': 'Rainfall Since 1/1 (mm)'
- }
+ } | degree_day_headers(DEGREE_DAY_EXTRA_BASES)
 
 
 def applescab(station_code:str, 
@@ -220,6 +496,7 @@ def applescab(station_code:str,
                gt_start:date = None,
                base_rm_api_url:str = BASE_RM_API_URL, 
                base_ewx_api_url:str = BASE_EWX_API_URL, 
+               engine:str = APPLESCAB_ENGINE,
                )->DataFrame: 
     """request the applescab model from the RM-API and return data frame
 
@@ -231,18 +508,42 @@ def applescab(station_code:str,
             which tells the model to estimate green tip based on DD
         base_rm_api_url (str, optional): URL for rm api. Defaults to BASE_RM_API_URL.
         base_ewx_api_url (str, optional): UR for ewx web api. Defaults to BASE_EWX_API_URL.
+        engine (str, optional): 'rm-api' or 'local' to compute it from the hourly readings
+            (see applescab.py). Defaults to APPLESCAB_ENGINE
         
     """
+    return(http_client.run_sync(applescab_async(station_code, select_date, gt_start, base_rm_api_url, base_ewx_api_url, engine)))
+
+
+async def applescab_async(station_code:str, 
+                          select_date:date = None, 
+                          gt_start:date = None,
+                          base_rm_api_url:str = BASE_RM_API_URL, 
+                          base_ewx_api_url:str = BASE_EWX_API_URL, 
+                          engine:str = APPLESCAB_ENGINE,
+                          )->DataFrame:
+    """async version of applescab"""
+    if engine == 'local':
+        select_date_str = date_to_api_str(select_date)
+        if not gt_start:
+            # estimate green tip from degree days, as the RM-API does
+            season = await weather_summary_async(station_code, select_date_str, base_rm_api_url=base_rm_api_url, 
+                                                 base_ewx_api_url=base_ewx_api_url)
+            if 'dd2_accum' not in season.columns:
+                return(DataFrame([{}]))
+            gt_start = green_tip_date(season)
+            if not gt_start:
+                # no green tip yet, so no infection periods
+                return(DataFrame(columns=APPLESCAB_COLUMNS))
+        return(await applescab_local_async(station_code, select_date_str, gt_start))
     
     result_model_code:str = "applescab"        
     select_date_str = date_to_api_str(select_date)
     gt_start_str = date_to_api_str(gt_start, default_date="")        
     model_url = f"{base_rm_api_url}/db2/run?stationCode={station_code}&stationType={PWS_STATION_TYPE}&selectDate={select_date_str}&resultModelCode={result_model_code}&gtStart={gt_start_str}"
-    model_data = ewx_request(model_url, base_ewx_api_url)    
+    model_df = await model_table_async(model_url, base_ewx_api_url, ttl = date_ttl(select_date_str))    
     
-    if model_data and 'Table' in model_data:
-        model_df= DataFrame(model_data['Table']) # .sort_values(by='startDateTime', axis=0, ascending=False)       
-    else:
+    if model_df is None:
         model_df = DataFrame([{}])    
     return(model_df)
 
@@ -0,0 +1,330 @@
+""" http_client.py: shared, pooled HTTP client used by pwsapi and ewx_api
+
+Every request to the PWS API and the Enviroweather APIs goes through this module
+so that TCP/TLS connections are re-used (keep-alive) instead of opened for each
+call.  There is one requests.Session per host, each with its own connection
+pool, and every request has a connect and read timeout.
+
+The async functions (request_async, get_async) send requests with httpx from one
+event loop that runs in a background thread, with one AsyncClient per host, so
+many requests can wait on slow APIs at the same time without a thread each, and
+connections are re-used across callbacks.  They can be awaited from any event 
+loop.  run_sync() runs a coroutine for callers that are not async on an event loop 
+of the calling thread, so only the requests go through the http loop, and cache 
+reads and data work stay in the caller's thread, in parallel with other callers.
+Sync and async requests share the HTTP_MAX_CONCURRENT limit and the latency stats.
+
+Configuration from environment variables (see example-dot-env.txt):
+
+- `HTTP_CONNECT_TIMEOUT` seconds to wait to open a connection, default 5
+- `HTTP_READ_TIMEOUT` seconds to wait for a response, default 60 (model runs are slow)
+- `HTTP_POOL_SIZE` connections kept open per host, default 10
+- `HTTP_MAX_CONCURRENT` max number of requests in flight at once from this process, default 20
+"""
+
+import asyncio
+import atexit
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv, getpid
+from time import perf_counter
+from urllib.parse import urlsplit
+from warnings import warn
+
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_CONNECT_TIMEOUT:float = float(getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT:float = float(getenv('HTTP_READ_TIMEOUT', 60))
+HTTP_POOL_SIZE:int = int(getenv('HTTP_POOL_SIZE', 10))
+HTTP_MAX_CONCURRENT:int = int(getenv('HTTP_MAX_CONCURRENT', 20))
+
+_sessions:dict = {}
+_sessions_lock = threading.Lock()
+_concurrency = threading.BoundedSemaphore(HTTP_MAX_CONCURRENT)
+
+_stats:dict = {}
+_stats_lock = threading.Lock()
+
+# event loop for the async requests, made again in a forked process (threads don't survive a fork)
+_loop:dict = {'loop': None, 'clients': {}}
+_loop_lock = threading.Lock()
+
+# event loop of each thread that calls run_sync, kept for the next call, and closed at exit
+_thread_loops = threading.local()
+_kept_loops:list = []
+
+# threads that run the coroutines of run_sync calls made from a running event loop
+# (sync functions in async callbacks), each keeps its event loop.  Made on first use
+_run_sync_pool:dict = {'executor': None}
+
+# process the pools, request slots and loop above belong to, see _reset_after_fork
+_process:dict = {'pid': getpid()}
+
+
+def _reset_after_fork():
+    """start a forked process (gunicorn worker, background callback) without the parent's 
+    connections, request slots and event loop.  Its pooled sockets would be shared with the 
+    parent, the slots of requests the parent had in flight would never be released, and the 
+    loop thread is not running.  The sessions are dropped, not closed, the sockets are the parent's"""
+    global _concurrency, _sessions_lock, _loop_lock, _stats_lock
+    _sessions.clear()
+    _concurrency = threading.BoundedSemaphore(HTTP_MAX_CONCURRENT)
+    _sessions_lock = threading.Lock()
+    _loop_lock = threading.Lock()
+    _stats_lock = threading.Lock()
+    _loop.update(loop = None, clients = {})
+    _run_sync_pool['executor'] = None
+    _kept_loops.clear()
+    _process['pid'] = getpid()
+
+
+def _check_process():
+    if _process['pid'] != getpid():
+        _reset_after_fork()
+
+# runs in the child right after a fork, while it has only one thread; the pid check 
+# catches forks that skip the hook
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child = _reset_after_fork)
+
+
+def host_of(url:str)->str:
+    """scheme and host:port part of a url, used as the key for pools and stats"""
+    parts = urlsplit(url)
+    return(f"{parts.scheme}://{parts.netloc}")
+
+
+def session_for(url:str)->requests.Session:
+    """get the keep-alive session for the host of this url, creating it on first use
+
+    Args:
+        url (str): any url on the host
+
+    Returns:
+        requests.Session: session with a connection pool for that host
+    """
+    _check_process()
+    host = host_of(url)
+    session = _sessions.get(host)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount(host, adapter)
+                _sessions[host] = session
+    return(session)
+
+
+def _record_latency(host:str, seconds:float, ok:bool):
+    with _stats_lock:
+        s = _stats.setdefault(host, {'count':0, 'errors':0, 'total_seconds':0.0, 'max_seconds':0.0})
+        s['count'] += 1
+        s['total_seconds'] += seconds
+        s['max_seconds'] = max(s['max_seconds'], seconds)
+        s['last_seconds'] = seconds
+        if not ok:
+            s['errors'] += 1
+
+
+def request(method:str, url:str, timeout:tuple = None, **kwargs):
+    """issue an HTTP request using the pooled session for the host of url
+
+    Blocks if HTTP_MAX_CONCURRENT requests are already in flight.
+    Connection errors and timeouts are not raised, but warned and None returned,
+    so callers can treat them like any other failed request.
+
+    Args:
+        method (str): HTTP method e.g. "GET"
+        url (str): full url
+        timeout (tuple, optional): (connect, read) timeout in seconds.
+            Defaults to (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        kwargs: passed on to requests.Session.request (headers, params, data...)
+
+    Returns:
+        requests.Response or None if the request could not be completed
+    """
+    if timeout is None:
+        timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+    session = session_for(url)
+    host = host_of(url)
+    with _concurrency:
+        start = perf_counter()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            _record_latency(host, perf_counter() - start, ok=False)
+            warn(f"request failed {method} {url}: {e}")
+            return(None)
+
+    _record_latency(host, perf_counter() - start, ok=response.status_code < 400)
+    return(response)
+
+
+def get(url:str, **kwargs):
+    """GET using the pooled session, see request()"""
+    return(request("GET", url, **kwargs))
+
+
+def latency_stats()->dict:
+    """per-host request counters: count, errors, total, mean, max and last latency in seconds
+
+    Returns:
+        dict: keyed on host
+    """
+    with _stats_lock:
+        stats = {host: dict(s) for host, s in _stats.items()}
+    for s in stats.values():
+        s['mean_seconds'] = s['total_seconds']/s['count'] if s['count'] else 0.0
+    return(stats)
+
+
+def reset_latency_stats():
+    """clear the latency counters"""
+    with _stats_lock:
+        _stats.clear()
+
+
+#### ASYNC REQUESTS
+
+def http_loop()->asyncio.AbstractEventLoop:
+    """the event loop the async requests run on, started in a background thread on first use"""
+    _check_process()
+    if _loop['loop'] is not None:
+        return(_loop['loop'])
+    with _loop_lock:
+        if _loop['loop'] is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="http-client-loop", daemon=True).start()
+            _loop.update(loop = loop, clients = {})
+    return(_loop['loop'])
+
+
+def run_sync(coroutine):
+    """run a coroutine to the end and return its result, for callers that are not async.
+
+    The coroutine runs on an event loop of the calling thread (kept for its next call), 
+    only the requests it awaits are sent from the http loop.  Called from a thread whose 
+    event loop is running (a sync function in an async callback) it runs on a thread of
+    a pool, up to HTTP_MAX_CONCURRENT, while the caller waits.  Not from the http loop, 
+    async code there should await the coroutine"""
+    _check_process()
+    running = _running_loop()
+    if running is None:
+        return(_thread_loop().run_until_complete(coroutine))
+    if running is _loop['loop']:
+        coroutine.close()
+        raise RuntimeError("run_sync() called on the http loop, await the async function instead")
+    if getattr(_thread_loops, 'in_pool', False):
+        # called by a coroutine on a pool thread, waiting for another pool thread could 
+        # use up the pool, so run it on a thread of its own with a loop that is closed after
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="run-sync-nested") as executor:
+            return(executor.submit(asyncio.run, coroutine).result())
+    return(_run_sync_executor().submit(run_sync, coroutine).result())
+
+
+def _run_sync_executor()->ThreadPoolExecutor:
+    if _run_sync_pool['executor'] is None:
+        with _loop_lock:
+            if _run_sync_pool['executor'] is None:
+                _run_sync_pool['executor'] = ThreadPoolExecutor(
+                    max_workers = HTTP_MAX_CONCURRENT, thread_name_prefix = "run-sync", 
+                    initializer = setattr, initargs = (_thread_loops, 'in_pool', True))
+    return(_run_sync_pool['executor'])
+
+
+def _thread_loop()->asyncio.AbstractEventLoop:
+    """event loop for run_sync in this thread, a new one after a fork"""
+    loop = getattr(_thread_loops, 'loop', None)
+    if loop is None or loop.is_closed() or _thread_loops.pid != getpid():
+        loop = asyncio.new_event_loop()
+        _thread_loops.loop, _thread_loops.pid = loop, getpid()
+        with _loop_lock:
+            _kept_loops.append(loop)
+    return(loop)
+
+
+@atexit.register
+def _close_kept_loops():
+    for loop in _kept_loops:
+        if not loop.is_running() and not loop.is_closed():
+            loop.close()
+
+
+def async_client_for(url:str):
+    """httpx.AsyncClient for the host of this url, made on first use.  Only use it on the http loop"""
+    import httpx
+    host = host_of(url)
+    client = _loop['clients'].get(host)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout = httpx.Timeout(HTTP_READ_TIMEOUT, connect = HTTP_CONNECT_TIMEOUT),
+            limits = httpx.Limits(max_connections = HTTP_MAX_CONCURRENT, max_keepalive_connections = HTTP_POOL_SIZE))
+        _loop['clients'][host] = client
+    return(client)
+
+
+async def request_async(method:str, url:str, timeout:tuple = None, **kwargs):
+    """async version of request(), the request is sent from the http loop 
+
+    Waits (without blocking the event loop) if HTTP_MAX_CONCURRENT requests are in flight.
+    Connection errors and timeouts are warned and None returned, as in request()
+
+    Args:
+        method (str): HTTP method e.g. "GET"
+        url (str): full url
+        timeout (tuple, optional): (connect, read) timeout in seconds.
+            Defaults to (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        kwargs: passed on to httpx.AsyncClient.request (headers, params...)
+
+    Returns:
+        httpx.Response or None if the request could not be completed.  Like a 
+        requests.Response it has status_code, text and json()
+    """
+    loop = http_loop()
+    coroutine = _request_on_http_loop(method, url, timeout, **kwargs)
+    if _running_loop() is loop:
+        return(await coroutine)
+    return(await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop)))
+
+
+async def get_async(url:str, **kwargs):
+    """async GET from the http loop, see request_async()"""
+    return(await request_async("GET", url, **kwargs))
+
+
+def _running_loop():
+    try:
+        return(asyncio.get_running_loop())
+    except RuntimeError:
+        return(None)
+
+
+async def _request_on_http_loop(method:str, url:str, timeout:tuple = None, **kwargs):
+    import httpx
+    if timeout is not None:
+        connect, read = timeout
+        kwargs['timeout'] = httpx.Timeout(read, connect = connect)
+
+    client = async_client_for(url)
+    host = host_of(url)
+    # same limit as the sync requests, so poll instead of blocking the loop
+    while not _concurrency.acquire(blocking = False):
+        await asyncio.sleep(0.01)
+    try:
+        start = perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            _record_latency(host, perf_counter() - start, ok=False)
+            warn(f"request failed {method} {url}: {e}")
+            return(None)
+    finally:
+        _concurrency.release()
+
+    _record_latency(host, perf_counter() - start, ok=response.status_code < 400)
+    return(response)
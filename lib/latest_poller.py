@@ -0,0 +1,162 @@
+""" latest_poller.py: one schedule for the latest readings of the stations people are watching
+
+Each open page used to ask the PWS API for the latest reading of its station
+on its own timer, so the number of requests grew with the number of users.
+The poller keeps the latest reading of every station that at least one page is
+watching, reloads them all on one schedule in a background thread, and wakes
+up the pages (see app.py /events/latest) when a reading changes.  The number of
+requests depends on the number of stations being watched, not on the number of pages.
+
+Configuration from environment variables:
+
+- `LATEST_POLL_SECONDS` seconds between reloads of the latest readings, default 120
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from warnings import warn
+
+from .pwsapi import refresh_latest_readings, STATION_FETCH_WORKERS
+
+LATEST_POLL_SECONDS:int = int(getenv('LATEST_POLL_SECONDS', 120))
+
+# fields that change with every request, a reading with only these changed is not new
+VOLATILE_READING_FIELDS = ('minutes_since_latest_reading',)
+
+
+class LatestReadingsPoller:
+    """latest readings of watched stations, with a version per station that
+    increases when a new reading arrives
+
+    Example:
+        poller = LatestReadingsPoller()
+        poller.start()
+        poller.subscribe(station_code)
+        version, reading = poller.latest(station_code)
+        version, reading = poller.wait_for_change(station_code, version, timeout = 30)
+        poller.unsubscribe(station_code)
+    """
+
+    def __init__(self, loader = refresh_latest_readings, poll_seconds:int = LATEST_POLL_SECONDS,
+                 max_workers:int = STATION_FETCH_WORKERS):
+        """
+        Args:
+            loader (callable, optional): function of a station code that returns the latest reading
+                from the API. Defaults to pwsapi.refresh_latest_readings
+            poll_seconds (int, optional): time between reloads. Defaults to LATEST_POLL_SECONDS
+            max_workers (int, optional): stations requested at once. Defaults to STATION_FETCH_WORKERS
+        """
+        self.loader = loader
+        self.poll_seconds = poll_seconds
+        self.max_workers = max_workers
+        self._watchers:dict = {}
+        self._readings:dict = {}
+        self._versions:dict = {}
+        self._changed = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self.polls:int = 0
+
+    def subscribe(self, station_code:str):
+        """start watching a station, the first page to watch it gets a reading right away"""
+        with self._changed:
+            self._watchers[station_code] = self._watchers.get(station_code, 0) + 1
+            first = station_code not in self._readings
+        if first:
+            self.poll([station_code])
+
+    def unsubscribe(self, station_code:str):
+        """stop watching a station, it is no longer polled when no page is watching it"""
+        with self._changed:
+            watchers = self._watchers.get(station_code, 0) - 1
+            if watchers > 0:
+                self._watchers[station_code] = watchers
+            else:
+                self._watchers.pop(station_code, None)
+                self._readings.pop(station_code, None)
+                self._versions.pop(station_code, None)
+
+    def latest(self, station_code:str)->tuple:
+        """(version, reading) of a station, reading is {} if there is none yet"""
+        with self._changed:
+            return((self._versions.get(station_code, 0), self._readings.get(station_code, {})))
+
+    @property
+    def stopped(self)->bool:
+        """True after stop(), pages waiting on the poller should end their streams"""
+        return(self._stop.is_set())
+
+    def wait_for_change(self, station_code:str, version:int, timeout:float = None)->tuple:
+        """wait until the station has a reading newer than version, or timeout seconds.
+        Returns right away once the poller is stopped, see stopped
+
+        Returns:
+            tuple: (version, reading), the same version if nothing changed before the timeout
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._versions.get(station_code, 0) != version or self._stop.is_set(),
+                                   timeout = timeout)
+        return(self.latest(station_code))
+
+    def poll(self, station_codes = None):
+        """reload the latest readings of the stations, default all watched stations,
+        and wake up the pages waiting on the ones that changed"""
+        if station_codes is None:
+            with self._changed:
+                station_codes = list(self._watchers)
+        if not station_codes:
+            return
+
+        with ThreadPoolExecutor(max_workers = min(self.max_workers, len(station_codes))) as executor:
+            readings = dict(zip(station_codes, executor.map(self._load, station_codes)))
+
+        with self._changed:
+            self.polls += 1
+            changed = False
+            for station_code, reading in readings.items():
+                if reading is None or station_code not in self._watchers:
+                    continue
+                if station_code not in self._readings or not same_reading(reading, self._readings[station_code]):
+                    self._readings[station_code] = reading
+                    self._versions[station_code] = self._versions.get(station_code, 0) + 1
+                    changed = True
+            if changed:
+                self._changed.notify_all()
+
+    def stats(self)->dict:
+        with self._changed:
+            return({'watched_stations': len(self._watchers), 'watchers': sum(self._watchers.values()), 'polls': self.polls})
+
+    def start(self):
+        """start polling in a background thread, if not already started"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="latest-readings-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """stop the background thread and wake up the pages waiting on it"""
+        self._stop.set()
+        with self._changed:
+            self._changed.notify_all()
+
+    def _load(self, station_code):
+        try:
+            return(self.loader(station_code))
+        except Exception as e:
+            warn(f"could not get latest reading for {station_code}: {e}")
+            return(None)
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            self.poll()
+
+
+def same_reading(reading:dict, other_reading:dict, ignore_fields = VOLATILE_READING_FIELDS)->bool:
+    """True if two latest readings are the same reading, not counting the ignore_fields"""
+    if not (isinstance(reading, dict) and isinstance(other_reading, dict)):
+        return(reading == other_reading)
+    return({k:v for k,v in reading.items() if k not in ignore_fields} == 
+           {k:v for k,v in other_reading.items() if k not in ignore_fields})
@@ -1,7 +1,7 @@
 
 # pws_components.py  reuseable components for pages
-from dash import html, dcc
-import plotly.express as px
+from dash import html, dcc, Patch, no_update
+from .timeseries_viz import line_figure
 
 
 import dash_bootstrap_components as dbc
@@ -10,10 +10,16 @@ from zoneinfo import ZoneInfo
 from datetime import date, timedelta
 
 from .pwsapi import get_hourly_readings,latest_readings, get_station_codes, get_station_data, get_all_stations
+from .pwsapi import get_hourly_readings_async, latest_readings_async
+from . import http_client
 import dash_ag_grid as dag
 from pandas import DataFrame
+import asyncio
 
-from .converters import hour_number2clock_str, degree2compass, kph2mph, c2f, mm2inch, today_localtime_str, first_of_year_string, first_of_last_year_string, days_ago
+from .converters import hour_number2clock_str, hour_number2clock_array, degree2compass, degree2compass_array, kph2mph, c2f, mm2inch, today_localtime, today_localtime_str, first_of_year_string, first_of_last_year_string, days_ago
+from .singleflight import SingleFlight
+from .tiered_cache import TieredCache, as_date, TTL_LATEST
+from .latest_poller import same_reading
 
 
 
@@ -78,20 +84,21 @@ def station_current_temperature(station_code):
     return(latest['atmp'])
     
         
-def station_table_narrow(station_records, selected_row = None):
-    """table of stations with a few carefully columns for narrow column display
+def station_table_rows(station_records)->list:
+    """rows for the narrow station table, one per station with a few carefully chosen columns
 
     Args:
         station_records (dict[dict]): dictionary of station records keyed on station code that comes from API
         
     Returns:
-        dash_ag_grid.AgGrid table for placing on dash page with cols station_code, type and location. 
-        does not include latest_reading since the dash app does not update this table. 
-        
+        list[dict]: row records with station_code, type, location and status
     """
     # convert the dictionary of records into an array and then a data frame. 
     
     df = DataFrame(list(station_records.values()))
+    if df.empty:
+        return([])
+    
     # select and rename columns
     table_df = DataFrame().assign(station_code = df.station_code, 
                                      type=df['station_type'] + " (" + df["sampling_interval"].map(str)+" min)",                                     
@@ -99,14 +106,29 @@ def station_table_narrow(station_records, selected_row = None):
                                      status = df.active.apply(lambda a: "active" if a else "inactive") ,
                                      # latest_reading = df.latest_reading_datetime
                                      )
+    return(table_df.to_dict('records'))
+
     
-    station_fields = list(table_df.columns)
+def station_table_narrow(station_records, selected_row = None):
+    """table of stations with a few carefully columns for narrow column display
+
+    Args:
+        station_records (dict[dict]): dictionary of station records keyed on station code that comes from API
+        
+    Returns:
+        dash_ag_grid.AgGrid table for placing on dash page with cols station_code, type and location. 
+        does not include latest_reading since the dash app does not update this table. 
+        Rows are identified by station_code so they can be updated with row transactions
+        
+    """
+    station_fields = ['station_code', 'type', 'location', 'status']
     station_column_defs = [{"field": f} for f in station_fields]
 
     grid = dag.AgGrid(
         id="station_table",
-        rowData = table_df.to_dict('records'),
+        rowData = station_table_rows(station_records),
         columnDefs = station_column_defs,
+        getRowId = "params.data.station_code",
         defaultColDef={"resizable": True, "sortable": True, "filter": True},
         columnSize="sizeToFit",
         dashGridOptions={"rowSelection": "single", "cellSelection": False, "animateRows": False},
@@ -119,67 +141,103 @@ def station_table_narrow(station_records, selected_row = None):
 def latest_readings_values(station_code, threshold_data_note_recent_enough_hours = 6):
     """get latest reading but check if it's too old for the UI to display"""
     r = latest_readings(station_code = station_code)
-    
-    if 'minutes_since_latest_reading' in r and r['minutes_since_latest_reading'] < threshold_data_note_recent_enough_hours*60:
+    return(recent_reading(r, threshold_data_note_recent_enough_hours))
+
+
+async def latest_readings_values_async(station_code, threshold_data_note_recent_enough_hours = 6):
+    """async version of latest_readings_values"""
+    r = await latest_readings_async(station_code = station_code)
+    return(recent_reading(r, threshold_data_note_recent_enough_hours))
+
+
+def recent_reading(r, threshold_data_note_recent_enough_hours = 6):
+    """the latest reading if it's recent enough for the UI to display, else {}"""
+    if isinstance(r, dict) and 'minutes_since_latest_reading' in r and r['minutes_since_latest_reading'] < threshold_data_note_recent_enough_hours*60:
         return(r) 
     else:
         return {}
 
 
-def hourly_readings_dataframe(station_code, for_date = None):
+def hourly_readings_dataframe(station_code, for_date = None, end_date = None):
     """wrangle data from hourly summary from pws api into dataframe for
     presentation in American units
 
     Args:
         station_code (_type_): _description_
         for_date (_type_, optional): _description_. Defaults to None.
+        end_date (_type_, optional): last day for several days of readings. Defaults to None, 
+            which is just for_date
     """
     
     if station_code:
         # get a data frame of readings or empty df
-        hourly_weather_json = get_hourly_readings(station_code=station_code, start_date = for_date) 
-        if not hourly_weather_json:
-            return("No Data")        
-        
-        weather_df = DataFrame(hourly_weather_json)
-        # filter out incomplete hours by ensuring record_count is all readings/hour
-        weather_df = weather_df[weather_df["record_count"] >= weather_df["api_hourly_frequency"]]
-
-        if(weather_df is None or (type(weather_df) != type(DataFrame([{}]))) or weather_df.empty):
-            return("No Data")        
-        else:
-            view_df = DataFrame().assign(
-                # date = weather_df['represented_date'],
-                hour     = weather_df.represented_hour,
-                time     = weather_df.represented_hour.map(hour_number2clock_str), 
-                atmp     = round(c2f(weather_df.atmp_avg_hourly),1),
-                relh     = round(weather_df.relh_avg_hourly,0),
-                pcpn     = round(mm2inch(weather_df.pcpn_total_hourly),2),
-                lws_pwet = weather_df.lws_pwet_hourly,
-                wspd     = round(kph2mph(weather_df.wspd_avg_hourly),1),
-                wspd_max = weather_df.wspd_max_hourly,
-                wdir_avg = weather_df.wdir_avg_hourly.map(degree2compass)
-            )
-            
-            view_df = view_df.sort_values(by=['hour'], ascending=False)
-            return(view_df)
-        
-            #df_table = dbc.Table.from_dataframe(df)
-            #return(df_table)
+        hourly_weather_json = get_hourly_readings(station_code=station_code, start_date = for_date, end_date = end_date) 
+        return(hourly_readings_view(hourly_weather_json))
     else:
         return("Select a station code")
+
+
+async def hourly_readings_dataframe_async(station_code, for_date = None, end_date = None):
+    """async version of hourly_readings_dataframe"""
+    if station_code:
+        hourly_weather_json = await get_hourly_readings_async(station_code=station_code, start_date = for_date, end_date = end_date) 
+        return(hourly_readings_view(hourly_weather_json))
+    else:
+        return("Select a station code")
+
+
+def hourly_readings_view(hourly_weather_json):
+    """hourly readings from the PWS API as a data frame in American units, 
+    for hourly_readings_dataframe, or "No Data" """
+    if not hourly_weather_json:
+        return("No Data")        
+    
+    weather_df = DataFrame(hourly_weather_json)
+    if "record_count" not in weather_df.columns:
+        return("No Data")
+    # filter out incomplete hours by ensuring record_count is all readings/hour
+    weather_df = weather_df[weather_df["record_count"] >= weather_df["api_hourly_frequency"]]
+
+    if(weather_df is None or (type(weather_df) != type(DataFrame([{}]))) or weather_df.empty):
+        return("No Data")        
+    else:
+        view_df = DataFrame().assign(
+            date     = weather_df.represented_date.astype(str).str[:10],
+            hour     = weather_df.represented_hour,
+            time     = hour_number2clock_array(weather_df.represented_hour), 
+            atmp     = round(c2f(weather_df.atmp_avg_hourly),1),
+            relh     = round(weather_df.relh_avg_hourly,0),
+            pcpn     = round(mm2inch(weather_df.pcpn_total_hourly),2),
+            lws_pwet = weather_df.lws_pwet_hourly,
+            wspd     = round(kph2mph(weather_df.wspd_avg_hourly),1),
+            wspd_max = weather_df.wspd_max_hourly,
+            wdir_avg = degree2compass_array(weather_df.wdir_avg_hourly)
+        )
+        
+        view_df = view_df.sort_values(by=['date', 'hour'], ascending=False)
+        return(view_df)
     
 
 
-def hourly_readings_table(station_code, for_date = None):
+def hourly_readings_table(station_code, for_date = None, end_date = None, readings_df:DataFrame = None):
+    """grid of hourly readings for a day or several days
 
-    readings_df = hourly_readings_dataframe(station_code, for_date)
+    Args:
+        station_code (str): valid PWS station code from database
+        for_date (str, optional): first day. Defaults to None, which is today
+        end_date (str, optional): last day. Defaults to None, which is for_date
+        readings_df (DataFrame, optional): readings from hourly_readings_dataframe already 
+            pulled for these dates, e.g. from the station context.  Defaults to None, which pulls them
+    """
+    if readings_df is None:
+        readings_df = hourly_readings_dataframe(station_code, for_date, end_date)
     
     if(readings_df is None or (type(readings_df) != type(DataFrame([{}]))) or readings_df.empty):
         return(html.Div("no recent data", className="fw-bold"))
     
     
     weather_column_defs = [
+        { 'headerName': 'Date', 'field': 'date', 'hide': bool(not end_date or end_date == for_date)},
         { 'headerName': 'hour', 'field': 'hour', 'hide':'true'},
         { 'headerName': 'Time', 'field': 'time',  'sortable': False  },
         { 'headerName': 'Air Temp (F)', 'field': 'atmp' },
@@ -191,16 +249,26 @@ def hourly_readings_table(station_code, for_date = None):
         { 'headerName': 'Wind Direction (avg)', 'field': 'wdir_avg' },
         ]
     
-    readings_table = dag.AgGrid(
-        id="readings_table",
-        rowData = readings_df.to_dict('records'),
-        columnDefs = weather_column_defs,
-        defaultColDef={"resizable": True, "sortable": True, 
+    default_col_def = {"resizable": True, "sortable": True, 
                     "filter": False,
                     "initialWidth": 200,
                     "wrapHeaderText": True,
                     "autoHeaderHeight": True,
-                    },
+                    }
+    
+    # one day fits on a page, so send it all.  More than that is sent a page at a time 
+    if len(readings_df) > GRID_PAGE_SIZE:
+        dates = f"{for_date or ''}/{end_date or ''}"
+        return(paged_grid(paged_grid_id('hourly', station_code, dates), 
+                          weather_column_defs, 
+                          default_col_def = default_col_def, 
+                          sort_model = [{"colId": "date", "sort": "desc"}]))
+    
+    readings_table = dag.AgGrid(
+        id="readings_table",
+        rowData = readings_df.to_dict('records'),
+        columnDefs = weather_column_defs,
+        defaultColDef=default_col_def,
         columnSize="sizeToFit",
         # dashGridOptions={"rowSelection": "single", "cellSelection": False, "animateRows": False},        
     )
@@ -210,6 +278,175 @@ def hourly_readings_table(station_code, for_date = None):
     return(readings_table)
 
 
+def hourly_readings_paged_frame(station_code:str, dates:str)->DataFrame:
+    """hourly readings for the paged grid, dates is 'start/end' """
+    for_date, end_date = (dates.split("/") + [""])[:2]
+    readings_df = hourly_readings_dataframe(station_code, for_date or None, end_date or None)
+    return(readings_df if isinstance(readings_df, DataFrame) else DataFrame())
+
+
+
+#### STATION CONTEXT
+# what the page shows for the selected station is loaded once per selection 
+# (and timer tick) by station_context, kept in a dcc.Store on the page, and the 
+# latest weather cards, hourly table and weather graph are drawn from that store
+
+def station_context(station_code:str, station:dict = None, include_summary:bool = True)->dict:
+    """everything the page shows for a station, with the upstream calls made at the same time
+
+    The season's weather summary is too big to send to the page, so it is pulled
+    into the summary frame cache (see weather_summary_frame) and the graph reads it from there.
+
+    Args:
+        station_code (str): valid PWS station code from database
+        station (dict, optional): station record from the station registry
+        include_summary (bool, optional): also pull the weather summary.  Defaults to True, 
+            False for refreshing the context of a station that is already showing
+
+    Returns:
+        dict: 'station_code', 'station' record, 'date' (today, station time), 'latest' reading 
+            (empty if too old), 'hourly' readings for today as records of hourly_readings_dataframe 
+            (empty if none), and 'summary' True if the weather summary was pulled. 
+            Empty dict if there is no station code
+    """
+    return(http_client.run_sync(station_context_async(station_code, station, include_summary)))
+
+
+async def station_context_async(station_code:str, station:dict = None, include_summary:bool = True)->dict:
+    """async version of station_context, the API calls are awaited together"""
+    if not station_code:
+        return({})
+    
+    today_str = today_localtime_str()
+    calls = [latest_readings_values_async(station_code), hourly_readings_dataframe_async(station_code, today_str)]
+    if include_summary:
+        calls.append(weather_summary_frame_async(station_code, today_str))
+    latest, hourly_df, *summary = await asyncio.gather(*calls)
+    
+    return({
+        'station_code': station_code,
+        'station': station or {},
+        'date': today_str,
+        'latest': latest,
+        'hourly': hourly_df.to_dict('records') if isinstance(hourly_df, DataFrame) else [],
+        'summary': include_summary and isinstance(summary[0], DataFrame),
+    })
+
+
+def station_context_patch(context:dict, new_context:dict):
+    """changes to bring the station context on the page up to date, for the same station and day
+
+    Args:
+        context (dict): station context the page has
+        new_context (dict): station context just loaded with station_context(include_summary = False)
+
+    Returns:
+        dash.Patch: with a new 'latest' reading and 'station' record if they changed, and the 
+            hours that are new appended to 'hourly', or dash.no_update if nothing changed
+    """
+    patch = Patch()
+    changed = False
+    if not same_reading(new_context['latest'], context.get('latest') or {}):
+        patch['latest'] = new_context['latest']
+        changed = True
+    if new_context['station'] and new_context['station'] != context.get('station'):
+        patch['station'] = new_context['station']
+        changed = True
+    
+    hours = {row['hour'] for row in context.get('hourly') or []}
+    new_rows = [row for row in new_context['hourly'] if row['hour'] not in hours]
+    if new_rows:
+        patch['hourly'].extend(new_rows)
+        changed = True
+    
+    return(patch if changed else no_update)
+
+
+#### PAGED GRIDS
+# grids with many rows use the AG Grid 'infinite' row model: the browser asks 
+# for the rows it is showing (getRowsRequest) and a callback in app.py answers 
+# with a sorted slice of the cached data frame (getRowsResponse).  The grid id 
+# has everything needed to get the frame again so the callback needs no state. 
+
+GRID_PAGE_SIZE:int = 50
+
+def paged_grid_id(kind:str, station_code:str, dates:str)->dict:
+    """pattern-matching id for a paged grid
+
+    Args:
+        kind (str): which frame the rows come from, a key of PAGED_FRAMES
+        station_code (str): station the frame is for
+        dates (str): date or dates the frame is for, as understood by the PAGED_FRAMES function
+    """
+    return({"type": "paged-grid", "kind": kind, "station_code": station_code, "dates": str(dates)})
+
+
+def paged_grid(grid_id:dict, column_defs:list, default_col_def:dict = None, sort_model:list = None, 
+               page_size:int = GRID_PAGE_SIZE, **kwargs):
+    """AG Grid using the infinite row model with pagination, rows are served by paged_grid_rows
+
+    Args:
+        grid_id (dict): from paged_grid_id
+        column_defs (list): AG Grid column definitions
+        default_col_def (dict, optional): AG Grid default column definition
+        sort_model (list, optional): initial sort, e.g. [{"colId": "date", "sort": "desc"}]
+        page_size (int, optional): rows per page and per request. Defaults to GRID_PAGE_SIZE
+        kwargs: other dash_ag_grid.AgGrid arguments
+    """
+    dash_grid_options = {
+        "pagination": True,
+        "paginationPageSize": page_size,
+        "paginationPageSizeSelector": False,
+        "cacheBlockSize": page_size,
+        "maxBlocksInCache": 4,
+        "rowBuffer": 0,
+        "sortingOrder": ['desc', 'asc', None],
+        "wrapHeaderText": True,
+        "autoHeaderHeight": True,
+        }
+    if sort_model:
+        dash_grid_options["initialState"] = {"sort": {"sortModel": sort_model}}
+    dash_grid_options.update(kwargs.pop("dashGridOptions", {}))
+    
+    return(dag.AgGrid(
+        id = grid_id,
+        rowModelType = "infinite",
+        columnDefs = column_defs,
+        defaultColDef = default_col_def or {"resizable": True, "sortable": True, "filter": False},
+        dashGridOptions = dash_grid_options,
+        columnSize = "sizeToFit",
+        **kwargs))
+
+
+def paged_rows(df:DataFrame, request:dict)->dict:
+    """one block of rows of a data frame for an AG Grid infinite row model request
+
+    Args:
+        df (DataFrame): all rows
+        request (dict): getRowsRequest from the grid, with startRow, endRow and sortModel
+
+    Returns:
+        dict: getRowsResponse with rowData for the block and the total rowCount
+    """
+    request = request or {}
+    sort_model = [s for s in request.get("sortModel") or [] if s.get("colId") in df.columns]
+    if sort_model:
+        df = df.sort_values(by = [s["colId"] for s in sort_model], 
+                            ascending = [s.get("sort") != "desc" for s in sort_model],
+                            kind = "stable")
+    start = int(request.get("startRow") or 0)
+    end = int(request.get("endRow") or start + GRID_PAGE_SIZE)
+    rows = df.iloc[start:end]
+    return({"rowData": rows.to_dict("records"), "rowCount": len(df)})
+
+
+def paged_grid_rows(grid_id:dict, request:dict)->dict:
+    """answer a getRowsRequest from a grid made by paged_grid, using the frame named in its id"""
+    frame_function = PAGED_FRAMES.get(grid_id.get("kind"))
+    if frame_function is None:
+        return({"rowData": [], "rowCount": 0})
+    df = frame_function(grid_id.get("station_code"), grid_id.get("dates"))
+    return(paged_rows(df, request))
 
 
 # this currently is not used.   Need to determine how to insert a whole AG grid into html 
@@ -278,6 +515,8 @@ def pws_date_picker(id:str, initial_date_str:str = None):
     
     return(dps)
 
+HOURLY_DAYS_OPTIONS = [1, 3, 7, 14]
+
 def hourly_weather_form():
     today =  datetime.now(tz=ZoneInfo('US/Eastern')).date().strftime("%Y-%m-%d")
     
@@ -286,6 +525,14 @@ def hourly_weather_form():
         [dbc.Col(pws_date_picker(id='hourly-weather-date-picker'),
                 width = "auto",
                 className="g-2",
+                ),
+         # days ending on the date, more than a page of hours is sent a page at a time, see hourly_readings_table
+         dbc.Col(dbc.Select(id='hourly-weather-days',
+                            options=[{"label": f"{d} day{'s' if d > 1 else ''}", "value": str(d)} for d in HOURLY_DAYS_OPTIONS],
+                            value="1",
+                            size="sm"),
+                width = "auto",
+                className="g-2",
                 )]
         )
         
@@ -296,7 +543,12 @@ def hourly_weather_form():
 
 ######################################
 #### EWX RM API Model Components
-from .ewx_api import tomcast, weather_summary, applescab  
+from .ewx_api import tomcast, weather_summary, applescab, weather_summary_async
+from .daily_summary import degree_day_headers, WEATHER_SUMMARY_ENGINE, DEGREE_DAY_EXTRA_BASES
+
+# weather summary frames shared by the graph and the table, see weather_summary_frame
+summary_frame_flights = SingleFlight()
+summary_frames = TieredCache('weather_summary_frames')
 
 
 def tomcast_form():
@@ -429,6 +681,11 @@ def weather_summary_form():
                             class_name="btn btn-success d-none d-sm-inline-block"), 
                 width="auto"
                 ),
+            dbc.Col(
+                html.Div("",
+                     className="col-auto me-3 d-none d-sm-inline-block text-muted", 
+                     id="weather_summary_loading_message"),
+            )
         ],
         className="g-2",
         )
@@ -436,53 +693,88 @@ def weather_summary_form():
     return(form)
         
         
-def weather_summary_table(station_code:str, select_date:date=None):
+def weather_summary_frame(station_code:str, select_date:date=None)->DataFrame:
+    """the daily weather summary for a station from Jan 1 to select_date, shared by 
+    the weather graph and the weather summary table.  
+    
+    Pulling these data takes a little while for a full year, so the frame is kept 
+    for a few minutes per station and date (in memory, and on disk so other app 
+    processes can use it), and concurrent requests for the same frame wait on one pull. 
+
+    Args:
+        station_code (str): valid PWS station code from database
+        select_date (date, optional): date to END pulling data. Defaults to None, which uses today
+
+    Returns:
+        DataFrame from ewx_api.weather_summary, do not modify it
+    """
+    return(http_client.run_sync(weather_summary_frame_async(station_code, select_date)))
+
+
+async def weather_summary_frame_async(station_code:str, select_date:date=None)->DataFrame:
+    """async version of weather_summary_frame"""
+    select_date_str = str(as_date(select_date) or today_localtime())
+    key = f"{station_code}|{select_date_str}"
+    
+    async def load():
+        found, weather_df = summary_frames.get(key)
+        if found:
+            return(weather_df)
+        weather_df = await weather_summary_async(station_code, select_date_str)
+        if isinstance(weather_df, DataFrame) and 'date' in weather_df.columns:
+            summary_frames.set(key, weather_df, ttl = TTL_LATEST)
+        return(weather_df)
+    
+    return(await summary_frame_flights.do_async(key, load))
+
+
+# for now, select few columns
+WEATHER_SUMMARY_TABLE_COLUMNS = ['date', 'atmp_avg', 'relh_avg', 'pcpn_single', 'pcpn0_accum', 'dd4_single', 'dd4_accum', 'l_wet_0']
+# degree days for more base temperatures are only computed by the local engine
+if WEATHER_SUMMARY_ENGINE == 'local':
+    WEATHER_SUMMARY_TABLE_COLUMNS += list(degree_day_headers(DEGREE_DAY_EXTRA_BASES))
+
+def weather_summary_table(station_code:str, select_date:date=None, weather_df:DataFrame = None):
     """run weather model and format for inclusion in Dash UI
 
     Args:
         station_code (str): valid PWS station code from database
         select_date (date, optional): date to END pulling data.  starts from 
             01-01 of year of date. Defaults to None, which uses today
+        weather_df (DataFrame, optional): summary already pulled for this station and date.
+            Defaults to None, which uses weather_summary_frame
     """
-    model_output = weather_summary(station_code, select_date)
+    model_output = weather_df if weather_df is not None else weather_summary_frame(station_code, select_date)
     
     if not isinstance(model_output, DataFrame):
         # not a data frame, assume it's a message
         return(dbc.Alert(model_output)) 
         
-    # for now, select few columns
-    ws_columns = ['date', 'atmp_avg', 'relh_avg', 'pcpn_single', 'pcpn0_accum', 'dd4_single', 'dd4_accum', 'l_wet_0']
     from .ewx_api import weather_summary_table_headers as display_headers 
-    column_defs = [ { 'field': c, 'headerName': display_headers[c] } for c in ws_columns]  
-    model_output_filtered= model_output.loc[:,ws_columns]
+    column_defs = [ { 'field': c, 'headerName': display_headers[c] } for c in WEATHER_SUMMARY_TABLE_COLUMNS]  
     
     # note: sort by date descending to show most recent data first
-    grid = dag.AgGrid(
-        id="weather_summary_grid",
-        rowData=model_output_filtered.to_dict("records"),
-        columnDefs=column_defs,
-        dashGridOptions={"filter": False,
-                    "wrapHeaderText": True,
-                    "autoHeaderHeight": True,
-                    "pagination":True,
-                    "sortingOrder": ['desc', 'asc', None],
-                    "initialWidth": 200,                    
-                    },
-        
-        
-        columnSize="sizeToFit",
-        )
+    # the season is sent to the browser a page at a time, see paged_grid
+    grid = paged_grid(paged_grid_id('weather_summary', station_code, str(as_date(select_date) or today_localtime())),
+                      column_defs,
+                      default_col_def = {"resizable": True, "sortable": True, "filter": False, "initialWidth": 200},
+                      sort_model = [{"colId": "date", "sort": "desc"}])
     
     return(grid)
         
 
+def weather_summary_paged_frame(station_code:str, dates:str)->DataFrame:
+    """weather summary columns shown in the table, for the paged grid"""
+    weather_df = weather_summary_frame(station_code, dates)
+    if not isinstance(weather_df, DataFrame) or 'date' not in weather_df.columns:
+        return(DataFrame())
+    return(weather_df.reindex(columns=WEATHER_SUMMARY_TABLE_COLUMNS))
+
+
 ###### WEATHER SUMMARY TABLE AND GRAPH
 
 def weather_summary_table_and_graph(station_code:str, select_date:date=None):
-    """run weather model to pull data, show and format for inclusion in Dash UI
-    Pulling these data takes a little while for a full year, so this method
-    creates both a grid and a figure from that data so we don't pull the data 
-    twice.  
+    """pull the weather summary once and build both a grid and a figure from it
 
     Args:
         station_code (str): valid PWS station code from database
@@ -490,61 +782,28 @@ def weather_summary_table_and_graph(station_code:str, select_date:date=None):
             01-01 of year of date, defaults to None, which uses today 
     """
     
-    model_output = weather_summary(station_code, select_date)
-    
-    if not isinstance(model_output, DataFrame):
-        # not a data frame, assume it's a message
-        return(dbc.Alert(model_output)) 
-        
-    # for now, select few columns
-    ws_columns = ['date', 'atmp_avg', 'relh_avg', 'pcpn_single', 'pcpn0_accum', 'dd4_single', 'dd4_accum', 'l_wet_0']
-    from .ewx_api import weather_summary_table_headers as display_headers 
-    column_defs = [ { 'field': c, 'headerName': display_headers[c] } for c in ws_columns]  
-    model_output_filtered= model_output.loc[:,ws_columns]
-    
-    # note: sort by date descending to show most recent data first
-    grid = dag.AgGrid(
-        id="weather_summary_grid",
-        rowData=model_output_filtered.to_dict("records"),
-        columnDefs=column_defs,
-        dashGridOptions={"filter": False,
-                    "wrapHeaderText": True,
-                    "autoHeaderHeight": True,
-                    "pagination":True,
-                    "sortingOrder": ['desc', 'asc', None],
-                    "initialWidth": 200,                    
-                    },
-        
-        
-        columnSize="sizeToFit",
-        )
-    
-    
-    fig = px.line(model_output_filtered, x='date', y='atmp_avg', title=f"Average Temperature for {station_code}")
+    weather_df = weather_summary_frame(station_code, select_date)
+    return(weather_summary_table(station_code, select_date, weather_df), 
+           weather_summary_viz(station_code, select_date, weather_df))
 
-    fig.update_xaxes(
-        rangeslider_visible=True,
-        rangeselector=dict(
-            buttons=list([
-                dict(count=1, label="1m", step="month", stepmode="backward"),
-                dict(count=6, label="6m", step="month", stepmode="backward"),
-                dict(count=1, label="YTD", step="year", stepmode="todate"),
-                dict(count=1, label="1y", step="year", stepmode="backward"),
-                dict(step="all")
-            ])
-        )
-    )
-    
-    return(grid, fig)
 
+def weather_summary_viz(station_code, select_date = None, weather_df:DataFrame = None, x_range = None):
+    """line graph of the daily weather summary
 
-### this is for testing, and pulls the data twice
-def weather_summary_viz(station_code, select_date = None):
+    Args:
+        station_code (str): valid PWS station code from database
+        select_date (date, optional): date to END pulling data. Defaults to None, which uses today
+        weather_df (DataFrame, optional): summary already pulled for this station and date.
+            Defaults to None, which uses weather_summary_frame
+        x_range (list, optional): [start, end] dates the user zoomed to, drawn in full detail. 
+            Defaults to None, the whole series
+    """
 
     if not station_code:
         return(None)
     
-    weather_df = weather_summary(station_code, select_date)
+    if weather_df is None:
+        weather_df = weather_summary_frame(station_code, select_date)
     
     if not isinstance(weather_df, DataFrame):
         # not a data frame, assume it's a message
@@ -557,34 +816,26 @@ def weather_summary_viz(station_code, select_date = None):
     data_column_label = 'max Temperature (F)'
     ws_columns = ['date', data_column ]
 
-    weather_df_filtered = weather_df.loc[:,ws_columns]
+    weather_df_filtered = weather_df.reindex(columns=ws_columns)
 
-    fig = px.line(weather_df_filtered, 
+    fig = line_figure(weather_df_filtered, 
                     x='date', y=data_column, 
                     title=f"Average Temperature for {station_code}",
-                    labels={
-                    data_column: data_column_label},
+                    y_label=data_column_label,
+                    x_range=x_range,
                 )
     
-    fig.update_layout(autotypenumbers='convert types')
-
-    fig.update_xaxes(
-        rangeslider_visible=True,
-        rangeselector=dict(
-            buttons=list([
-                dict(count=1, label="1m", step="month", stepmode="backward"),
-                dict(count=6, label="6m", step="month", stepmode="backward"),
-                dict(count=1, label="YTD", step="year", stepmode="todate"),
-                # dict(count=1, label="1y", step="year", stepmode="backward"),
-                dict(step="all")
-            ])
-        )
-    )
-    
     return(fig)
 
 
 
+# data frames for paged grids, by the 'kind' in the grid id
+PAGED_FRAMES = {
+    'weather_summary': weather_summary_paged_frame,
+    'hourly': hourly_readings_paged_frame,
+}
+
+
 ######### Apple Scab ############
 
 def applescab_form():
@@ -619,6 +870,11 @@ def applescab_form():
                 
                 width="auto"
                 ),
+            dbc.Col(
+                html.Div("",
+                     className="col-auto me-3 d-none d-sm-inline-block text-muted", 
+                     id="applescab_loading_message"),
+            )
         ],
         className="g-2",
         )
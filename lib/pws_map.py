@@ -2,59 +2,178 @@
 
 #### STATION MAP
 # convenience functions to help show the map and make markers clickable
+#
+# stations are drawn as one GeoJSON layer with marker clustering, instead of
+# one dl.Marker component per station.  When there are many stations, only
+# those in (and around) the part of the map that is showing are sent to the
+# browser, found with StationIndex.
+#
+# Configuration from environment variables:
+#
+# - `MAP_ALL_STATIONS_MAX` up to this many stations are all sent with the map, default 500
+# - `MAP_INDEX_CELL_DEGREES` size of the spatial index grid cells, default 0.5 degrees
 
-import dash_leaflet as dl
+from math import floor
+from os import getenv
 
-def station_marker_id(station:dict):
-    """consistent way to generate marker id's for us in map and in callbacks"""
-    marker_id = f"{station['station_code']}_marker"
-    return(marker_id)
+MAP_ALL_STATIONS_MAX:int = int(getenv('MAP_ALL_STATIONS_MAX', 500))
+MAP_INDEX_CELL_DEGREES:float = float(getenv('MAP_INDEX_CELL_DEGREES', 0.5))
 
-def station_from_marker_id(marker_id:str):
+def station_layer_id(map_id = "station_map"):
+    """pattern-matching id of the GeoJSON layer of station markers on a map, 
+    use map_id = ALL in a callback to listen to the stations on every map"""
+    return({"type": "station-markers", "map": map_id})
+
+def station_from_marker_id(marker_id):
     """consistent way to get a station record given a map marker id
 
     Args:
-        marker_id (str): marker id used on a map and returned by a callback fundtion    
+        marker_id (dict|str): the GeoJSON feature of a station from a station layer's clickData, 
+            or a '<station_code>_marker' id
         
     Returns:
        str:station code
     """
+    if isinstance(marker_id, dict):
+        return(marker_id.get('properties', {}).get('station_code'))
     
     station_code = marker_id.replace('_marker', '')
     return(station_code)
     
     
-def station_marker(station):
-    """generate the marker code for placing stations on the map, 
-    extracted into a function for clarity.  calls station_marker_id
-    to make consistent ids for use in callbacks
+def station_feature(station:dict)->dict:
+    """GeoJSON point for one station, the tooltip is the station code and type.  
+    GeoJSON ids have to be strings, so the feature id is the station code
 
     Args:
         station (dictionary): station record from API, dictionary not pandas
 
     Returns:
-        dash-leaflet.Marker: marker to place on a dash-leaflet maps
+        dict: GeoJSON Feature
     """
-    station_description = f"{station['station_code']} ({station['station_type']})"
-    return dl.Marker(
-        position = [station['lat'],station['lon']],
-        children = [dl.Tooltip(content=station_description)], 
-        id = station_marker_id(station)
-        )
+    return({
+        "type": "Feature",
+        "id": station['station_code'],
+        "geometry": {"type": "Point", "coordinates": [station['lon'], station['lat']]},
+        "properties": {
+            "station_code": station['station_code'],
+            "tooltip": f"{station['station_code']} ({station['station_type']})",
+            },
+        })
+
+
+def station_geojson(stations)->dict:
+    """GeoJSON FeatureCollection of station records, for the station_markers layer
+
+    Args:
+        stations (iterable): station records (dicts)
+    """
+    return({"type": "FeatureCollection",
+            "features": [station_feature(station) for station in stations]})
+
+
+class StationIndex:
+    """stations bucketed on a lat/lon grid, to find the stations on the part of the map
+    that is showing without looking at every station
+
+    Example:
+        index = StationIndex(station_records)
+        stations = index.query([[42, -86], [44, -83]])
+    """
+
+    def __init__(self, station_records:dict, cell_degrees:float = MAP_INDEX_CELL_DEGREES):
+        """
+        Args:
+            station_records (dict): station records keyed on station code
+            cell_degrees (float, optional): grid cell size. Defaults to MAP_INDEX_CELL_DEGREES.
+        """
+        self.cell_degrees = cell_degrees
+        self._cells:dict = {}
+        for station in station_records.values():
+            if station.get('lat') is None or station.get('lon') is None:
+                continue
+            self._cells.setdefault(self._cell(station['lat'], station['lon']), []).append(station)
+
+    def __len__(self):
+        return(sum(len(stations) for stations in self._cells.values()))
+
+    def query(self, bounds, pad:float = 0.5)->list:
+        """stations inside the map bounds
+
+        Args:
+            bounds (list): [[south, west], [north, east]], as in the dl.Map bounds property
+            pad (float, optional): grow the bounds by this fraction on each side so
+                stations just off the edge are there when the map is moved a little. Defaults to 0.5
+
+        Returns:
+            list: station records
+        """
+        (south, west), (north, east) = bounds
+        lat_pad, lon_pad = (north - south)*pad, (east - west)*pad
+        south, north = south - lat_pad, north + lat_pad
+        west, east = west - lon_pad, east + lon_pad
+
+        (row_min, col_min), (row_max, col_max) = self._cell(south, west), self._cell(north, east)
+        stations = []
+        for (row, col), cell_stations in self._cells.items():
+            if row_min <= row <= row_max and col_min <= col <= col_max:
+                stations.extend(s for s in cell_stations
+                                if south <= s['lat'] <= north and west <= s['lon'] <= east)
+        return(stations)
+
+    def _cell(self, lat, lon)->tuple:
+        return((floor(lat/self.cell_degrees), floor(lon/self.cell_degrees)))
+
+
+def station_map_data(station_records:dict, bounds = None, index:StationIndex = None)->dict:
+    """GeoJSON for the station_markers layer: every station when there are up to
+    MAP_ALL_STATIONS_MAX of them or the bounds are not known yet, otherwise only those
+    in the map bounds
+
+    Args:
+        station_records (dict): station records keyed on station code
+        bounds (list, optional): [[south, west], [north, east]] of the map.
+        index (StationIndex, optional): index of station_records, made if not given.
+    """
+    if len(station_records) <= MAP_ALL_STATIONS_MAX or not bounds:
+        return(station_geojson(station_records.values()))
+
+    if index is None:
+        index = StationIndex(station_records)
+    return(station_geojson(index.query(bounds)))
 
 
 def station_map(station_records, map_zoom = 7, center_coordinates = None):
+    # imported here so the app starts without loading dash_leaflet, it is loaded with the first page
+    import dash_leaflet as dl
     station_data = list(station_records.values())
-    
+
     selected_station_id = 0
     if not center_coordinates:
-        center_coordinates = [station_data[selected_station_id]['lat'], station_data[selected_station_id]['lon']]
-        
+        if station_data:
+            center_coordinates = [station_data[selected_station_id]['lat'], station_data[selected_station_id]['lon']]
+        else:
+            # no stations (yet), same default as station_latlon
+            center_coordinates = [43, -82]
+
+    # with many stations the map starts empty, and the stations in view
+    # are sent once the browser knows the map bounds
+    if len(station_data) <= MAP_ALL_STATIONS_MAX:
+        station_data = station_geojson(station_data)
+    else:
+        station_data = station_geojson([])
+
     m = dl.Map(
         id='station_map',        
             children=[
                 dl.TileLayer(),
-                dl.FeatureGroup( [station_marker(station) for station in station_data], id="station_markers"),
+                dl.GeoJSON(
+                    data = station_data,
+                    id = station_layer_id(),
+                    cluster = True,
+                    zoomToBoundsOnClick = True,
+                    superClusterOptions = {"radius": 60, "maxZoom": 12},
+                    ),
             ],     
             center=center_coordinates,
             className = "w-100", 
@@ -64,4 +183,3 @@ def station_map(station_records, map_zoom = 7, center_coordinates = None):
         )
 
     return(m)
-
@@ -1,12 +1,32 @@
-import requests
 from warnings import warn
 from . import BASE_PWS_API_URL
-from datetime import date, timedelta
+from . import http_client
+from .tiered_cache import TieredCache, TTL_LATEST, TTL_RECENT, TTL_FOREVER
+from .converters import MICHIGAN_TIME_ZONE_KEY, today_localtime
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import getenv
+from time import perf_counter
 import pandas as pd
+
+# number of stations to request at once when loading all stations
+STATION_FETCH_WORKERS:int = int(getenv('STATION_FETCH_WORKERS', 16))
+
+# latest weather readings are cached for a few minutes
+readings_cache = TieredCache('readings')
+
+# hourly readings are stored by station and day.  Complete days that are over 
+# are kept for good, today and days with missing hours are refreshed. 
+hourly_store = TieredCache('hourly_days', disk_items = 0)
+
+# days after a day is over that its missing hours may still arrive, then it is kept as it is
+HOURLY_SETTLE_DAYS:int = int(getenv('HOURLY_SETTLE_DAYS', 2))
             
 def get_station_codes(api_url:str = BASE_PWS_API_URL):
-    r = requests.get(url = f"{api_url}/stations/")
-    if r.status_code == 200:
+    r = http_client.get(url = f"{api_url}/stations/")
+    if r is not None and r.status_code == 200:
         station_codes = r.json()['station_codes']
     else:
         station_codes = []
@@ -23,15 +43,15 @@ def get_station_data(station_code:str, api_url:str = BASE_PWS_API_URL):
     Raises:
         RuntimeError: _description_
     """
-    
+    return(http_client.run_sync(get_station_data_async(station_code, api_url)))
+
+
+async def get_station_data_async(station_code:str, api_url:str = BASE_PWS_API_URL):
+    """async version of get_station_data"""
     if(not api_url):
         raise RuntimeError( "you must set the URL to reach the PWS API, for example BASE_PWS_API_URL")
     
-    r = requests.get(url = f"{api_url}/stations/{station_code}")
-    if r.status_code == 200:
-        return(r.json())
-    else:
-        return({})
+    return(await _get_json_async(f"{api_url}/stations/{station_code}", {}))
 
 def station_latlon(station_code):
     if station_code:
@@ -44,29 +64,84 @@ def station_latlon(station_code):
         
     return ([lat, lon])
 
-def get_all_stations(api_url:str = BASE_PWS_API_URL):
-    """get a table of all station data using a loop
+def get_all_stations(api_url:str = BASE_PWS_API_URL, max_workers:int = STATION_FETCH_WORKERS):
+    """get a table of all station data
     
     since there is not an API endpoint to list all the stations with details (or a subset), 
-    this just loops through and hits the api for each. Very inefficient! 
+    this hits the api for each station, in parallel. See get_all_stations_with_report 
 
     Args:
         api_url (str, optional): base of the API to use to pull data.  Defaults to constant BASE_PWS_API_URL.
+        max_workers (int, optional): number of stations to fetch at once, 1 fetches serially. 
+            Defaults to STATION_FETCH_WORKERS
+    
+    Returns:
+        dict: station records keyed on station code.  Stations that could not be fetched are left out
+    """
+    stations, report = get_all_stations_with_report(api_url, max_workers)
+    return(stations)
+
+
+def _timed_station_data(station_code:str, api_url:str):
+    start = perf_counter()
+    station_data_json = get_station_data(station_code, api_url)
+    return(station_data_json, perf_counter() - start)
+
+
+def get_all_stations_with_report(api_url:str = BASE_PWS_API_URL, max_workers:int = STATION_FETCH_WORKERS):
+    """get all station data with a bounded pool of worker threads, and report on each fetch
+    
+    The total time is about that of the slowest station rather than the sum of all
+    of them.  The number of requests in flight is also capped by the shared http client.
+    A station that fails is reported and left out, it does not fail the others
+
+    Args:
+        api_url (str, optional): base of the API to use to pull data.  Defaults to constant BASE_PWS_API_URL.
+        max_workers (int, optional): number of stations to fetch at once, 1 fetches serially. 
+            Defaults to STATION_FETCH_WORKERS
+
+    Returns:
+        tuple(dict, dict): station records keyed on station code, and a report keyed on station
+            code with 'ok' (bool) and 'seconds' (latency of the request) for every station
     """
-    # create pandas df instead 
     stations = {}
+    report = {}
     station_codes = get_station_codes(api_url)
+    if not station_codes:
+        return(stations, report)
     
-    for station_code in station_codes:
-        station_data_json = get_station_data(station_code, api_url)
-        # 
-        stations[station_code ]  = station_data_json
-                                  
-    return(stations)
+    with ThreadPoolExecutor(max_workers = max(1, min(max_workers, len(station_codes)))) as executor:
+        futures = {executor.submit(_timed_station_data, station_code, api_url): station_code 
+                   for station_code in station_codes}
+        for future in as_completed(futures):
+            station_code = futures[future]
+            try:
+                station_data_json, seconds = future.result()
+            except Exception as e:
+                warn(f"could not get station data for {station_code}: {e}")
+                report[station_code] = {'ok': False, 'seconds': None}
+                continue
+            
+            report[station_code] = {'ok': bool(station_data_json), 'seconds': seconds}
+            if station_data_json:
+                stations[station_code] = station_data_json
+            else:
+                warn(f"no station data returned for {station_code}")
+    
+    # keep the order of the station list from the API
+    stations = {station_code: stations[station_code] for station_code in station_codes if station_code in stations}
+    return(stations, report)
+
 
+def get_hourly_readings(station_code=None, start_date=None, end_date=None, api_url = BASE_PWS_API_URL, 
+                        timezone_key = MICHIGAN_TIME_ZONE_KEY):
+    """hourly weather readings for a station, from the per-day store or the PWS API
 
-def get_hourly_readings(station_code=None, start_date=None, end_date=None, api_url = BASE_PWS_API_URL):
-    """_summary_
+    Each day is stored separately (see hourly_store). Only days that are not stored, or
+    can still change, are requested from the API, in a single request covering them.
+    Runs of consecutive missing days are requested separately, so only the days that
+    are not stored are sent again.  If a request fails, the other days are returned without 
+    its days, with a warning naming them, and [{}] only when there are no days at all.
 
     Args:
         station_code (_type_, optional): station code from weatherstation table in db. Defaults to None.
@@ -76,7 +151,15 @@ def get_hourly_readings(station_code=None, start_date=None, end_date=None, api_u
         end_date (_type_, optional): date to end on, could be same as start. 
             Defaults to None, meaning same as start_date
         api_url (_type_, optional): PWS API url. Defaults to BASE_PWS_API_URL.
+        timezone_key (str, optional): time zone of the station, to determine which day is 'today' for it. 
+            Defaults to MICHIGAN_TIME_ZONE_KEY
     """
+    return(http_client.run_sync(get_hourly_readings_async(station_code, start_date, end_date, api_url, timezone_key)))
+
+
+async def get_hourly_readings_async(station_code=None, start_date=None, end_date=None, api_url = BASE_PWS_API_URL, 
+                                    timezone_key = MICHIGAN_TIME_ZONE_KEY):
+    """async version of get_hourly_readings"""
     
     EMPTY_DATA = [{}]
     
@@ -93,15 +176,95 @@ def get_hourly_readings(station_code=None, start_date=None, end_date=None, api_u
     else:
         if(not end_date):
             end_date = start_date
-            
-
-    # check if start and end great than today
-    url = f"{api_url}/weather/{station_code}/hourly?start={start_date}&end={end_date}"
-    r = requests.get(url)
-    if r.status_code == 200:
-        return(r.json())
-    else:
+    
+    days = [str(d) for d in pd.date_range(str(start_date)[:10], str(end_date)[:10]).date]
+    readings_by_day = {}
+    missing_days = []
+    for day in days:
+        found, day_readings = hourly_store.get(hourly_store_key(api_url, station_code, day))
+        if found:
+            readings_by_day[day] = day_readings
+        else:
+            missing_days.append(day)
+    
+    # one request for each run of consecutive missing days, so a gap early in the
+    # season does not make every refresh of today ask for all the days in between
+    runs = []
+    for day in missing_days:
+        if runs and date.fromisoformat(day) - date.fromisoformat(runs[-1][-1]) == timedelta(days=1):
+            runs[-1].append(day)
+        else:
+            runs.append([day])
+    urls = [f"{api_url}/weather/{station_code}/hourly?start={run[0]}&end={run[-1]}" for run in runs]
+    local_today = today_localtime(timezone_key)
+    failed_days = []
+    for run, readings in zip(runs, await asyncio.gather(*[_get_json_async(url, EMPTY_DATA) for url in urls])):
+        if readings == EMPTY_DATA:
+            failed_days.extend(run)
+            continue
+        fetched = {day:[] for day in run}
+        for reading in readings:
+            fetched.setdefault(str(reading.get('represented_date'))[:10], []).append(reading)
+        for day in run:
+            day_readings = fetched[day]
+            hourly_store.set(hourly_store_key(api_url, station_code, day), 
+                             day_readings, 
+                             ttl = hourly_day_ttl(day_readings, date.fromisoformat(day), local_today, timezone_key))
+            readings_by_day[day] = day_readings
+    
+    if not readings_by_day:
         return(EMPTY_DATA)
+    if failed_days:
+        # the other days are still good, leave out the ones the API did not send
+        warn(f"could not get hourly readings for {station_code} on {', '.join(failed_days)}, "
+             f"using the {len(readings_by_day)} other days of {start_date} to {end_date} without them")
+    return([reading for day in days if day in readings_by_day for reading in readings_by_day[day]])
+
+
+def hourly_store_key(api_url:str, station_code:str, day:str)->str:
+    return(f"{api_url}|{station_code}|{day}")
+
+
+def hours_in_day(day:date, timezone_key = MICHIGAN_TIME_ZONE_KEY)->int:
+    """hours in a day in the station's time zone, 23 or 25 on the days the clocks change"""
+    tz = ZoneInfo(timezone_key)
+    start = datetime(day.year, day.month, day.day, tzinfo=tz)
+    end = datetime.combine(day + timedelta(days=1), datetime.min.time(), tzinfo=tz)
+    return(round((end.timestamp() - start.timestamp())/3600))
+
+
+def hourly_day_complete(day_readings:list, day:date = None, timezone_key = MICHIGAN_TIME_ZONE_KEY)->bool:
+    """True if a day of hourly readings has all its hours, each with every reading expected for the hour
+
+    Args:
+        day_readings (list): hourly readings of one day
+        day (date, optional): the day, for the number of hours it had. Defaults to None, 24 hours
+        timezone_key (str, optional): time zone of the station. Defaults to MICHIGAN_TIME_ZONE_KEY
+    """
+    hours = {r.get('represented_hour') for r in day_readings 
+             if (r.get('record_count') or 0) >= (r.get('api_hourly_frequency') or 1)}
+    expected = hours_in_day(day, timezone_key) if day else 24
+    return(len(hours & set(range(1, 26))) >= expected)
+
+
+def hourly_day_settled(day_readings:list, day:date, local_today:date, timezone_key = MICHIGAN_TIME_ZONE_KEY)->bool:
+    """True once a day can no longer change: it is over in the station's time zone and 
+    complete, or HOURLY_SETTLE_DAYS have passed since, and readings still missing won't come"""
+    if day >= local_today:
+        return(False)
+    return(day <= local_today - timedelta(days=HOURLY_SETTLE_DAYS) or 
+           hourly_day_complete(day_readings, day, timezone_key))
+
+
+def hourly_day_ttl(day_readings:list, day:date, local_today:date, timezone_key = MICHIGAN_TIME_ZONE_KEY):
+    """how long to store a day of hourly readings: for good once it is settled (see 
+    hourly_day_settled), a short time for today, and for days that are over but still 
+    missing readings that may arrive late"""
+    if hourly_day_settled(day_readings, day, local_today, timezone_key):
+        return(TTL_FOREVER)
+    if day >= local_today:
+        return(TTL_LATEST)
+    return(TTL_RECENT)
  
 
 
@@ -166,17 +329,53 @@ def latest_readings(station_code=None, api_url = BASE_PWS_API_URL):
         api_url (str, optional): base url of the PWS API.  defaults to constant 
             set at top of this module
     """
+    return(http_client.run_sync(latest_readings_async(station_code, api_url)))
+
+
+async def latest_readings_async(station_code=None, api_url = BASE_PWS_API_URL):
+    """async version of latest_readings"""
     EMPTY_DATA = [{}]
     
     if(not station_code):
         return(EMPTY_DATA)
     
     url = f"{api_url}/weather/{station_code}/latest"
-    r = requests.get(url)
-    if r.status_code == 200:
+    found, readings = readings_cache.get(url)
+    if found:
+        return(readings)
+    readings = await _get_json_async(url, EMPTY_DATA)
+    if readings != EMPTY_DATA:
+        readings_cache.set(url, readings, ttl = TTL_LATEST)
+    return(readings)
+
+
+def refresh_latest_readings(station_code:str, api_url = BASE_PWS_API_URL):
+    """get the latest readings from the API even if they are cached, and cache them, 
+    for the latest readings poller (see latest_poller.py)
+
+    Returns:
+        dict: latest readings, or None if the request did not succeed
+    """
+    EMPTY_DATA = [{}]
+    url = f"{api_url}/weather/{station_code}/latest"
+    readings = _get_json(url, EMPTY_DATA)
+    if readings == EMPTY_DATA:
+        return(None)
+    readings_cache.set(url, readings, ttl = TTL_LATEST)
+    return(readings)
+
+
+def _get_json(url:str, empty_data):
+    """json from a GET request, or empty_data if the request did not succeed"""
+    return(http_client.run_sync(_get_json_async(url, empty_data)))
+
+
+async def _get_json_async(url:str, empty_data):
+    r = await http_client.get_async(url)
+    if r is not None and r.status_code == 200:
         return(r.json())
     else:
-        return(EMPTY_DATA)
+        return(empty_data)
     
 
         
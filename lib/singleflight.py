@@ -0,0 +1,103 @@
+""" singleflight.py: run a function once for many concurrent callers with the same key
+
+When several callbacks ask for the same thing at the same time (e.g. the same
+model run for the same station and date) only the first one does the work, the
+others wait for it and get the same result.  Nothing is kept once the call
+finishes, caching results is a separate job.  Async callers use do_async(), 
+and share in-flight calls with sync callers of the same SingleFlight.
+"""
+
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters:int = 0
+
+
+class SingleFlight:
+    """de-duplicate concurrent calls by key
+
+    Example:
+        flights = SingleFlight()
+        df = flights.do(url, lambda: fetch(url))
+    """
+
+    def __init__(self):
+        self._calls:dict = {}
+        self._lock = threading.Lock()
+        self.calls:int = 0
+        self.shared:int = 0
+
+    def do(self, key, fn):
+        """call fn() unless a call with the same key is in flight, in which case wait for that one
+
+        Args:
+            key (hashable): identifies calls that would return the same result
+            fn (callable): function with no arguments that does the work
+
+        Returns:
+            the return value of fn, or of the in-flight call.  If that call raised
+            an exception, it is raised for every waiting caller too
+        """
+        call, leader = self._join(key)
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return(call.result)
+
+    async def do_async(self, key, fn):
+        """async version of do(), fn is an async function with no arguments. 
+        Waiting for an in-flight call does not block the event loop"""
+        call, leader = self._join(key)
+
+        if not leader:
+            if not call.done.is_set():
+                await asyncio.to_thread(call.done.wait)
+        else:
+            try:
+                call.result = await fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return(call.result)
+
+    def _join(self, key)->tuple:
+        """(call, leader) the in-flight call for key, leader is True if this caller has to make it"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.shared += 1
+                return(call, False)
+            call = _Call()
+            self._calls[key] = call
+            self.calls += 1
+            return(call, True)
+
+    def stats(self)->dict:
+        """number of calls made and number of callers that shared an in-flight call"""
+        with self._lock:
+            return({'calls': self.calls, 'shared': self.shared, 'in_flight': len(self._calls)})
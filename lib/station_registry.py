@@ -0,0 +1,323 @@
+""" station_registry.py: in-process list of stations that refreshes itself
+
+The station list used to be read once when the app started, so the app had to
+be restarted to see new or changed stations.  The registry holds the current
+station records, re-reads them from the PWS API in a background thread on a
+schedule, and keeps track of which stations were added, removed or changed
+so that pages that are already open can be sent just those changes.
+
+The last station list loaded is saved to a snapshot file, so when the app starts
+it can show the stations right away from the snapshot and load them from the
+API in the background.  With several worker processes (see gunicorn.conf.py) 
+one process loads the stations from the API and the workers follow the snapshot 
+file, so the API is not asked once per worker. 
+
+Configuration from environment variables:
+
+- `STATION_REFRESH_SECONDS` seconds between reloads of the station list, default 900 (15 minutes)
+- `STATION_SNAPSHOT_FILE` last known station list, default stations.json in the cache directory
+- `STATION_SNAPSHOT_CHECK_SECONDS` seconds between checks of the snapshot by worker processes, default 30
+"""
+
+import json
+import threading
+from time import time
+from os import getenv, getpid, makedirs, path, replace
+from warnings import warn
+
+from . import CACHE_DIR
+from .pwsapi import get_all_stations
+
+STATION_REFRESH_SECONDS:int = int(getenv('STATION_REFRESH_SECONDS', 15*60))
+STATION_SNAPSHOT_FILE:str = getenv('STATION_SNAPSHOT_FILE', path.join(CACHE_DIR, 'stations.json'))
+STATION_SNAPSHOT_CHECK_SECONDS:int = int(getenv('STATION_SNAPSHOT_CHECK_SECONDS', 30))
+
+# fields that change with every new reading, they are kept up to date in the
+# registry but don't count as a change to the station
+VOLATILE_STATION_FIELDS = ('latest_reading_datetime', 'latest_reading_datetime_utc')
+
+
+class StationRegistry:
+    """current station records, keyed on station code, with a version number
+    that increases each time a refresh finds a difference.
+
+    Example:
+        registry = StationRegistry()
+        registry.load_snapshot()            # last known stations, if any
+        registry.start(refresh_first=True)  # load from the API and keep up to date in the background
+        stations = registry.ensure_loaded() # waits for the first load if there was no snapshot
+        changes = registry.changes_since(version_the_page_has)
+    """
+
+    def __init__(self, loader = get_all_stations, refresh_seconds:int = STATION_REFRESH_SECONDS, history_size:int = 100,
+                 snapshot_file:str = STATION_SNAPSHOT_FILE):
+        """
+        Args:
+            loader (callable, optional): function that returns dict of station records keyed on
+                station code. Defaults to pwsapi.get_all_stations
+            refresh_seconds (int, optional): time between background refreshes. Defaults to STATION_REFRESH_SECONDS
+            history_size (int, optional): number of versions to remember for changes_since().  Pages
+                with an older version get the full station list. Defaults to 100
+            snapshot_file (str, optional): file to save the station list to after each change, 
+                None to not save it. Defaults to STATION_SNAPSHOT_FILE
+        """
+        self.loader = loader
+        self.refresh_seconds = refresh_seconds
+        self.history_size = history_size
+        self.snapshot_file = snapshot_file
+        self._snapshot_mtime = None
+        self._load_lock = threading.Lock()
+        self._stations:dict = {}
+        self._version:int = 0
+        # version -> (codes present at that version, codes touched to reach that version)
+        self._history:dict = {0: (frozenset(), frozenset())}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def stations(self)->dict:
+        """copy of the current station records keyed on station code"""
+        with self._lock:
+            return(dict(self._stations))
+
+    @property
+    def version(self)->int:
+        return(self._version)
+
+    def refresh(self)->dict:
+        """reload stations from the loader and record what changed
+
+        If the loader fails or returns nothing the current stations are kept,
+        as the API being down is not the same as all the stations being removed
+
+        Returns:
+            dict: codes of stations that were 'add'ed, 'remove'd and 'update'd by this refresh
+        """
+        try:
+            new_stations = self.loader()
+        except Exception as e:
+            warn(f"station registry refresh failed: {e}")
+            new_stations = None
+
+        if not new_stations:
+            return({'add': [], 'remove': [], 'update': []})
+
+        diff = self._set_stations(new_stations)
+        if diff['add'] or diff['remove'] or diff['update'] or not path.exists(self.snapshot_file or ''):
+            self.save_snapshot()
+        return(diff)
+
+    def ensure_loaded(self)->dict:
+        """current stations, loading them first if there are none yet (no snapshot and 
+        the background refresh has not finished).  Concurrent callers wait for one load"""
+        stations = self.stations
+        if stations:
+            return(stations)
+        with self._load_lock:
+            if not self._stations:
+                self.refresh()
+        return(self.stations)
+
+    def load_snapshot(self)->bool:
+        """use the station list saved by the last refresh, if there is one, 
+        and the registry version it had
+
+        Returns:
+            bool: True if stations were loaded from the snapshot
+        """
+        if not self.snapshot_file or not path.exists(self.snapshot_file):
+            return(False)
+        try:
+            mtime = path.getmtime(self.snapshot_file)
+            with open(self.snapshot_file) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            warn(f"could not read station snapshot {self.snapshot_file}: {e}")
+            return(False)
+        self._snapshot_mtime = mtime
+        if not snapshot.get('stations'):
+            return(False)
+        self._set_stations(snapshot['stations'], snapshot.get('version'))
+        return(True)
+
+    def save_snapshot(self):
+        """save the current station list and version to the snapshot file"""
+        if not self.snapshot_file:
+            return
+        try:
+            makedirs(path.dirname(self.snapshot_file) or '.', exist_ok=True)
+            with self._lock:
+                snapshot = {'version': self._version, 'stations': dict(self._stations)}
+            # write then rename, so other processes never read half a file
+            tmp_file = f"{self.snapshot_file}.{getpid()}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(snapshot, f)
+            replace(tmp_file, self.snapshot_file)
+            self._snapshot_mtime = path.getmtime(self.snapshot_file)
+        except OSError as e:
+            warn(f"could not save station snapshot {self.snapshot_file}: {e}")
+
+    def share_with_processes(self, check_seconds:int = STATION_SNAPSHOT_CHECK_SECONDS):
+        """keep up to date together with other processes using the same snapshot file, 
+        in a background thread, if not already started.  One process at a time (the one 
+        holding a lock on the snapshot) loads the stations from the API every refresh_seconds 
+        and saves the snapshot, the others reload the snapshot when it changes. 
+        If that process stops, another one takes over.  For worker processes, see gunicorn.conf.py
+
+        Args:
+            check_seconds (int, optional): time between checks of the file. Defaults to STATION_SNAPSHOT_CHECK_SECONDS
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            if self.snapshot_file:
+                target, args = self._run_shared, (check_seconds,)
+            else:
+                # nothing to share through, every process loads from the API
+                target, args = self._run, (True,)
+            self._thread = threading.Thread(target=target, args=args, name="station-registry", daemon=True)
+            self._thread.start()
+
+    def _set_stations(self, new_stations:dict, version:int = None)->dict:
+        """replace the stations, and move to a new version if they changed or to
+        the given version (from a snapshot)"""
+        with self._lock:
+            diff = station_diff(self._stations, new_stations)
+            touched = diff['add'] + diff['remove'] + diff['update']
+            self._stations = dict(new_stations)
+            new_version = version if version is not None else self._version + (1 if touched else 0)
+            if new_version != self._version:
+                # from a snapshot the version can skip ahead, that step then holds every change 
+                # since this process's last version.  It only goes back if the snapshot was
+                # started over, and the versions after it no longer mean the same stations
+                for stale_version in [v for v in self._history if v >= new_version]:
+                    del self._history[stale_version]
+                self._version = new_version
+                self._history[self._version] = (frozenset(new_stations), frozenset(touched))
+                for old_version in [v for v in self._history if v <= self._version - self.history_size]:
+                    del self._history[old_version]
+        return(diff)
+
+    def changes_since(self, version:int)->dict:
+        """which station records a page needs to go from an older version to the current one
+
+        Versions are the same in every process sharing the snapshot, but a process that
+        follows the snapshot only has the versions it loaded, so a page built with a
+        version this process skipped gets the full list
+
+        Args:
+            version (int): registry version the page was built with
+
+        Returns:
+            dict: with 'version' (current), and 'add', 'remove', 'update' lists of codes,
+                or 'full' set to True when the version is unknown (too old, or skipped) and 
+                the page should reload the whole list
+        """
+        with self._lock:
+            current = self._version
+            if version == current:
+                return({'version': current, 'add': [], 'remove': [], 'update': []})
+
+            if version not in self._history or version > current:
+                return({'version': current, 'full': True, 'add': [], 'remove': [], 'update': []})
+
+            codes_then = self._history[version][0]
+            touched = set()
+            for v in self._history:
+                if version < v <= current:
+                    touched.update(self._history[v][1])
+
+            changes = {'version': current, 'add': [], 'remove': [], 'update': []}
+            for code in sorted(touched):
+                if code in self._stations:
+                    changes['update' if code in codes_then else 'add'].append(code)
+                elif code in codes_then:
+                    changes['remove'].append(code)
+
+            return(changes)
+
+    def start(self, refresh_first:bool = False):
+        """start refreshing in a background thread, if not already started
+
+        Args:
+            refresh_first (bool, optional): refresh right away instead of after refresh_seconds. Defaults to False
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(refresh_first,), name="station-registry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """stop the background thread after the current refresh"""
+        self._stop.set()
+
+    def _run_shared(self, check_seconds:int):
+        lock_file = None
+        refreshed_at = self._snapshot_mtime or 0
+        while True:
+            if lock_file is None:
+                lock_file = self._snapshot_lock()
+            if lock_file is not None:
+                if time() - refreshed_at >= self.refresh_seconds:
+                    self.refresh()
+                    refreshed_at = time()
+            else:
+                try:
+                    if path.getmtime(self.snapshot_file) != self._snapshot_mtime:
+                        self.load_snapshot()
+                except OSError:
+                    pass
+            if self._stop.wait(check_seconds):
+                break
+        if lock_file is not None:
+            lock_file.close()
+
+    def _snapshot_lock(self):
+        """open lock file if this process got the lock on the snapshot, else None"""
+        import fcntl
+        try:
+            makedirs(path.dirname(self.snapshot_file) or '.', exist_ok=True)
+            lock_file = open(f"{self.snapshot_file}.lock", 'a')
+        except OSError as e:
+            warn(f"could not open station snapshot lock: {e}")
+            return(None)
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return(lock_file)
+        except OSError:
+            lock_file.close()
+            return(None)
+
+    def _run(self, refresh_first:bool = False):
+        if refresh_first:
+            with self._load_lock:
+                self.refresh()
+        while not self._stop.wait(self.refresh_seconds):
+            self.refresh()
+
+
+def station_diff(old_stations:dict, new_stations:dict, ignore_fields = VOLATILE_STATION_FIELDS)->dict:
+    """compare two sets of station records keyed on station code
+
+    Args:
+        old_stations (dict): station records keyed on station code
+        new_stations (dict): station records keyed on station code
+        ignore_fields (tuple, optional): record fields that are not compared.  Defaults to VOLATILE_STATION_FIELDS
+
+    Returns:
+        dict: lists of station codes in 'add', 'remove' and 'update'
+    """
+    return({
+        'add':    [code for code in new_stations if code not in old_stations],
+        'remove': [code for code in old_stations if code not in new_stations],
+        'update': [code for code in new_stations if code in old_stations and 
+                   _without(new_stations[code], ignore_fields) != _without(old_stations[code], ignore_fields)],
+    })
+
+
+def _without(record:dict, fields)->dict:
+    return({k:v for k,v in record.items() if k not in fields})
@@ -0,0 +1,207 @@
+""" tiered_cache.py: two level cache for API results
+
+Results from the RM-API and the PWS API are kept in a small in-process LRU
+(fast, per process) in front of a shared cache, on disk by default (survives 
+restarts and is shared by every process using the same cache directory) or in
+Redis (shared by all the app's worker processes, on one or several servers).
+How long a result is kept depends on what it is, see the TTL constants and date_ttl().
+
+Configuration from environment variables:
+
+- `CACHE_BACKEND` shared tier, 'filesystem' (default) or 'redis' (needs the redis package)
+- `CACHE_REDIS_URL` Redis server for the 'redis' backend, default redis://localhost:6379/0
+- `DASH_CACHE` directory for the disk tier, same as the app's cache (see lib/__init__.py)
+- `CACHE_MEMORY_ITEMS` number of results kept in memory per cache, default 256
+- `CACHE_TTL_CLOSED_SECONDS` results for days that are over, default 30 days
+- `CACHE_TTL_RECENT_SECONDS` results for today and yesterday, default 10 minutes
+- `CACHE_TTL_LATEST_SECONDS` latest readings, default 3 minutes
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from os import getenv, path
+from time import time
+from warnings import warn
+
+from cachelib import FileSystemCache
+
+from . import CACHE_DIR, CACHE_BACKEND, CACHE_REDIS_URL
+from .converters import today_localtime
+
+CACHE_MEMORY_ITEMS:int = int(getenv('CACHE_MEMORY_ITEMS', 256))
+TTL_CLOSED:int = int(getenv('CACHE_TTL_CLOSED_SECONDS', 30*24*60*60))
+TTL_RECENT:int = int(getenv('CACHE_TTL_RECENT_SECONDS', 10*60))
+TTL_LATEST:int = int(getenv('CACHE_TTL_LATEST_SECONDS', 3*60))
+# for data that can no longer change
+TTL_FOREVER = float('inf')
+
+_caches:dict = {}
+
+
+class TieredCache:
+    """in-memory LRU in front of a shared (disk or Redis) cache, with a time-to-live 
+    per item and hit/miss counters for each tier
+
+    Example:
+        models = TieredCache('models')
+        df = models.get_or_load(url, lambda: run_model(url), ttl=date_ttl(select_date))
+    """
+
+    def __init__(self, name:str, memory_items:int = CACHE_MEMORY_ITEMS, cache_dir:str = None, disk_items:int = 5000):
+        """
+        Args:
+            name (str): name of the cache, also the sub-folder of the cache directory
+            memory_items (int, optional): max number of items kept in memory. Defaults to CACHE_MEMORY_ITEMS.
+            cache_dir (str, optional): folder for the disk tier, defaults to CACHE_DIR/name.
+            disk_items (int, optional): max number of items on disk before old ones are removed, 
+                0 for no limit.  Redis removes items by its own memory policy
+        """
+        self.name = name
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = shared_cache(name, cache_dir, disk_items)
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'sets': 0}
+        _caches[name] = self
+
+    def get(self, key:str):
+        """look up a key, first in memory then on disk
+
+        Returns:
+            tuple(bool, any): (found, value)
+        """
+        now = time()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return(True, value)
+                del self._memory[key]
+
+        item = self._disk_get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > now:
+                self._memory_set(key, value, expires_at)
+                with self._lock:
+                    self._stats['disk_hits'] += 1
+                return(True, value)
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return(False, None)
+
+    def set(self, key:str, value, ttl:int):
+        """store a value in both tiers for ttl seconds.  A ttl of 0 or less is not stored, 
+        TTL_FOREVER is kept until it is deleted or pushed out by newer items"""
+        if not ttl or ttl <= 0:
+            return
+        expires_at = time() + ttl
+        self._memory_set(key, value, expires_at)
+        try:
+            self._disk.set(key, (expires_at, value), timeout = 0 if ttl == TTL_FOREVER else int(ttl))
+        except Exception as e:
+            warn(f"could not write {key} to {self.name} cache: {e}")
+        with self._lock:
+            self._stats['sets'] += 1
+
+    def get_or_load(self, key:str, loader, ttl:int, cacheable = None):
+        """cached value for key, or call loader() and store its result
+
+        Args:
+            key (str): cache key
+            loader (callable): function with no arguments that gets the value
+            ttl (int): seconds to keep the value
+            cacheable (callable, optional): function of the value returning False for
+                results that should not be stored (e.g. empty results from an error).
+                Defaults to storing anything that is not None
+
+        Returns:
+            cached or loaded value
+        """
+        found, value = self.get(key)
+        if found:
+            return(value)
+        value = loader()
+        if (cacheable(value) if cacheable else value is not None):
+            self.set(key, value, ttl)
+        return(value)
+
+    def delete(self, key:str):
+        with self._lock:
+            self._memory.pop(key, None)
+        self._disk.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        self._disk.clear()
+
+    def stats(self)->dict:
+        with self._lock:
+            stats = dict(self._stats, memory_items=len(self._memory))
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits'])/lookups if lookups else 0.0
+        return(stats)
+
+    def _memory_set(self, key, value, expires_at):
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def _disk_get(self, key):
+        try:
+            return(self._disk.get(key))
+        except Exception as e:
+            warn(f"could not read {key} from {self.name} cache: {e}")
+            return(None)
+
+
+def shared_cache(name:str, cache_dir:str = None, disk_items:int = 5000, backend:str = CACHE_BACKEND):
+    """the cachelib cache for the shared tier of a TieredCache, by CACHE_BACKEND"""
+    if backend == 'redis':
+        # optional dependency, only needed for this backend
+        import redis
+        from cachelib import RedisCache
+        return(RedisCache(host=redis.Redis.from_url(CACHE_REDIS_URL), key_prefix=f"ewxpws:{name}:", default_timeout=0))
+    return(FileSystemCache(cache_dir or path.join(CACHE_DIR, name), threshold=disk_items))
+
+
+def as_date(d)->date:
+    """date from a date, datetime or iso string, None for anything else"""
+    if isinstance(d, datetime):
+        return(d.date())
+    if isinstance(d, date):
+        return(d)
+    if isinstance(d, str) and d:
+        try:
+            return(date.fromisoformat(d[:10]))
+        except ValueError:
+            return(None)
+    return(None)
+
+
+def date_ttl(d, today:date = None)->int:
+    """how long to keep a result that covers data up to date d
+
+    Days before yesterday are over and the data for them will not change,
+    so they are kept TTL_CLOSED. Today, yesterday (data may still be arriving),
+    future dates and missing dates are kept TTL_RECENT
+    """
+    d = as_date(d)
+    if today is None:
+        today = today_localtime()
+    if d is not None and d < today - timedelta(days=1):
+        return(TTL_CLOSED)
+    return(TTL_RECENT)
+
+
+def cache_stats()->dict:
+    """hit and miss counters of every tiered cache, keyed on cache name"""
+    return({name: cache.stats() for name, cache in _caches.items()})
@@ -0,0 +1,164 @@
+""" timeseries_viz.py: line graphs for long weather time series
+
+A season of daily values is a few hundred points, but hourly values or several
+years are tens of thousands, which is slow to send and to draw.  Above a point
+budget the series is downsampled with LTTB (largest triangle three buckets,
+which keeps the peaks and dips that matter for weather) and drawn with WebGL.
+When the user zooms in, the graph is drawn again with full detail in the
+visible range, see line_figure(x_range=...).
+
+Configuration from environment variables:
+
+- `FIGURE_POINT_BUDGET` max points drawn per series, default 2000
+"""
+
+from os import getenv
+
+import numpy as np
+import pandas as pd
+
+FIGURE_POINT_BUDGET:int = int(getenv('FIGURE_POINT_BUDGET', 2000))
+
+
+def lttb(x, y, n_out:int)->np.ndarray:
+    """indexes of the points to keep to draw a line of n_out points that looks like the
+    full series, by the Largest-Triangle-Three-Buckets algorithm (Steinarsson 2013)
+
+    Args:
+        x (array-like): numeric x values, sorted ascending
+        y (array-like): numeric y values, same length, NaN not allowed
+        n_out (int): number of points to keep, at least 3
+
+    Returns:
+        numpy.ndarray: sorted indexes into x and y, always with the first and last point
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return(np.arange(n))
+
+    # the first and last point are kept, the rest are split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=int)
+    keep[0] = 0
+    keep[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # average of the next bucket is the third point of the triangle
+        next_start, next_end = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        # point in this bucket making the largest triangle with the last kept point
+        areas = np.abs((x[a] - avg_x)*(y[start:end] - y[a]) - (x[a] - x[start:end])*(avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        keep[i + 1] = a
+
+    return(keep)
+
+
+def downsample(df:pd.DataFrame, x:str, y:str, point_budget:int = FIGURE_POINT_BUDGET, x_range = None)->pd.DataFrame:
+    """rows of df to draw y against x within the point budget
+
+    Missing y values are dropped.  With an x_range, the rows in the range get the
+    whole budget and the rows outside it a small share, so the graph's range slider
+    still shows the full series.
+
+    Args:
+        df (DataFrame): data to draw
+        x (str): column for the x axis, numbers or dates
+        y (str): column for the y axis
+        point_budget (int, optional): max number of rows. Defaults to FIGURE_POINT_BUDGET.
+        x_range (list, optional): [start, end] of the visible part of the x axis. Defaults to None.
+
+    Returns:
+        DataFrame: rows of df sorted by x
+    """
+    df = df.assign(**{y: pd.to_numeric(df[y], errors='coerce')}).dropna(subset=[y]).sort_values(x)
+    if len(df) <= point_budget:
+        return(df)
+
+    x_values = _numeric_x(df[x])
+    if not x_range:
+        return(df.iloc[lttb(x_values, df[y].to_numpy(), point_budget)])
+
+    start, end = _numeric_x(pd.Series(list(x_range)))
+    visible = (x_values >= start) & (x_values <= end)
+    outside_budget = max(3, point_budget//10)
+    parts = [df[visible].iloc[lttb(x_values[visible], df[y].to_numpy()[visible], point_budget)]]
+    for part in (~visible & (x_values < start), ~visible & (x_values > end)):
+        if part.any():
+            parts.append(df[part].iloc[lttb(x_values[part], df[y].to_numpy()[part], outside_budget)])
+    return(pd.concat(parts).sort_values(x))
+
+
+def line_figure(df:pd.DataFrame, x:str, y:str, title:str = None, y_label:str = None,
+                point_budget:int = FIGURE_POINT_BUDGET, x_range = None)->'go.Figure':
+    """line graph with a range slider that stays fast for long series
+
+    Series longer than the point budget are downsampled and drawn with WebGL
+    (Scattergl). The figure keeps the user's zoom when it is redrawn for a new x_range.
+
+    Args:
+        df (DataFrame): data to draw
+        x (str): column for the x axis
+        y (str): column for the y axis
+        title (str, optional): graph title
+        y_label (str, optional): y axis title. Defaults to the column name
+        point_budget (int, optional): max points to draw. Defaults to FIGURE_POINT_BUDGET.
+        x_range (list, optional): [start, end] of the visible x axis after zooming. Defaults to None.
+
+    Returns:
+        plotly.graph_objects.Figure
+    """
+    # plotly graph objects take a while to import, and are not needed until a graph is drawn
+    import plotly.graph_objects as go
+    full_length = len(df)
+    points = downsample(df, x, y, point_budget, x_range)
+    trace_type = go.Scattergl if full_length > point_budget else go.Scatter
+
+    fig = go.Figure(trace_type(x = points[x], y = points[y], mode = "lines", name = y_label or y))
+    fig.update_layout(
+        title = title,
+        yaxis_title = y_label or y,
+        autotypenumbers = 'convert types',
+        # keep zoom and range slider position when the figure is replaced
+        uirevision = title or y,
+        )
+    if x_range:
+        fig.update_xaxes(range = list(x_range))
+
+    fig.update_xaxes(
+        rangeslider_visible=True,
+        rangeselector=dict(
+            buttons=list([
+                dict(count=1, label="1m", step="month", stepmode="backward"),
+                dict(count=6, label="6m", step="month", stepmode="backward"),
+                dict(count=1, label="YTD", step="year", stepmode="todate"),
+                dict(step="all")
+            ])
+        )
+    )
+    return(fig)
+
+
+def relayout_x_range(relayout_data:dict):
+    """the visible x range from a dcc.Graph relayoutData, None if zoomed out to the full range,
+    or False if the relayout was not a change of the x range"""
+    if not relayout_data:
+        return(False)
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return([relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']])
+    if 'xaxis.range' in relayout_data:
+        return(list(relayout_data['xaxis.range']))
+    if relayout_data.get('xaxis.autorange'):
+        return(None)
+    return(False)
+
+
+def _numeric_x(values:pd.Series)->np.ndarray:
+    """x values as floats, dates as nanoseconds"""
+    if values.dtype.kind in 'iuf':
+        return(values.to_numpy(dtype=float))
+    return(pd.to_datetime(values).to_numpy(dtype='datetime64[ns]').astype('int64').astype(float))
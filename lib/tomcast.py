@@ -0,0 +1,158 @@
+""" tomcast.py: TOMCAST disease severity values computed from PWS hourly readings
+
+Computes the output of the RM-API 'tomcast' model (see ewx_api.tomcast) from the
+hourly readings of the PWS API, which are already cached per station and day, so
+a run for another spray date or day needs no request to the RM-API.
+
+Each day gets a disease severity value (DSV, 0 to 4) from the hours its leaves were
+wet and the mean air temperature during those hours, by the TOMCAST table (Pitblado
+1992, adapted from the FAST model of Madden et al. 1978).  DSVs are summed from the
+date of the last spray (or the start of accumulation), and the risk is from that sum.
+
+Configuration from environment variables:
+
+- `TOMCAST_ENGINE` 'rm-api' (default) to run the model on the RM-API, or 'local' to use this module
+- `TOMCAST_WET_PERCENT` an hour is wet if the leaf was wet this percent of it or more, default 50
+- `TOMCAST_MODERATE_DSV` accumulated DSV from which the risk is moderate, default 15
+- `TOMCAST_HIGH_DSV` accumulated DSV from which the risk is high, default 20
+- `TOMCAST_DEFAULT_DAYS` days to accumulate when no spray date is given, default 14
+
+See bench/validate_tomcast.py to compare the results with the RM-API.
+"""
+
+import asyncio
+from datetime import date, timedelta
+from os import getenv
+
+import numpy as np
+from pandas import DataFrame, to_numeric, date_range
+
+from . import http_client
+from .pwsapi import get_hourly_readings_async
+
+TOMCAST_ENGINE:str = getenv('TOMCAST_ENGINE', 'rm-api').lower()
+TOMCAST_WET_PERCENT:float = float(getenv('TOMCAST_WET_PERCENT', 50))
+TOMCAST_MODERATE_DSV:float = float(getenv('TOMCAST_MODERATE_DSV', 15))
+TOMCAST_HIGH_DSV:float = float(getenv('TOMCAST_HIGH_DSV', 20))
+TOMCAST_DEFAULT_DAYS:int = int(getenv('TOMCAST_DEFAULT_DAYS', 14))
+
+# mean temperature (C) during the wet hours: lower edges of the bands in DSV_WET_HOURS,
+# the last edge is the upper limit of the last band.  No DSV outside them
+DSV_TEMPERATURE_EDGES = [13, 18, 21, 26, 30]
+
+# for each temperature band, the wet hours needed for a DSV of 1, 2, 3 and 4
+DSV_WET_HOURS = np.array([
+    [7, 16, 21, np.inf],   # 13-17 C
+    [4, 9, 16, 23],        # 18-20 C
+    [3, 6, 13, 21],        # 21-25 C
+    [4, 9, 16, 23],        # 26-29 C
+])
+
+TOMCAST_COLUMNS = ['Date', 'DSV', 'SumDSV', 'Risk', 'TomcastDay']
+
+
+def disease_severity_values(wet_hours, wet_temperature)->np.ndarray:
+    """DSV (0-4) by the TOMCAST table, vectorized
+
+    Args:
+        wet_hours (array-like): hours of leaf wetness of each day
+        wet_temperature (array-like): mean air temperature (C) during the wet hours, NaN if none
+
+    Returns:
+        numpy array of int DSVs
+    """
+    wet_hours = np.asarray(wet_hours, dtype=float)
+    wet_temperature = np.asarray(wet_temperature, dtype=float)
+    band = np.digitize(wet_temperature, DSV_TEMPERATURE_EDGES) - 1
+    in_table = (band >= 0) & (band < len(DSV_WET_HOURS))
+    needed = DSV_WET_HOURS[np.clip(band, 0, len(DSV_WET_HOURS) - 1)]
+    dsv = (wet_hours[:, None] >= needed).sum(axis=1)
+    return(np.where(in_table, dsv, 0))
+
+
+def daily_wetness(hourly_readings, wet_percent:float = TOMCAST_WET_PERCENT)->DataFrame:
+    """hours of leaf wetness and their mean temperature per day
+
+    Args:
+        hourly_readings (list[dict] | DataFrame): readings from pwsapi.get_hourly_readings
+        wet_percent (float, optional): an hour is wet from this percent wet. Defaults to TOMCAST_WET_PERCENT.
+
+    Returns:
+        DataFrame with 'date' (YYYY-MM-DD), 'wet_hours', 'wet_temperature' (C) and 'DSV',
+        one row per day with readings
+    """
+    hourly = DataFrame(hourly_readings)
+    if hourly.empty or 'represented_date' not in hourly.columns:
+        return(DataFrame(columns=['date', 'wet_hours', 'wet_temperature', 'DSV']))
+
+    pwet = to_numeric(hourly.get('lws_pwet_hourly'), errors='coerce')
+    atmp = to_numeric(hourly.get('atmp_avg_hourly'), errors='coerce')
+    wet = (pwet >= wet_percent) & atmp.notna()
+    hourly = DataFrame({
+        'date': hourly['represented_date'].astype(str).str[:10],
+        'wet': wet.astype(int),
+        'wet_atmp': atmp.where(wet),
+    })
+    days = hourly.groupby('date').agg(wet_hours = ('wet', 'sum'), wet_temperature = ('wet_atmp', 'mean')).reset_index()
+    days['DSV'] = disease_severity_values(days.wet_hours, days.wet_temperature)
+    return(days)
+
+
+def tomcast_risk(sum_dsv)->np.ndarray:
+    """'low', 'moderate' or 'high' for accumulated DSVs"""
+    sum_dsv = np.asarray(sum_dsv, dtype=float)
+    return(np.select([sum_dsv >= TOMCAST_HIGH_DSV, sum_dsv >= TOMCAST_MODERATE_DSV], ['high', 'moderate'], 'low'))
+
+
+def accumulation_start(select_date, date_start_accumulation = None)->date:
+    """first day DSVs are summed from: the spray date, or TOMCAST_DEFAULT_DAYS before select_date"""
+    select_date = date.fromisoformat(str(select_date)[:10])
+    if date_start_accumulation:
+        return(min(date.fromisoformat(str(date_start_accumulation)[:10]), select_date))
+    return(select_date - timedelta(days = TOMCAST_DEFAULT_DAYS - 1))
+
+
+def tomcast_frame(hourly_readings, select_date, date_start_accumulation = None,
+                  wet_percent:float = TOMCAST_WET_PERCENT)->DataFrame:
+    """TOMCAST for each day from the start of accumulation to select_date
+
+    Args:
+        hourly_readings (list[dict] | DataFrame): readings covering those days, from pwsapi.get_hourly_readings
+        select_date (date | str): last day
+        date_start_accumulation (date | str, optional): date of the last spray.  Defaults to None,
+            which sums the last TOMCAST_DEFAULT_DAYS days
+        wet_percent (float, optional): an hour is wet from this percent wet. Defaults to TOMCAST_WET_PERCENT.
+
+    Returns:
+        DataFrame like ewx_api.tomcast: Date, DSV, SumDSV, Risk and TomcastDay (1 on the first day),
+        sorted by Date descending.  Days without readings have a DSV of 0
+    """
+    start = accumulation_start(select_date, date_start_accumulation)
+    days = [str(d) for d in date_range(str(start), str(select_date)[:10]).date]
+    wetness = daily_wetness(hourly_readings, wet_percent).set_index('date')
+
+    dsv = wetness['DSV'].reindex(days, fill_value = 0).to_numpy(dtype=int)
+    sum_dsv = np.cumsum(dsv)
+    tomcast_df = DataFrame({
+        'Date': days,
+        'DSV': dsv,
+        'SumDSV': sum_dsv,
+        'Risk': tomcast_risk(sum_dsv),
+        'TomcastDay': np.arange(1, len(days) + 1),
+    })
+    return(tomcast_df.sort_values(by='Date', ascending=False, ignore_index=True))
+
+
+def tomcast_local(station_code:str, select_date, date_start_accumulation = None)->DataFrame:
+    """TOMCAST for a station from its hourly readings, like ewx_api.tomcast"""
+    return(http_client.run_sync(tomcast_local_async(station_code, select_date, date_start_accumulation)))
+
+
+async def tomcast_local_async(station_code:str, select_date, date_start_accumulation = None)->DataFrame:
+    """async version of tomcast_local"""
+    start = accumulation_start(select_date, date_start_accumulation)
+    readings = await get_hourly_readings_async(station_code, start_date = str(start), end_date = str(select_date)[:10])
+    if readings == [{}]:
+        return(DataFrame([{}]))
+    # the days are summed in a worker thread, so other calls on this event loop go on meanwhile
+    return(await asyncio.to_thread(tomcast_frame, readings, select_date, date_start_accumulation))
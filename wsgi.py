@@ -0,0 +1,15 @@
+""" wsgi.py: entry point for production WSGI servers
+
+    gunicorn -c gunicorn.conf.py wsgi:server
+
+app.py is imported once (preload_app in gunicorn.conf.py), the station list is
+loaded here once before the worker processes are forked, and each worker starts
+its background threads after the fork (see post_fork in gunicorn.conf.py).
+"""
+
+from app import app, station_registry
+
+server = app.server
+
+# from the snapshot if there is one, otherwise from the API, once for all workers
+station_registry.ensure_loaded()